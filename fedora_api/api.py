@@ -1,30 +1,91 @@
 import requests
+from requests.adapters import HTTPAdapter
+from requests.cookies import RequestsCookieJar
 from lxml import etree
+import cookielib
+import threading
 import os
 
+# Pooled keep-alive sessions, shared by FedoraApi instances in a process with the same url, user and pool settings.
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+# Datatypes Fedora accepts for literal relationships.
+VALID_DATATYPE_URIS = [
+    "http://www.w3.org/2001/XMLSchema#int",
+    "http://www.w3.org/2001/XMLSchema#double",
+    "http://www.w3.org/2001/XMLSchema#float",
+    "http://www.w3.org/2001/XMLSchema#dateTime",
+    "http://www.w3.org/2001/XMLSchema#long",
+]
+
+
+def validate_datatype(datatype, valid_datatype_uris=VALID_DATATYPE_URIS):
+    """Return full datatype uri for a short (e.g. "int") or full datatype name, or None if not allowed."""
+    dt = [d for d in valid_datatype_uris if datatype == d or datatype == d.split("#")[1]]
+    if dt:
+        return dt[0]
+    return None
+
+
+def get_session(base_url=None, username=None, pool_connections=10, pool_maxsize=10, pool_block=False, max_retries=0):
+    """Return a shared requests session with a keep-alive connection pool.
+
+    Sessions are keyed by base url and user, so different credentials never share a session, and by
+    process id as well as pool settings so that forked workers never share sockets with their parent.
+    The session's cookie jar accepts no cookies, as callers in other threads share it; FedoraApi keeps
+    cookies per instance.
+
+    kwargs:
+        base_url(str): server the session is used for.
+        username(str): user the session's requests are authenticated as.
+        pool_connections(int): number of per-host connection pools to keep.
+        pool_maxsize(int): maximum number of connections kept alive for each host.
+        pool_block(bool): if True, wait for a free connection rather than opening more than pool_maxsize.
+        max_retries(int): number of retries for failed connections (not for failed requests).
+    """
+    key = (os.getpid(), base_url, username, pool_connections, pool_maxsize, pool_block, max_retries)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            session.cookies.set_policy(cookielib.DefaultCookiePolicy(allowed_domains=[]))
+            adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                                  pool_block=pool_block, max_retries=max_retries)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[key] = session
+    return session
+
+
 class FedoraApi():
 
     """Class for interacting with the fedora API."""
 
-    def __init__(self, base_url="http://localhost:8080/fedora", username=None, password=None):
-        """Initialize API by testing connection."""
+    def __init__(self, base_url="http://localhost:8080/fedora", username=None, password=None,
+                 pool_connections=10, pool_maxsize=10, pool_block=False, max_retries=0, timeout=(10, 300)):
+        """Initialize API by testing connection.
+
+        kwargs:
+            pool_connections, pool_maxsize, pool_block, max_retries: connection pool settings, see get_session.
+            timeout(tuple): (connect, read) timeouts in seconds; None waits indefinitely.
+        """
         self.base_url = base_url
         self.url = base_url
         self.method = "GET"
         self.auth = None
         self.file = None
+        self.timeout = timeout
+        self.session = get_session(base_url=base_url, username=username, pool_connections=pool_connections,
+                                   pool_maxsize=pool_maxsize, pool_block=pool_block, max_retries=max_retries)
+        # Cookies set by the server for this instance only.
+        self.cookies = RequestsCookieJar()
         if username and password:
             self.auth = (username, password)
         self.static_params = {"resultFormat": "xml"}
         self.dynamic_params = {}
 
-        self.valid_datatype_uris = [
-            "http://www.w3.org/2001/XMLSchema#int",
-            "http://www.w3.org/2001/XMLSchema#double",
-            "http://www.w3.org/2001/XMLSchema#float",
-            "http://www.w3.org/2001/XMLSchema#dateTime",
-            "http://www.w3.org/2001/XMLSchema#long",
-        ]
+        self.valid_datatype_uris = list(VALID_DATATYPE_URIS)
 
     def set_static_param(self, field, value):
         self.static_params[field] = value 
@@ -43,11 +104,16 @@ class FedoraApi():
         params.update(self.dynamic_params)
 
         try:
-            req = requests.request(self.method, self.url, params=params, auth=self.auth, files=self.file)
+            req = self.session.request(self.method, self.url, params=params, auth=self.auth, files=self.file,
+                                       timeout=self.timeout, cookies=self.cookies)
+            self.cookies.update(req.cookies)
             res = (req.status_code, req.content)
         except Exception as e:
             res = (-1, e)
         self.dynamic_params = {}
+        # Reset per-call state so a shared instance doesn't resend a file or reuse the last method.
+        self.method = "GET"
+        self.file = None
  
         return res
 
@@ -210,9 +276,11 @@ class FedoraApi():
         self.file = {'file': file_object}
         return self.call_api()
 
-    def modify_datastream(self, pid, ds_id, filepath=None, **kwargs):
+    def modify_datastream(self, pid, ds_id, filepath=None, file_object=None, **kwargs):
         """Modify datastream of specified object.
 
+        New content may be given either as a path (filepath) or an open file-like object (file_object).
+
         Allowed kwargs:
         [controlGroup] [dsLocation] [altIDs] [dsLabel] [versionable] [dsState] [formatURI] [checksumType] [checksum]
         [mimeType] [logMessage]
@@ -221,7 +289,10 @@ class FedoraApi():
         self.set_url("objects/{0}/datastreams/{1}".format(pid, ds_id))
         for f, v in kwargs.items():
             self.set_dynamic_param(f, v)
-        if filepath:
+        if file_object is not None:
+            self.file = {'file': file_object}
+            res = self.call_api()
+        elif filepath:
             with open(filepath, 'rb') as f:
                 self.file = {'file': f}
                 res = self.call_api()
@@ -278,11 +349,13 @@ class FedoraApi():
             self.set_dynamic_param("predicate", predicate)
         return self.call_api()
 
-    def get_next_pid(self, namespace):
-        """Get next available pid from within given namespace."""
+    def get_next_pid(self, namespace, numPIDs=1):
+        """Get next available pid(s) from within given namespace."""
         self.set_method("POST")
         self.set_url("objects/nextPID")
         self.set_dynamic_param("namespace", namespace)
+        if numPIDs > 1:
+            self.set_dynamic_param("numPIDs", numPIDs)
         self.set_dynamic_param("format", "xml")
         return self.call_api()
 
@@ -299,10 +372,6 @@ class FedoraApi():
         return self.call_api()
 
     def validate_datatype(self, datatype):
-
-        dt = [d for d in self.valid_datatype_uris if datatype == d or datatype == d.split("#")[1]] 
-        if dt:
-            return dt[0]
-        return None
+        return validate_datatype(datatype, self.valid_datatype_uris)
 
 
@@ -0,0 +1,35 @@
+"""Local stand-in Fedora server for tests and benchmarks of FedoraApi sessions."""
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+
+class CookieHandler(BaseHTTPRequestHandler):
+
+    """Sets a cookie naming the requesting user, and echoes the cookies it was sent."""
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Set-Cookie", "session={0}; Path=/".format(self.headers.getheader("Authorization")[6:]))
+        body = self.headers.getheader("Cookie") or ""
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class KeepAliveHandler(CookieHandler):
+
+    """CookieHandler keeping connections open, as Fedora does."""
+
+    protocol_version = "HTTP/1.1"
+    # Headers are written a line at a time; don't let Nagle's algorithm hold them back on a reused connection.
+    disable_nagle_algorithm = True
+
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+
+    """Serves each connection in its own thread, so connections left open by one client don't block others."""
+
+    daemon_threads = True
@@ -1,48 +1,249 @@
-import subprocess
+import errno
+import os
+import select
 import shlex
+import signal
+import subprocess
+import time
+
+# Bytes of stdout and of stderr kept from each command; earlier output is dropped.
+CAPTURE_LIMIT = 64 * 1024
+
+# Seconds between checks for exited commands once their output is closed.
+POLL_INTERVAL = 0.05
+
+# Process groups of commands currently running, so they can be killed if the caller is stopped.
+running = set()
+
+
+def kill_running():
+    """Kill every running command, with any processes it started."""
+    for pgid in list(running):
+        try:
+            os.killpg(pgid, signal.SIGKILL)
+        except OSError:
+            pass
+    running.clear()
+
+
+class TailBuffer(object):
+    """Keep the last `limit` bytes written."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.data = b''
+
+    def write(self, data):
+        self.data = (self.data + data)[-self.limit:] if self.limit else b''
+
+    def getvalue(self):
+        return self.data
+
+
+class Stage(object):
+    """A running command of a chain."""
+
+    def __init__(self, command, timeout):
+        self.command = command
+        self.timeout = timeout
+        self.proc = None
+        self.started = None
+        self.deadline = None
+        self.exit_code = None
+        self.timed_out = False
+        self.usage = None
+
+    def start(self, stdin, stdout):
+        self.started = time.time()
+        self.deadline = self.started + self.timeout if self.timeout is not None else None
+        # Each command leads its own process group, so a timeout kills whatever it started too.
+        self.proc = subprocess.Popen(shlex.split(self.command), stdin=stdin, stdout=stdout,
+                                     stderr=subprocess.PIPE, close_fds=True, preexec_fn=os.setpgrp)
+        running.add(self.proc.pid)
+
+    def kill(self):
+        if self.exit_code is None:
+            self.timed_out = True
+            try:
+                os.killpg(self.proc.pid, signal.SIGKILL)
+            except OSError:
+                pass
+
+    def reap(self, block=False):
+        """Collect exit status and resource usage if the command has exited; return True if it has."""
+        if self.exit_code is not None:
+            return True
+        try:
+            pid, status, rusage = os.wait4(self.proc.pid, 0 if block else os.WNOHANG)
+        except OSError as e:
+            if e.errno == errno.EINTR:
+                return False
+            raise
+        if pid == 0:
+            return False
+        self.exit_code = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+        self.proc.returncode = self.exit_code
+        self.usage = {
+            "command": self.command,
+            "exit_code": self.exit_code,
+            "timed_out": self.timed_out,
+            "wall": time.time() - self.started,
+            "cpu": rusage.ru_utime + rusage.ru_stime,
+            # Kilobytes on Linux.
+            "max_rss": rusage.ru_maxrss,
+        }
+        running.discard(self.proc.pid)
+        return True
+
 
 class PChain(object):
+    """Run commands joined by AND, OR or PIPE, like a shell.
+
+    Commands joined by PIPE run together, each reading the output of the one before. The last output and
+    error of each run are kept up to `capture_limit` bytes. A command past its own timeout, or any running
+    when the chain's timeout passes, is killed with its process group and fails. Resource usage of each
+    command is available from usage() after run().
+    """
     AND = 0
     OR = 1
     PIPE = 2
 
-    def __init__(self):
+    def __init__(self, timeout=None, capture_limit=CAPTURE_LIMIT):
         self.procs = []
+        self.timeout = timeout
+        self.capture_limit = capture_limit
+        self.deadline = None
         self.s_out = ''
         self.s_err = ''
+        self.stages = []
 
-    def add(self, command, join=None):
+    def add(self, command, join=None, timeout=None):
         if (join is None):
             join = self.AND
-        self.procs.append([command,join])
+        self.procs.append([command, join, timeout])
 
     def run(self):
         exit_code = None
-        plist = []
-        s_in = None
-
-        for p in self.procs:
-            cmd, join = p
-            p_err = subprocess.PIPE
-            if (join == self.PIPE):
-                p_err = subprocess.STDOUT
-            try:
-                proc = subprocess.Popen( shlex.split(cmd), stdout=subprocess.PIPE, stderr=p_err, stdin=s_in )
-                plist.append( proc )
-            except:
-                exit_code = 1
+        self.stages = []
+        self.deadline = time.time() + self.timeout if self.timeout is not None else None
+
+        i = 0
+        while i < len(self.procs):
+            # A PIPE join runs the command together with the next one.
+            j = i
+            while j < len(self.procs) - 1 and self.procs[j][1] == self.PIPE:
+                j += 1
+            join = self.procs[j][1]
+            exit_code = self.run_pipeline(self.procs[i:j + 1])
+            i = j + 1
+
+            if (join == self.OR and exit_code == 0) or (join == self.AND and exit_code != 0):
                 break
 
-            if join == self.PIPE:
-                s_in = proc.stdout
-            else:
-                self.s_out, self.s_err = proc.communicate()
-                exit_code = proc.returncode
+        return exit_code
 
-                if (join == self.OR and exit_code == 0) or (join == self.AND and exit_code != 0):
+    def run_pipeline(self, commands):
+        """Run commands with each one's output piped to the next; return the exit code of the last."""
+        out = TailBuffer(self.capture_limit)
+        err = TailBuffer(self.capture_limit)
+        stages = []
+        readers = {}
+        stdin = None
+        try:
+            for n, (cmd, join, timeout) in enumerate(commands):
+                stage = Stage(cmd, timeout)
+                try:
+                    stage.start(stdin, subprocess.PIPE)
+                except (OSError, ValueError) as e:
+                    err.write("Could not run {0}: {1}\n".format(cmd, e).encode("utf-8"))
                     break
+                finally:
+                    # The next command holds the only read end, so earlier commands see it close.
+                    if stdin is not None:
+                        stdin.close()
+                        stdin = None
+                stages.append(stage)
+                readers[stage.proc.stderr.fileno()] = (stage.proc.stderr, err)
+                if n == len(commands) - 1:
+                    readers[stage.proc.stdout.fileno()] = (stage.proc.stdout, out)
+                else:
+                    stdin = stage.proc.stdout
+            if stdin is not None:
+                stdin.close()
 
-        return exit_code
+            self.wait(stages, readers)
+        except BaseException:
+            for stage in stages:
+                stage.kill()
+                stage.reap(block=True)
+            raise
+        finally:
+            for f, buf in readers.values():
+                f.close()
+
+        for stage in stages:
+            if stage.timed_out:
+                err.write("Timed out after {0:.1f} seconds: {1}\n".format(time.time() - stage.started, stage.command).encode("utf-8"))
+            self.stages.append(stage.usage)
+        self.s_out = out.getvalue()
+        self.s_err = err.getvalue()
+
+        if len(stages) < len(commands):
+            return 1
+        if any(stage.timed_out for stage in stages):
+            return stages[-1].exit_code or 1
+        return stages[-1].exit_code
+
+    def wait(self, stages, readers):
+        """Read output and reap commands until all have exited, killing those past their deadlines."""
+        while True:
+            for stage in stages:
+                stage.reap()
+            live = [s for s in stages if s.exit_code is None]
+            if not live:
+                break
+
+            now = time.time()
+            for stage in live:
+                if (stage.deadline is not None and stage.deadline <= now) or (self.deadline is not None and self.deadline <= now):
+                    stage.kill()
+            deadlines = [s.deadline for s in live if s.deadline is not None and not s.timed_out]
+            if self.deadline is not None:
+                deadlines.append(self.deadline)
+            wait = max(0, min(deadlines) - now) if deadlines else None
+            if not readers or any(s.timed_out for s in live):
+                wait = POLL_INTERVAL if wait is None else min(wait, POLL_INTERVAL)
+            elif wait is None or wait > 1:
+                # Wake to reap commands that exit while another keeps its output open.
+                wait = 1
+            self.read(readers, wait)
+
+        # Output still buffered in the pipes once every command has exited; processes the commands left
+        # running may hold the pipes open, so stop when nothing is waiting.
+        drain_until = time.time() + 1
+        while readers and self.read(readers, 0) and time.time() < drain_until:
+            pass
+
+    def read(self, readers, wait):
+        """Read what is available from readers within wait seconds; return True if anything was read."""
+        if not readers:
+            time.sleep(wait)
+            return False
+        try:
+            ready = select.select(list(readers), [], [], wait)[0]
+        except select.error as e:
+            if e.args[0] == errno.EINTR:
+                return False
+            raise
+        for fd in ready:
+            f, buf = readers[fd]
+            data = os.read(fd, 65536)
+            if data:
+                buf.write(data)
+            else:
+                f.close()
+                del readers[fd]
+        return bool(ready)
 
     def stdout(self):
         return self.s_out
@@ -50,3 +251,14 @@ class PChain(object):
     def stderr(self):
         return self.s_err
 
+    def usage(self):
+        """Return exit code, timed_out, wall and cpu seconds, and max_rss (KB) of each command run."""
+        return self.stages
+
+    def cpu_time(self):
+        """Return CPU seconds used by all commands run."""
+        return sum(s["cpu"] for s in self.stages)
+
+    def max_rss(self):
+        """Return the largest resident set size, in KB, of the commands run."""
+        return max([s["max_rss"] for s in self.stages] or [0])
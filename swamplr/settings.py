@@ -23,6 +23,21 @@ def load_configs(path_to_configs):
     configs.readfp(open(path_to_configs))
     return configs
 
+def get_config(section, option, default=None):
+    """Return optional config value, or default if it is not set in swamplr.cfg."""
+    if configs.has_option(section, option):
+        return configs.get(section, option)
+    return default
+
+def get_type_config(section, option):
+    """Parse optional "job_type:number, ..." config value into dict of job type label: int."""
+    values = {}
+    for pair in get_config(section, option, "").split(","):
+        if pair.strip():
+            label, value = pair.rsplit(":", 1)
+            values[label.strip()] = int(value)
+    return values
+
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(__file__))
 
@@ -38,6 +53,63 @@ configs = load_configs(SECURE_SETTINGS)
 # Max number of threads
 MAX_THREADS = int(configs.get("processing","MAX_THREADS"))
 
+# Seconds a derivative's commands may run before they are killed and the derivative marked failed.
+DERIVATIVE_TIMEOUT = float(get_config("processing", "DERIVATIVE_TIMEOUT", 120))
+
+# Resources derivative workers may use at once, against the cost classes in derive.cfg: cores (0 for all of
+# them), megabytes of memory to leave free, and total I/O weight (0 for no limit).
+DERIVATIVE_CPUS = float(get_config("processing", "DERIVATIVE_CPUS", 0))
+DERIVATIVE_MEMORY_RESERVE = float(get_config("processing", "DERIVATIVE_MEMORY_RESERVE", 1024))
+DERIVATIVE_IO_CAPACITY = float(get_config("processing", "DERIVATIVE_IO_CAPACITY", 0))
+
+# If true, derivatives jobs queue their tasks for derivative workers (manage.py run_derivative_worker) on any
+# host, rather than running them in the job's process; a task is failed after DERIVATIVE_TASK_ATTEMPTS workers
+# stop responding while running it.
+DERIVATIVE_DISTRIBUTED = get_config("processing", "DERIVATIVE_DISTRIBUTED", "False").lower() == "true"
+DERIVATIVE_TASK_ATTEMPTS = int(get_config("processing", "DERIVATIVE_TASK_ATTEMPTS", 3))
+
+# Directory for intermediate files shared by derivatives of a source file; the system temp directory if empty.
+DERIVATIVE_SCRATCH_DIR = get_config("processing", "DERIVATIVE_SCRATCH_DIR", "")
+
+# Job worker (manage.py run_worker): jobs run at once, and seconds between queue polls,
+# heartbeats of running jobs, and runs of app pre_process functions.
+WORKER_CONCURRENCY = int(get_config("processing", "WORKER_CONCURRENCY", 1))
+WORKER_POLL_INTERVAL = float(get_config("processing", "WORKER_POLL_INTERVAL", 5))
+WORKER_HEARTBEAT_INTERVAL = float(get_config("processing", "WORKER_HEARTBEAT_INTERVAL", 30))
+PRE_PROCESS_INTERVAL = float(get_config("processing", "PRE_PROCESS_INTERVAL", 60))
+# Seconds without a heartbeat after which a running job is returned to the queue.
+JOB_LEASE_TIMEOUT = float(get_config("processing", "JOB_LEASE_TIMEOUT", 300))
+
+# Scheduling of queued jobs: default priority per job type (higher runs first), maximum running
+# jobs per job type, and seconds a job waits in the queue to gain one priority point.
+JOB_TYPE_PRIORITY = get_type_config("processing", "JOB_TYPE_PRIORITY")
+JOB_TYPE_MAX_RUNNING = get_type_config("processing", "JOB_TYPE_MAX_RUNNING")
+JOB_AGING_INTERVAL = float(get_config("processing", "JOB_AGING_INTERVAL", 600))
+
+# Seconds between checks of whether a running job has been stopped by the user.
+CANCEL_CHECK_INTERVAL = float(get_config("processing", "CANCEL_CHECK_INTERVAL", 5))
+
+# Number of top-level objects ingested at once; 1 processes objects one at a time.
+INGEST_THREADS = int(get_config("processing", "INGEST_THREADS", 1))
+
+# Ingest results are written in batches of this many rows, or with the next result once this many seconds
+# have passed since the last write.
+RESULT_BATCH_SIZE = int(get_config("processing", "RESULT_BATCH_SIZE", 500))
+RESULT_FLUSH_INTERVAL = float(get_config("processing", "RESULT_FLUSH_INTERVAL", 10))
+
+# Seconds before a cached hint file is checked for changes during an ingest job.
+HINT_CHECK_INTERVAL = float(get_config("processing", "HINT_CHECK_INTERVAL", 60))
+
+# Directory in which to save the manifest of each ingest job's source files; not saved if empty.
+INGEST_MANIFEST_DIR = get_config("processing", "INGEST_MANIFEST_DIR", "")
+
+# Number of new PIDs reserved from Fedora per request during ingest.
+PID_BLOCK_SIZE = int(get_config("processing", "PID_BLOCK_SIZE", 50))
+
+# Directory for archived job results, and days after completion before results of removed jobs are archived.
+RESULTS_ARCHIVE_DIR = get_config("processing", "RESULTS_ARCHIVE_DIR") or os.path.join(BASE_DIR, "archive")
+RESULTS_RETENTION_DAYS = int(get_config("processing", "RESULTS_RETENTION_DAYS", 90))
+
 # SECURITY WARNING: keep the secret key used in production secret!
 SECRET_KEY = configs.get("secretkey", "SECRET_KEY")
 
@@ -65,6 +137,15 @@ FEDORA_URL = configs.get("fedora", "FEDORA_URL")
 FEDORA_USER = configs.get("fedora", "FEDORA_USER")
 FEDORA_PASSWORD = configs.get("fedora", "FEDORA_PASSWORD")
 
+# Keep-alive connection pool and (connect, read) timeouts for Fedora API calls.
+FEDORA_SESSION = {
+    "pool_connections": int(get_config("fedora", "FEDORA_POOL_CONNECTIONS", 10)),
+    "pool_maxsize": int(get_config("fedora", "FEDORA_POOL_MAXSIZE", 10)),
+    "pool_block": get_config("fedora", "FEDORA_POOL_BLOCK", "False").lower() == "true",
+    "timeout": (float(get_config("fedora", "FEDORA_CONNECT_TIMEOUT", 10)),
+                float(get_config("fedora", "FEDORA_READ_TIMEOUT", 300))),
+}
+
 # Gsearch server info and credentials
 GSEARCH_USER = configs.get("gsearch", "GSEARCH_USER")
 GSEARCH_PASSWORD = configs.get("gsearch", "GSEARCH_PASSWORD")
@@ -25,6 +25,8 @@ urlpatterns = [
     url(r'^remove/(?P<job_id>[0-9]+)/$', views.remove_job, name='remove_job'),
     url(r'^stop/(?P<job_id>[0-9]+)/$', views.stop_job, name='stop_job'),
     url(r'^job/(?P<job_id>[0-9]+)/$', views.view_job, name='view_job'),
+    url(r'^job/(?P<job_id>[0-9]+)/objects/$', views.job_objects, name='job_objects'),
+    url(r'^job/(?P<job_id>[0-9]+)/export/$', views.export_job, name='export_job'),
 ]
 
 if 'swamplr_services' in settings.INSTALLED_APPS:
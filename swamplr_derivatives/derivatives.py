@@ -1,17 +1,28 @@
 from django.conf import settings
-from time import sleep
-from multiprocessing import Process, Value
-import multiprocessing
 import logging
 import os
-from swamplr_jobs.models import job_messages, status, jobs
+from swamplr_jobs.models import job_messages, status
+from swamplr_jobs.cancellation import CancellationToken
+from swamplr_jobs.counters import increment_counts
 from proclr import PChain
 from django.utils import timezone
 from models import derivative_files, derivative_results, job_derivatives
+from pool import WorkerPool
+from resources import ResourceBudget, group_cost
+from plan import derivative_groups
+from engines import engine_available, run_engine
+from manifest import MANIFEST_BATCH_SIZE, command_hash, file_checksum, is_up_to_date, load_manifest, manifest_changed, save_manifest, source_state
+from discovery import SourceScanner, source_filter
+import resource
+import shutil
 import subprocess
+import tempfile
 from pwd import getpwnam
 import getpass
-from django import db
+from django.db import transaction
+
+# Seconds a task may run beyond its derivatives' timeouts, for the worker to report commands it killed.
+TASK_TIMEOUT_GRACE = 10
 
 
 class Derivatives(object):
@@ -39,10 +50,13 @@ class Derivatives(object):
         # Get the types specified in the job
         derivative_job_types = job_derivatives.objects.filter(derive_id = self.derivative_job)
         types = [d.derive_type for d in derivative_job_types]
-        output_endings = [d["output_file"].replace("{0}","") for d in self.derivative_types]
+        output_endings = [d["output_file"].replace("{0}","") for d in self.derivative_types if not d.get("intermediate")]
 
-        # filter the config settings based on only the selected derivatives for this job
-        self.derivative_types = [d for d in self.derivative_types if d['derivative_type'] in types]
+        # filter the config settings based on only the selected derivatives for this job, and plan the
+        # groups of derivatives made from one another that run together for each file
+        self.definitions = dict((d["derivative_type"], d) for d in self.derivative_types)
+        self.derivative_types = [d for d in self.derivative_types if d['derivative_type'] in types and not d.get("intermediate")]
+        groups = derivative_groups([d["derivative_type"] for d in self.derivative_types], self.definitions)
 
         # get the job_derivative objects for each of the types
         derive_objs = {}
@@ -68,217 +82,314 @@ class Derivatives(object):
             raise 
 
 
-        processes = []
-        thread_index = 0
         files_processed = 0
-        thread_count = Value('i',0)
-        # walk the directory starting at the source_dir
-        for root, dirs, files in os.walk(self.derivative_job.source_dir):
-            for f in files:
-                # Check if the job has been stopped (i.e. cancelled by the user)
-                failure_status = jobs.objects.get(job_id=self.derivative_job.job_id.job_id).status_id.failure 
-                if failure_status == "manual":
-                    break
-
-                f = f.replace('.'+self.derivative_job.source_file_extension.upper(),'.'+self.derivative_job.source_file_extension.lower())
-                ## determine if file matches the source_ext, skip if not
-                if f.endswith('.'+self.derivative_job.source_file_extension.lower()):
+        cancel_token = CancellationToken(self.derivative_job.job_id.job_id)
+        if settings.DERIVATIVE_DISTRIBUTED:
+            # Derivative workers, on this or other hosts, make the derivatives (see task_queue.py).
+            from task_queue import TaskQueue
+            pool = TaskQueue(self, cancel_token)
+        else:
+            # MAX_THREADS caps the workers; how many run at once depends on the cost of their derivatives.
+            budget = ResourceBudget(settings.DERIVATIVE_CPUS or None, settings.DERIVATIVE_MEMORY_RESERVE, settings.DERIVATIVE_IO_CAPACITY or None)
+            pool = WorkerPool(make_derivatives, settings.MAX_THREADS, self.record_result, timeout=settings.DERIVATIVE_TIMEOUT, budget=budget)
+        self.derive_objs = derive_objs
+        self.status_objs = status_objs
+        self.incremental = self.derivative_job.incremental == "y"
+        self.brightness = self.derivative_job.brightness if self.derivative_job.brightness is not None else 0
+        self.contrast = self.derivative_job.contrast if self.derivative_job.contrast is not None else 0
+        self.command_hashes = dict((name, command_hash(name, self.definitions, self.brightness, self.contrast)) for name in derive_objs)
+        self.manifest = {}
+        # find source files in the background, starting derivatives of each as it is found
+        scanner = SourceScanner(self.derivative_job.source_dir, source_filter(self.derivative_job.source_file_extension, output_endings))
+        scanner.start()
+        try:
+            # while the scan is slow, keep collecting results and starting queued tasks
+            for batch in scanner.batches(MANIFEST_BATCH_SIZE, lambda: self.poll(pool, cancel_token)):
+                scanner.log_errors()
+                if self.incremental:
+                    # what the existing derivatives of these files were made from
+                    self.manifest = load_manifest(batch, derive_objs.keys())
+                for source_file in batch:
+                    # Check if the job has been stopped (i.e. cancelled by the user)
+                    if cancel_token.is_cancelled():
+                        break
 
-                    ## if the file matches the output file format, skips since this file is a derivative
-                    source_file = os.path.join(root, f)
-                    if f.endswith(tuple(output_endings)):
-                        #logging.debug("Not processing {0}, since this file is a derivative.".format(source_file))
-                        continue
                     ## check if over the subset count; if so, break
                     if self.derivative_job.subset is not None and self.derivative_job.subset > 0 and files_processed >= self.derivative_job.subset:
                         logging.debug("Reached subset count ({0}), stopping processing.".format(files_processed))
                         break
 
-                    ## loop over each derivative type to be created for each object
-                    for derivative in self.derivative_types:
-                        # Check if the job has been stopped (i.e. cancelled by the user)
-                        failure_status = jobs.objects.get(job_id=self.derivative_job.job_id.job_id).status_id.failure 
-                        if failure_status == "manual":
-                            job_messages.objects.create(
-                                job_id=derivative_job.job_id,
-                                created=timezone.now(),
-                                message="Job manually stopped by user."
-                            )
-                            status_id = status.objects.get(status="Cancelled By User").status_id
-                            logging.debug("Derivative job manually cancelled by user")
-                            break
-
-                        thread_index += 1
-                        ### if we are over the max thread count, wait until one frees up
-                        if thread_count.value >= settings.MAX_THREADS:
-                            while thread_count.value >= settings.MAX_THREADS:
-                                logging.debug("{0} threads running, waiting before continuing processing".format(thread_count.value))
-                                sleep(3)
-
-                        ### get the derive object
-                        try:
-                            derive_obj = derive_objs[derivative["derivative_type"]]
-                        except Exception as e:
-                            logging.error("Could not find job_derivatives object for {0}, {1}.".format(self.derivative_job.derive_id,derivative["derivative_type"]))
+                    ## loop over each group of derivatives to be created for each object
+                    for group in groups:
+                        group = [(name, save) for name, save in group if not save or name in derive_objs]
+                        if not any(save for name, save in group):
                             continue
 
-                        ### create a process for create_derivative for the object and derivative type
-                        p = multiprocessing.Process(target=self.create_derivative, args=(self.derivative_job,derive_obj, source_file, derivative, status_objs, thread_count, thread_index))
-                        processes.append(p)
-                        
-                        ### update the number of running threads
-                        thread_count.acquire()
-                        thread_count.value +=1
-                        logging.debug("Kicking off thread: {0}".format(thread_count.value))
-                        thread_count.release()
-
-                        ### start the process
-                        db.connections.close_all()
-                        p.start()
+                        ### queue the derivatives; waits here while all workers are busy
+                        pool.submit(self.derivative_task(source_file, group), timeout=self.task_timeout(group),
+                                    cost=group_cost([self.definitions[name].get("cost") for name, save in group]))
 
                     ## increment number of files processed
                     files_processed += 1
-            
-            # Check if the job has been stopped (i.e. cancelled by the user)
-            failure_status = jobs.objects.get(job_id=self.derivative_job.job_id.job_id).status_id.failure 
-            if failure_status == "manual":
-                break
-            ## check if over the subset count; if so, break
-            if self.derivative_job.subset is not None and self.derivative_job.subset > 0 and files_processed >= self.derivative_job.subset:
-                break
-
-
-        # re-join all the threads to wait until they are complete
-        logging.debug("All derivatives queued, waiting for them to finish")
-        for p in processes:
-            p.join(timeout=120) # TODO move to config?
-            # check if process is still running (i.e. it hung and timed out)
-            if p.is_alive():
-                logging.debug("Thread {0} still alive after timeout limit, terminating.".format(thread_index))
-                p.terminate()
-                p.join(timeout=2)
-                # check if process is still running after being terminated
-                if p.is_alive():
-                    logging.error("Thread {0} still alive after terminate.".format(thread_index))
 
-        if status_id is None:
-            status_id = status.objects.get(status="Complete").status_id
-        return status_id
-
-
-    def create_derivative(self, derivative_job, derive_obj, source_file, derivative_options, status_objs, thread_count, thread_index):
-        """Create a derivative for the given object using the command information provided
-        args:
-            derivative_job (object): the derivative job
-            derive_obj (object): the job derivatives object
-            source_file (string): file to use as the input to the derivative command
-            derivative_options (dict): settings for the command
-            status_objs (dict): the 3 result status objects (success, failure, skipped)
-            thread_count (Syncronized Value): number of threads running
-            thread_index(int): increment threads opened during the course of the current job.
-        """
-        try:
-            # make sure the source_file exists
-            if not os.path.isfile(source_file):
-                message = "Source file no longer exists on the filesystem. Can not process. {0}".format(source_file)
-                logging.error(message)
+                # Check if the job has been stopped (i.e. cancelled by the user)
+                if cancel_token.is_cancelled():
+                    break
+                ## check if over the subset count; if so, break
+                if self.derivative_job.subset is not None and self.derivative_job.subset > 0 and files_processed >= self.derivative_job.subset:
+                    break
+            scanner.stop()
+            scanner.log_errors()
+
+            if not cancel_token.is_cancelled():
+                # wait until the queued derivatives are complete
+                logging.debug("All derivatives queued, waiting for them to finish")
+                pool.join()
+            if cancel_token.is_cancelled():
                 job_messages.objects.create(
                     job_id=derivative_job.job_id,
                     created=timezone.now(),
-                    message= message,
+                    message="Job manually stopped by user."
                 )
+                status_id = status.objects.get(status="Cancelled By User").status_id
+                logging.debug("Derivative job manually cancelled by user")
+                pool.terminate()
+        except:
+            scanner.stop()
+            pool.terminate()
+            raise
 
-            # determine the target file
-            ext = "." + source_file.split(".")[-1]
-            target_file = derivative_options["output_file"].format(source_file.replace(ext,""))
-
-            # check if the target_file exists, skip if replace = false
-            ext = "." + source_file.split(".")[-1]
-            if os.path.isfile(target_file) and not derivative_job.replace_on_duplicate:
-                logging.info("(THREAD={0}) Skipping {1} derivative for {2}".format(thread_index, derive_obj.derive_type, source_file))
-                # mark as skipped in objects table then end the thread
-                #result_object = derivative_results.objects.get(label="Skipped")
-                derivative_files.objects.create(
-                    job_derive_id=derive_obj,
-                    created=timezone.now(),
-                    source_file=source_file,
-                    target_file=target_file,
-                    result_id=status_objs['skipped'],
-                )
+        if status_id is None:
+            status_id = status.objects.get(status="Complete").status_id
+        return status_id
 
-            # create the derivative
-            else:
-                logging.debug("(THREAD={0}) Creating {1} derivative for {2}".format(thread_index, derive_obj.derive_type, source_file))
-
-                # build the command
-                # replace all placeholders, output_file, input_file, brightness, contrast
-                brightness= derivative_job.brightness if derivative_job.brightness is not None else 0
-                contrast = derivative_job.contrast if derivative_job.contrast is not None else 0
-
-                pchain = PChain()
-                
-                for command in derivative_options["commands"]:
-                    c = command[0].format(output_file="\"" + target_file + "\"", input_file="\"" + source_file + "\"", brightness=brightness, contrast=contrast)
-                    logging.debug("(THREAD={0}) Adding command: {1}. JOIN: {2} ({3})".format(thread_index, c, command[1], getattr(pchain, command[1])))
-                    pchain.add(c, getattr(pchain, command[1]))
-                    
-                exit_code = pchain.run()    
-
-                # run the command and update the status
-                if exit_code == 0:
-                    logging.info("(THREAD={0}) Successfully created {1} derivative at {2}".format(thread_index, derive_obj.derive_type, target_file))
-                    #result_object = derivative_results.objects.get(label="Success")
-                    derivative_files.objects.create(
-                        job_derive_id=derive_obj,
-                        created=timezone.now(),
-                        source_file=source_file,
-                        target_file=target_file,
-                        result_id=status_objs['success'],
-                    )
-
-                elif exit_code is None or len(derivative_options["commands"]) == 0:
-                    logging.error("(THREAD={0}) Failed creating {1} derivative at {2}. Error: {2}.".format(thread_index, derive_obj.derive_type, target_file, "No commands supplied."))
-                    #result_object = derivative_results.objects.get(label="Failure")
-                    derivative_files.objects.create(
-                        job_derive_id=derive_obj,
-                        created=timezone.now(),
-                        source_file=source_file,
-                        target_file=target_file,
-                        result_id=status_objs['failure'],
-                    )
-
-                    job_messages.objects.create(
-                        job_id=derivative_job.job_id,
-                        created=timezone.now(),
-                        message= "Error generating {0} derivative to create {1}. Error: {2}.".format(derive_obj.derive_type, target_file, "No commands supplied."),
-                    )
-
-
-                else:
-                    logging.error("(THREAD={0}) Failed creating {1} derivative at {2}. Error: {3}".format(thread_index, derive_obj.derive_type, target_file, pchain.stderr()))
-                    #result_object = derivative_results.objects.get(label="Failure")
-                    derivative_files.objects.create(
-                        job_derive_id=derive_obj,
-                        created=timezone.now(),
-                        source_file=source_file,
-                        target_file=target_file,
-                        result_id=status_objs['failure'],
-                    )
-
-                    job_messages.objects.create(
-                        job_id=derivative_job.job_id,
-                        created=timezone.now(),
-                        message= "Error generating {0} derivative to create {1}. Error: {2}".format(derive_obj.derive_type, target_file, pchain.stderr()),
-                    )
+    def poll(self, pool, cancel_token):
+        """See to the running tasks while waiting for source files; return True if the job was stopped."""
+        pool.poll()
+        return cancel_token.is_cancelled()
 
-        except Exception as e:
-            logging.error("(THREAD={0}) Unexpected error occured in thread generating {1} derivative for {2}. {3}.".format(thread_index,derive_obj.derive_type, source_file, e))
-            # Not attempting to log the object as failed in case that was where the exception occured
-        finally:
-            # update the current running thread count to free up another thread
-            thread_count.acquire()
-            thread_count.value -= 1
-            thread_count.release()
-            logging.debug("(THREAD={0}) COMPLETE. creating {1} derivative for {2}".format(thread_index, derive_obj.derive_type, source_file))
+    def load_job(self, derivative_job):
+        """Load what record_result needs to record results of derivative_job, e.g. in a derivative worker."""
+        self.derivative_job = derivative_job
+        self.derive_objs = dict((d.derive_type, d) for d in job_derivatives.objects.filter(derive_id=derivative_job))
+        self.status_objs = dict((label.lower(), derivative_results.objects.get(label=label)) for label in ("Skipped", "Success", "Failure"))
+        return self
 
+    def derivative_task(self, source_file, group):
+        """Return task for make_derivatives: the commands to create a group of derivatives of source_file.
 
+        args:
+            source_file (string): file to use as the input to the derivative commands
+            group (list): (derivative type, save) pairs from derivative_groups, inputs first
+        """
+        steps = []
+        for name, save in group:
+            options = self.definitions[name]
+            steps.append({
+                "derive_type": name,
+                "save": save,
+                "input": options.get("input"),
+                "output_file": options["output_file"],
+                "commands": options["commands"],
+                "timeout": options.get("timeout") or settings.DERIVATIVE_TIMEOUT,
+                "step_timeouts": options.get("step_timeouts"),
+                "engine": options.get("engine"),
+                "operations": options.get("operations", {}),
+                "command_hash": self.command_hashes.get(name),
+                "manifest": self.manifest.get((source_file, name)),
+            })
+        return {
+            "source_file": source_file,
+            "replace": bool(self.derivative_job.replace_on_duplicate),
+            "incremental": self.incremental,
+            "brightness": self.brightness,
+            "contrast": self.contrast,
+            "steps": steps,
+        }
+
+    def task_timeout(self, group):
+        """Return seconds a group of derivatives may run, with time for the worker to report commands it killed."""
+        return sum(self.definitions[name].get("timeout") or settings.DERIVATIVE_TIMEOUT for name, save in group) + TASK_TIMEOUT_GRACE
+
+    def record_result(self, task, result):
+        """Save the results of a derivative task, in the job process."""
+        for step in task["steps"]:
+            if not step["save"]:
+                continue
+            # An error that ended the whole task (e.g. a timeout) applies to every derivative in it.
+            step_result = result.get(step["derive_type"]) or {"result": "failure", "error": result.get("error")}
+            self.record_step(task, step, step_result)
+
+    def record_step(self, task, step, result):
+        derive_obj = self.derive_objs[step["derive_type"]]
+        label = result.get("result", "failure")
+        target_file = result.get("target_file") or target_path(task["source_file"], step["output_file"])
+        if "error" in result:
+            logging.error("Error generating {0} derivative for {1}. {2}".format(derive_obj.derive_type, task["source_file"], result["error"]))
+        with transaction.atomic():
+            derivative_files.objects.create(
+                job_derive_id=derive_obj,
+                created=timezone.now(),
+                source_file=task["source_file"],
+                target_file=target_file,
+                result_id=self.status_objs[label],
+                cpu_time=result.get("cpu"),
+                max_rss=result.get("max_rss"),
+            )
+            increment_counts(self.derivative_job.job_id_id, {self.status_objs[label].label: 1})
+            if result.get("source"):
+                save_manifest(task["source_file"], step["derive_type"], result["source"], step["command_hash"])
+
+        if label == "failure":
+            job_messages.objects.create(
+                job_id=self.derivative_job.job_id,
+                created=timezone.now(),
+                message="Error generating {0} derivative to create {1}. Error: {2}".format(
+                    derive_obj.derive_type, target_file, result.get("error") or result.get("stderr")),
+            )
+
+
+def target_path(source_file, output_file, directory=None):
+    """Return path of a derivative of source_file, in directory if given, else beside the source file."""
+    ext = "." + source_file.split(".")[-1]
+    target_file = output_file.format(source_file.replace(ext,""))
+    if directory:
+        target_file = os.path.join(directory, os.path.basename(target_file))
+    return target_file
+
+
+def make_derivatives(task):
+    """Run the commands of a group of derivatives of one source file, in a worker process.
+
+    Existing derivatives are kept if the job doesn't replace them or, for incremental jobs, if they are up to
+    date. The other steps run in order, each reading the output of its input step, or the source file if it
+    has none; steps that are only inputs run only if a derivative being made needs them. Outputs of steps
+    that aren't saved go in a scratch directory, removed when the group is done.
+
+    args:
+        task (dict): from Derivatives.derivative_task.
+    returns:
+        (dict): derivative type: result of make_derivative for each saved step, with "source", the source
+            file state to record in the manifest, for derivatives that are current after this run.
+    """
+    source_file = task["source_file"]
+    results = {}
+    outputs = {}
+    scratch = None
+
+    # make sure the source_file exists
+    if not os.path.isfile(source_file):
+        message = "Source file no longer exists on the filesystem. Can not process. {0}".format(source_file)
+        logging.error(message)
+        return dict((step["derive_type"], {"result": "failure", "error": message}) for step in task["steps"] if step["save"])
+    state = source_state(source_file)
+
+    # Keep existing derivatives where possible.
+    for step in task["steps"]:
+        if not step["save"]:
+            continue
+        target_file = target_path(source_file, step["output_file"])
+        if task["incremental"]:
+            keep = is_up_to_date(source_file, target_file, step["manifest"], state, step["command_hash"])
+        else:
+            keep = os.path.isfile(target_file) and not task["replace"]
+        if keep:
+            logging.info("Skipping {0} derivative for {1}".format(step["derive_type"], source_file))
+            results[step["derive_type"]] = {"result": "skipped", "target_file": target_file}
+            outputs[step["derive_type"]] = target_file
+            if task["incremental"] and manifest_changed(step["manifest"], state):
+                results[step["derive_type"]]["source"] = dict(state)
+
+    # Work back from the derivatives to make to the inputs they need.
+    needed = set(step["derive_type"] for step in task["steps"] if step["save"] and step["derive_type"] not in outputs)
+    for step in reversed(task["steps"]):
+        if step["derive_type"] in needed and step["input"] and step["input"] not in outputs:
+            needed.add(step["input"])
+
+    try:
+        for step in task["steps"]:
+            if step["derive_type"] not in needed:
+                continue
+            if step["input"] and step["input"] not in outputs:
+                results[step["derive_type"]] = {"result": "failure", "error": "Input {0} could not be created.".format(step["input"])}
+                continue
+            if step["save"]:
+                target_file = target_path(source_file, step["output_file"])
+            else:
+                if scratch is None:
+                    scratch = tempfile.mkdtemp(prefix="swamplr-derive-", dir=settings.DERIVATIVE_SCRATCH_DIR or None)
+                target_file = target_path(source_file, step["output_file"], scratch)
+            input_file = outputs[step["input"]] if step["input"] else source_file
+            if step.get("engine") and engine_available(step["engine"]):
+                result = make_engine_derivative(step["derive_type"], input_file, target_file, step, task)
+            else:
+                if step.get("engine"):
+                    logging.warning("Engine {0} is not installed, running the {1} commands instead.".format(step["engine"], step["derive_type"]))
+                result = make_derivative(step["derive_type"], input_file, target_file, step["commands"], task,
+                                         timeout=step.get("timeout"), step_timeouts=step.get("step_timeouts"))
+            result["target_file"] = target_file
+            if result["result"] == "success":
+                outputs[step["derive_type"]] = target_file
+                if step["save"]:
+                    # Checksums let later incremental jobs tell a touched source from a changed one.
+                    if task["incremental"] and state["checksum"] is None:
+                        state["checksum"] = file_checksum(source_file)
+                    result["source"] = dict(state)
+            results[step["derive_type"]] = result
+    finally:
+        if scratch is not None:
+            shutil.rmtree(scratch, ignore_errors=True)
+    return results
+
+
+def make_derivative(derive_type, input_file, target_file, commands, task, timeout=None, step_timeouts=None):
+    """Run the commands creating one derivative.
+
+    kwargs:
+        timeout (float): seconds all the commands may run before they are killed.
+        step_timeouts (list): seconds each command may run, or None.
+    returns:
+        (dict): "result" (success or failure), "cpu" seconds and "max_rss" KB used, and "stderr" or "error"
+            on failure.
+    """
+    if not commands:
+        logging.error("Failed creating {0} derivative at {1}. Error: {2}.".format(derive_type, target_file, "No commands supplied."))
+        return {"result": "failure", "error": "No commands supplied."}
+
+    # build the command, replacing all placeholders: output_file, input_file, brightness, contrast
+    logging.debug("Creating {0} derivative for {1}".format(derive_type, task["source_file"]))
+    pchain = PChain(timeout=timeout)
+    for i, (command, join) in enumerate(commands):
+        c = command.format(output_file="\"" + target_file + "\"", input_file="\"" + input_file + "\"",
+                           brightness=task["brightness"], contrast=task["contrast"])
+        logging.debug("Adding command: {0}. JOIN: {1} ({2})".format(c, join, getattr(pchain, join)))
+        pchain.add(c, getattr(pchain, join), step_timeouts[i] if step_timeouts else None)
+    exit_code = pchain.run()
+    usage = {"cpu": pchain.cpu_time(), "max_rss": pchain.max_rss()}
+
+    if exit_code == 0:
+        logging.info("Successfully created {0} derivative at {1}".format(derive_type, target_file))
+        return dict(usage, result="success")
+
+    logging.error("Failed creating {0} derivative at {1}. Error: {2}".format(derive_type, target_file, pchain.stderr()))
+    return dict(usage, result="failure", stderr=pchain.stderr())
+
+
+def make_engine_derivative(derive_type, input_file, target_file, step, task):
+    """Create one derivative in process with the engine of its step.
+
+    returns:
+        (dict): "result" (success or failure), and "error" on failure.
+    """
+    logging.debug("Creating {0} derivative for {1} with {2}".format(derive_type, task["source_file"], step["engine"]))
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    try:
+        run_engine(step["engine"], input_file, target_file, step["operations"], task["brightness"], task["contrast"])
+    except Exception as e:
+        # Decoder errors of Pillow and pyvips are reported as failures of this derivative alone.
+        logging.error("Failed creating {0} derivative at {1}. Error: {2}".format(derive_type, target_file, e))
+        return {"result": "failure", "error": "{0}: {1}".format(type(e).__name__, e)}
+    after = resource.getrusage(resource.RUSAGE_SELF)
+    logging.info("Successfully created {0} derivative at {1}".format(derive_type, target_file))
+    # The worker's peak memory isn't this derivative's alone, so only CPU time is recorded.
+    return {"result": "success", "cpu": after.ru_utime + after.ru_stime - before.ru_utime - before.ru_stime}
@@ -0,0 +1,171 @@
+"""Find the source files of a derivatives job while derivatives of the files already found are being made."""
+import logging
+import os
+import threading
+import Queue
+try:
+    from os import scandir
+except ImportError:
+    # Python 2: backport package.
+    from scandir import scandir
+
+# Source files found ahead of the pool; the scan waits while this many are waiting to be queued.
+DISCOVERY_QUEUE_SIZE = 1000
+
+# Files passed through the queue at a time, to keep its locking off each file.
+DISCOVERY_CHUNK_SIZE = 50
+
+# Seconds between checks of whether the scan has been stopped while the queue is full.
+STOP_CHECK_INTERVAL = 0.5
+
+# Seconds the job waits for more files before seeing to its running tasks.
+DISCOVERY_POLL_INTERVAL = 0.1
+
+# Marks the end of the scan in the queue.
+DONE = None
+
+
+def source_filter(extension, output_endings):
+    """Return a function giving the source name of a file name, or None if it isn't a source file of the job.
+
+    The source name has the extension in lower case, as derivatives are named from it. Files ending as
+    derivatives do (output_endings, e.g. "_TN.jpg") are not sources. The suffixes are worked out once per job
+    rather than for each file.
+    """
+    lower = "." + extension.lower()
+    upper = "." + extension.upper()
+    suffixes = (lower, upper)
+    derivative_suffixes = tuple(output_endings)
+
+    def match(name):
+        if not name.endswith(suffixes):
+            return None
+        name = name.replace(upper, lower)
+        if name.endswith(derivative_suffixes):
+            return None
+        return name
+    return match
+
+
+def scan_source_files(source_dir, match, errors=None):
+    """Yield paths of source files below source_dir as each is read, in the order os.walk would visit them.
+
+    Like os.walk, links to directories aren't followed and directories that can't be read are skipped.
+
+    args:
+        match(callable): from source_filter.
+    kwargs:
+        errors(list): messages about directories that couldn't be read are appended here.
+    """
+    stack = [source_dir]
+    while stack:
+        path = stack.pop()
+        dirs = []
+        try:
+            for entry in scandir(path):
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    if not entry.is_symlink():
+                        dirs.append(entry.path)
+                    continue
+                name = match(entry.name)
+                if name is not None:
+                    yield os.path.join(path, name)
+        except OSError as e:
+            if errors is not None:
+                errors.append("Unable to scan {0}: {1}".format(path, e))
+        # Push in reverse so directories are visited in the order they were read, top-down.
+        stack.extend(reversed(dirs))
+
+
+class SourceScanner(threading.Thread):
+
+    """Scan for source files in a background thread, handing them to the job through a bounded queue.
+
+    The job starts derivatives of the first files as soon as they are found, and the scan carries on while
+    they are made, up to DISCOVERY_QUEUE_SIZE files ahead. The thread doesn't log, since the pool forks
+    workers while it runs; the job logs scan errors with log_errors.
+    """
+
+    def __init__(self, source_dir, match, size=DISCOVERY_QUEUE_SIZE):
+        super(SourceScanner, self).__init__(name="derivative-scan")
+        self.daemon = True
+        self.source_dir = source_dir
+        self.match = match
+        self.queue = Queue.Queue(max(1, size // DISCOVERY_CHUNK_SIZE))
+        self.stopped = threading.Event()
+        self.errors = []
+        self.error = None
+
+    def run(self):
+        chunk = []
+        # The first file is passed on at once, so the job can start on it.
+        chunk_size = 1
+        try:
+            for path in scan_source_files(self.source_dir, self.match, self.errors):
+                chunk.append(path)
+                if len(chunk) >= chunk_size:
+                    if not self.put(chunk):
+                        return
+                    chunk = []
+                    chunk_size = DISCOVERY_CHUNK_SIZE
+        except Exception as e:
+            self.error = e
+        if chunk and not self.put(chunk):
+            return
+        self.put(DONE)
+
+    def put(self, item):
+        """Add item to the queue, waiting while it is full; return False if the scan was stopped."""
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=STOP_CHECK_INTERVAL)
+                return True
+            except Queue.Full:
+                continue
+        return False
+
+    def batches(self, size, on_wait=None):
+        """Yield lists of source files found: each waits for the next file, then takes those already found,
+        up to size.
+
+        kwargs:
+            on_wait(callable): called every DISCOVERY_POLL_INTERVAL seconds while waiting for files, e.g. to
+                collect results of running tasks; no more batches are yielded once it returns True.
+        """
+        done = False
+        while not done:
+            try:
+                chunk = self.queue.get(timeout=DISCOVERY_POLL_INTERVAL)
+            except Queue.Empty:
+                if on_wait is not None and on_wait():
+                    break
+                continue
+            if chunk is DONE:
+                break
+            batch = list(chunk)
+            while len(batch) < size:
+                try:
+                    chunk = self.queue.get_nowait()
+                except Queue.Empty:
+                    break
+                if chunk is DONE:
+                    done = True
+                    break
+                batch.extend(chunk)
+            for i in range(0, len(batch), size):
+                yield batch[i:i + size]
+        if self.error is not None:
+            raise self.error
+
+    def log_errors(self):
+        """Log errors of the scan so far, from the job's thread."""
+        while self.errors:
+            logging.warning(self.errors.pop(0))
+
+    def stop(self):
+        """Stop scanning, e.g. when the job is cancelled."""
+        self.stopped.set()
@@ -0,0 +1,177 @@
+"""In-process image engines for derivatives, as an alternative to shelling out to ImageMagick.
+
+A derivative section in derive.cfg selects an engine with "engine = pillow" or "engine = pyvips" and describes its
+output with these options, which follow the ImageMagick options of the same names:
+
+    flatten = yes       composite transparency onto white and use the first page or layer
+    resize = 200x200    ImageMagick geometry: WIDTH, WIDTHxHEIGHT (fit within), xHEIGHT or PERCENT%; add ">" to
+                        only shrink
+    adjust = yes        apply the job's brightness and contrast, as -brightness-contrast does
+    quality = 75        JPEG quality
+    density = 300       resolution in pixels per inch
+
+Operations run in the order flatten, resize, adjust, as in the existing convert commands. The output format
+follows the output_file extension. If the engine's library isn't installed the section's command is run instead.
+pyvips decodes large masters in strips (and shrinks on load where the format allows), so it suits huge TIFs;
+Pillow decodes the whole image.
+"""
+import math
+import os
+import re
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+try:
+    import pyvips
+except (ImportError, OSError):
+    # OSError if the libvips shared library is missing.
+    pyvips = None
+
+ENGINE_OPTIONS = ["flatten", "resize", "adjust", "quality", "density"]
+
+GEOMETRY = re.compile(r"^\s*(?:(?P<percent>[\d.]+)%|(?P<width>\d+)?(?:x(?P<height>\d+))?)\s*(?P<shrink>>)?\s*$")
+
+
+class EngineError(Exception):
+    """Raised when an engine can't create a derivative."""
+    pass
+
+
+def engine_available(name):
+    """Return True if the library of the named engine is installed."""
+    return (name == "pillow" and Image is not None) or (name == "pyvips" and pyvips is not None)
+
+
+def get_engine_options(config, option_key):
+    """Return engine name and operations of a derive.cfg section, or (None, {}) if it has no engine."""
+    if not config.has_option(option_key, "engine"):
+        return None, {}
+    operations = dict((o, config.get(option_key, o).strip()) for o in ENGINE_OPTIONS if config.has_option(option_key, o))
+    return config.get(option_key, "engine").strip().lower(), operations
+
+
+def is_true(value):
+    return str(value).strip().lower() in ("1", "yes", "true", "on")
+
+
+def fit_size(width, height, geometry):
+    """Return size of an image of width x height resized by an ImageMagick geometry, keeping its aspect ratio."""
+    match = GEOMETRY.match(geometry or "")
+    if not match or not any(match.group("percent", "width", "height")):
+        raise EngineError("Unsupported resize geometry '{0}'.".format(geometry))
+    if match.group("percent"):
+        scale = float(match.group("percent")) / 100
+    else:
+        scales = []
+        if match.group("width"):
+            scales.append(float(match.group("width")) / width)
+        if match.group("height"):
+            scales.append(float(match.group("height")) / height)
+        scale = min(scales)
+    if match.group("shrink") and scale >= 1:
+        return width, height
+    return max(1, int(round(width * scale))), max(1, int(round(height * scale)))
+
+
+def brightness_contrast(brightness, contrast):
+    """Return slope and intercept (on a 0-1 scale) of ImageMagick's -brightness-contrast BxC."""
+    brightness = float(brightness or 0)
+    contrast = float(contrast or 0)
+    slope = max(0.0, math.tan(math.pi * (contrast / 100 + 1) / 4))
+    intercept = brightness / 100 + ((100 - brightness) / 200) * (1 - slope)
+    return slope, intercept
+
+
+def output_format(target_file):
+    ext = os.path.splitext(target_file)[1].lower()
+    if ext in (".jpg", ".jpeg"):
+        return "JPEG"
+    if ext in (".tif", ".tiff"):
+        return "TIFF"
+    if ext == ".png":
+        return "PNG"
+    raise EngineError("Unsupported output format '{0}'.".format(ext))
+
+
+def run_engine(name, input_file, target_file, operations, brightness=0, contrast=0):
+    """Create target_file from input_file with the named engine.
+
+    args:
+        name(str): "pillow" or "pyvips".
+        operations(dict): options from get_engine_options.
+    kwargs:
+        brightness, contrast: the job's adjustment, applied if operations["adjust"] is set.
+    """
+    if name == "pillow":
+        return pillow_derivative(input_file, target_file, operations, brightness, contrast)
+    if name == "pyvips":
+        return vips_derivative(input_file, target_file, operations, brightness, contrast)
+    raise EngineError("Unknown engine '{0}'.".format(name))
+
+
+def pillow_derivative(input_file, target_file, operations, brightness, contrast):
+    fmt = output_format(target_file)
+    # Masters are trusted local files, often larger than Pillow's decompression bomb limit.
+    Image.MAX_IMAGE_PIXELS = None
+    img = Image.open(input_file)
+    size = fit_size(img.size[0], img.size[1], operations["resize"]) if operations.get("resize") else img.size
+    if img.format == "JPEG":
+        # Decode JPEGs at a reduced scale when shrinking.
+        img.draft(img.mode, size)
+
+    if img.mode in ("I;16", "I;16B", "I;16L", "I"):
+        img = img.point(lambda i: i * (1.0 / 256)).convert("L")
+    if is_true(operations.get("flatten")) or fmt == "JPEG":
+        if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+            img = img.convert("RGBA")
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            background.paste(img, mask=img.split()[-1])
+            img = background
+        elif img.mode not in ("L", "RGB", "CMYK"):
+            img = img.convert("RGB")
+
+    if img.size != size:
+        img = img.resize(size, Image.LANCZOS)
+
+    if is_true(operations.get("adjust")) and (brightness or contrast):
+        slope, intercept = brightness_contrast(brightness, contrast)
+        lut = [min(255, max(0, int(round((slope * i / 255.0 + intercept) * 255)))) for i in range(256)]
+        img = img.point(lut * len(img.getbands()))
+
+    options = {}
+    if fmt == "JPEG":
+        options["quality"] = int(operations.get("quality", 92))
+    if operations.get("density"):
+        options["dpi"] = (float(operations["density"]),) * 2
+    img.save(target_file, fmt, **options)
+
+
+def vips_derivative(input_file, target_file, operations, brightness, contrast):
+    fmt = output_format(target_file)
+    img = pyvips.Image.new_from_file(input_file, access="sequential")
+    if operations.get("resize"):
+        width, height = fit_size(img.width, img.height, operations["resize"])
+        if (width, height) != (img.width, img.height):
+            # thumbnail shrinks on load where the format allows (JPEG, pyramidal TIFF) and streams otherwise.
+            img = pyvips.Image.thumbnail(input_file, width, height=height, size="force")
+
+    if img.interpretation in ("rgb16", "grey16"):
+        img = img.colourspace("srgb" if img.interpretation == "rgb16" else "b-w")
+    if (is_true(operations.get("flatten")) or fmt == "JPEG") and img.hasalpha():
+        img = img.flatten(background=255)
+
+    if is_true(operations.get("adjust")) and (brightness or contrast):
+        slope, intercept = brightness_contrast(brightness, contrast)
+        img = img.linear(slope, intercept * 255).cast("uchar")
+
+    options = {}
+    if fmt == "JPEG":
+        options["Q"] = int(operations.get("quality", 92))
+    if operations.get("density"):
+        # libvips resolution is in pixels per millimetre.
+        res = float(operations["density"]) / 25.4
+        img = img.copy(xres=res, yres=res)
+    img.write_to_file(target_file, **options)
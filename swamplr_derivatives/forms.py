@@ -8,6 +8,7 @@ from crispy_forms.layout import Submit, Layout, Field, Fieldset, HTML
 from django.core.exceptions import ValidationError
 from django.utils.translation import ugettext_lazy as _
 from django.conf import settings
+from swamplr_jobs.forms import priority_field
 
 
 def validate_path(value):
@@ -26,7 +27,9 @@ def get_slider_layout():
             'path_list_selected',
             'derive_types',
             'replace_on_duplicate',
+            'incremental',
             'subset_value',
+            'priority',
             HTML("""
               <input
                     type="text"
@@ -108,6 +111,10 @@ class DerivativesForm(forms.Form):
                 configs = views.get_configs()
                 command_list = views.get_command_list(configs, item_type.lower(), option_key) 
                 help_data[d]["command"] = "<br/>".join(["{0} {1}".format(c[0], c[1]) for c in command_list])
+            if dsettings.get("input"):
+                help_data[d]["command"] = "(input: {0}) {1}".format(dsettings["input"].strip(), help_data[d]["command"])
+            if dsettings.get("engine"):
+                help_data[d]["command"] = "(engine: {0}) {1}".format(dsettings["engine"].strip(), help_data[d]["command"])
 
         self.fields["derive_types"] = forms.MultipleChoiceField(
             label = "Select derivatives types to create.",
@@ -122,12 +129,19 @@ class DerivativesForm(forms.Form):
             help_text="",
         )
 
+        self.fields["incremental"] = forms.BooleanField(
+            required=False,
+            label="Only replace changed derivatives.",
+            help_text="Replace existing derivatives only if their source file or commands changed since they were made.",
+        )
+
         self.fields["subset_value"] = forms.IntegerField(
             required=False,
             label="Subset",
             min_value=0,
             help_text="Optionally select a number of items to process. Leave blank to process all items."
         )
+        self.fields["priority"] = priority_field("derivatives")
         self.fields["contrast_value"] = forms.CharField(label="Contrast", max_length="20",initial=0)
         self.fields["brightness_value"] = forms.CharField(label="Brightness", max_length="20", initial=0)
 
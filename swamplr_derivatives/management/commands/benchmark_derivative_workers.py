@@ -0,0 +1,105 @@
+from django import db
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from django.utils import timezone
+from swamplr_derivatives.derivatives import Derivatives
+from swamplr_derivatives.models import derivative_files, derivative_jobs, derivative_tasks, job_derivatives
+from swamplr_derivatives.task_queue import DerivativeWorker, TaskQueue
+from swamplr_jobs.models import jobs, job_types, status
+import logging
+import multiprocessing
+import os
+import shutil
+import signal
+import tempfile
+import time
+
+
+class NotCancelled(object):
+
+    def is_cancelled(self):
+        return False
+
+
+def run_worker(processes):
+    """Run a derivative worker until SIGTERM; target of each worker process."""
+    DerivativeWorker(processes, poll_interval=0.05, heartbeat_interval=5).run()
+
+
+class Command(BaseCommand):
+    help = ('Times derivative tasks made by several derivative workers on this host, through derivative_tasks, '
+            'and checks each task is made exactly once. Uses a job created in the database and removed afterwards')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tasks', type=int, default=80, help='Number of derivative tasks.')
+        parser.add_argument('--workers', default='1,2,4,8', help='Comma separated numbers of workers to time.')
+        parser.add_argument('--processes', type=int, default=1, help='Processes of each worker.')
+        parser.add_argument('--command', default='sleep 0.25', help='Command each task runs.')
+
+    def handle(self, *args, **options):
+        running = status.objects.filter(running="y").first()
+        job_type = job_types.objects.filter(app_name="swamplr_derivatives").first()
+        if running is None or job_type is None:
+            raise CommandError("A running status and a derivatives job type are needed.")
+
+        # Workers log every task; keep the timings readable.
+        logging.disable(logging.INFO)
+        base_dir = tempfile.mkdtemp()
+        job = jobs.objects.create(created=timezone.now(), status_id=running, type_id=job_type, archived="y")
+        try:
+            derivative_job = derivative_jobs.objects.create(job_id=job, source_dir=base_dir, replace_on_duplicate="y",
+                                                            source_file_extension="tif")
+            job_derivatives.objects.create(derive_id=derivative_job, derive_type="benchmark", parameters="")
+            sources = []
+            for n in range(options['tasks']):
+                sources.append(os.path.join(base_dir, "{0:06d}.tif".format(n)))
+                open(sources[-1], "w").close()
+            self.stdout.write("{0} tasks of \"{1}\", workers with {2} process(es) each".format(
+                len(sources), options['command'], options['processes']))
+
+            for workers in [int(w) for w in options['workers'].split(",")]:
+                elapsed = self.time_workers(derivative_job, sources, options['command'], workers, options['processes'])
+                made = derivative_files.objects.filter(job_derive_id__derive_id=derivative_job)
+                per_file = made.values("source_file").annotate(n=Count("pk")).filter(n=1).count()
+                once = made.count() == len(sources) and per_file == len(sources)
+                self.stdout.write("{0} worker(s): {1:.2f}s{2}".format(
+                    workers, elapsed, "" if once else " (NOT EVERY TASK MADE EXACTLY ONCE: {0} results)".format(made.count())))
+                made.delete()
+        finally:
+            logging.disable(logging.NOTSET)
+            derivative_tasks.objects.filter(derive_id__job_id=job).delete()
+            job.delete()
+            shutil.rmtree(base_dir)
+
+    def time_workers(self, derivative_job, sources, command, workers, processes):
+        """Queue a task for each source file, and return seconds workers take to do them all."""
+        queue = TaskQueue(Derivatives().load_job(derivative_job), NotCancelled())
+        for source_file in sources:
+            queue.submit({
+                "source_file": source_file,
+                "replace": True,
+                "incremental": False,
+                "brightness": 0,
+                "contrast": 0,
+                "steps": [{"derive_type": "benchmark", "save": True, "input": None, "output_file": "{0}.out",
+                           "commands": [(command, "AND")], "command_hash": None, "manifest": None}],
+            })
+        queue.flush()
+
+        # Connections must not be shared with the worker processes.
+        db.connections.close_all()
+        start = time.time()
+        pool = [multiprocessing.Process(target=run_worker, args=(processes,)) for n in range(workers)]
+        for p in pool:
+            p.start()
+        tasks = derivative_tasks.objects.filter(derive_id=derivative_job)
+        while tasks.exists():
+            if not any(p.is_alive() for p in pool):
+                raise CommandError("Every worker stopped with tasks left.")
+            time.sleep(0.05)
+        elapsed = time.time() - start
+        for p in pool:
+            os.kill(p.pid, signal.SIGTERM)
+        for p in pool:
+            p.join()
+        return elapsed
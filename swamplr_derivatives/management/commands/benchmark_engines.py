@@ -0,0 +1,92 @@
+from distutils.spawn import find_executable
+from django.core.management.base import BaseCommand, CommandError
+from swamplr_derivatives.derivatives import make_derivative, make_engine_derivative
+from swamplr_derivatives.engines import Image, engine_available
+from swamplr_derivatives.views import get_derivative_settings
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+
+class Command(BaseCommand):
+    help = ("Times the derive.cfg commands of derivatives that set an engine against the Pillow and pyvips engines, "
+            "on generated source files")
+
+    def add_arguments(self, parser):
+        parser.add_argument('source_type', help='Source type of derive.cfg, e.g. tif or jpg.')
+        parser.add_argument('--derivatives', help='Comma separated derivatives to time; all with an engine if not given.')
+        parser.add_argument('--files', type=int, default=20, help='Number of source files.')
+        parser.add_argument('--width', type=int, default=2400, help='Width of the source files.')
+        parser.add_argument('--height', type=int, default=3000, help='Height of the source files.')
+        parser.add_argument('--brightness', type=int, default=10, help="The job's brightness.")
+        parser.add_argument('--contrast', type=int, default=20, help="The job's contrast.")
+        parser.add_argument('--dir', help='Directory to create the files in; a temporary one if not given.')
+
+    def handle(self, *args, **options):
+        if Image is None:
+            raise CommandError("Pillow is needed to generate the source files.")
+        source_type = options['source_type'].lower()
+        steps = [s for s in get_derivative_settings(source_type) if s["engine"] and not s.get("intermediate")]
+        if options['derivatives']:
+            names = [n.strip() for n in options['derivatives'].split(",")]
+            steps = [s for s in steps if s["derivative_type"] in names]
+        if not steps:
+            raise CommandError("No {0} derivatives set an engine.".format(source_type))
+
+        # Commands log every file; keep the timings readable.
+        logging.disable(logging.INFO)
+        base_dir = options['dir'] or tempfile.mkdtemp()
+        try:
+            sources = self.build(base_dir, source_type, options['files'], options['width'], options['height'])
+            self.stdout.write("{0} {1}x{2} {3} files in {4}; each derivative is made from the source file, even if "
+                              "derive.cfg sets another input".format(len(sources), options['width'], options['height'],
+                                                                   source_type, base_dir))
+            task = {"brightness": options['brightness'], "contrast": options['contrast']}
+            for step in steps:
+                name = step["derivative_type"]
+                program = step["commands"][0][0].split()[0] if step["commands"] else None
+                if program and find_executable(program):
+                    self.time_path(name, "commands", sources, step, task, self.run_commands)
+                else:
+                    self.stdout.write("{0}, commands: not run, {1} is not installed".format(name, program))
+                for engine in ("pillow", "pyvips"):
+                    if engine_available(engine):
+                        self.time_path(name, engine, sources, dict(step, engine=engine), task, self.run_engine)
+                    else:
+                        self.stdout.write("{0}, {1}: not run, {1} is not installed".format(name, engine))
+        finally:
+            logging.disable(logging.NOTSET)
+            if not options['dir']:
+                shutil.rmtree(base_dir)
+
+    def build(self, base_dir, source_type, files, width, height):
+        """Create source files of random RGB noise, which compresses and decodes like a scanned page."""
+        sources = []
+        for n in range(files):
+            path = os.path.join(base_dir, "page{0:04d}.{1}".format(n, source_type))
+            noise = Image.frombytes("RGB", (256, 256), os.urandom(256 * 256 * 3))
+            noise.resize((width, height)).save(path)
+            sources.append(path)
+        return sources
+
+    def run_commands(self, step, input_file, target_file, task):
+        return make_derivative(step["derivative_type"], input_file, target_file, step["commands"], task,
+                               timeout=step["timeout"], step_timeouts=step["step_timeouts"])
+
+    def run_engine(self, step, input_file, target_file, task):
+        return make_engine_derivative(step["derivative_type"], input_file, target_file, step, task)
+
+    def time_path(self, name, label, sources, step, task, run):
+        """Make the derivative of every source file one way, and write ms per file and failures."""
+        failures = 0
+        start = time.time()
+        for source in sources:
+            target_file = step["output_file"].format(os.path.splitext(source)[0] + "_" + label)
+            result = run(step, source, target_file, dict(task, source_file=source))
+            if result["result"] != "success":
+                failures += 1
+        elapsed = time.time() - start
+        self.stdout.write("{0}, {1}: {2:.0f} ms/file{3}".format(
+            name, label, elapsed * 1000 / len(sources), ", {0} failed".format(failures) if failures else ""))
@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from swamplr_derivatives.task_queue import DerivativeWorker
+
+
+class Command(BaseCommand):
+    help = 'Makes derivatives queued by derivatives jobs (with DERIVATIVE_DISTRIBUTED) until stopped with SIGTERM or SIGINT'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=settings.MAX_THREADS,
+                            help='Most derivative tasks to run at once, subject to their cost classes.')
+        parser.add_argument('--poll-interval', type=float, default=settings.WORKER_POLL_INTERVAL,
+                            help='Seconds between checks for tasks when idle.')
+        parser.add_argument('--heartbeat-interval', type=float, default=settings.WORKER_HEARTBEAT_INTERVAL,
+                            help='Seconds between heartbeats of claimed tasks.')
+
+    def handle(self, *args, **options):
+        worker = DerivativeWorker(
+            options['processes'],
+            poll_interval=options['poll_interval'],
+            heartbeat_interval=options['heartbeat_interval'],
+        )
+        worker.run()
@@ -0,0 +1,115 @@
+"""Record what each derivative was made from, so incremental jobs only remake derivatives that are out of date."""
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from models import derivative_manifest
+from plan import input_chain
+import hashlib
+import json
+import os
+
+# Source files looked up per query.
+MANIFEST_BATCH_SIZE = 500
+
+
+def path_hash(path):
+    """Return sha1 of a file path, the manifest key of its source file."""
+    if isinstance(path, unicode):
+        path = path.encode("utf-8")
+    return hashlib.sha1(path).hexdigest()
+
+
+def command_hash(derive_type, definitions, brightness, contrast):
+    """Return sha1 of everything besides the source file that a derivative's content depends on.
+
+    This is the commands, engine and output of the derivative and of each input it is made from, with the
+    job's brightness and contrast.
+    """
+    chain = [(name, definitions[name]["commands"], definitions[name]["output_file"])
+             + ((definitions[name]["engine"], definitions[name]["operations"]) if definitions[name].get("engine") else ())
+             for name in input_chain(derive_type, definitions)]
+    return hashlib.sha1(json.dumps([chain, brightness, contrast], sort_keys=True)).hexdigest()
+
+
+def file_checksum(path, block_size=1 << 20):
+    """Return sha1 of a file's content."""
+    checksum = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            checksum.update(block)
+    return checksum.hexdigest()
+
+
+def source_state(path):
+    """Return modification time and size of a source file."""
+    stat = os.stat(path)
+    return {"mtime": stat.st_mtime, "size": stat.st_size, "checksum": None}
+
+
+def is_up_to_date(source_file, target_file, entry, state, commands):
+    """Return True if target_file can be kept rather than remade.
+
+    With a manifest entry, the derivative is current if it was made with the same commands and the source
+    is unchanged: the same modification time and size, or, if those changed, the same checksum (which is
+    then added to state). With no entry, it is current if it is newer than the source.
+
+    args:
+        entry(dict): manifest row of the derivative, or None.
+        state(dict): source_state of source_file.
+        commands(str): command_hash of the derivative.
+    """
+    if not os.path.isfile(target_file):
+        return False
+    if entry is None:
+        return os.path.getmtime(target_file) >= state["mtime"]
+    if entry["command_hash"] != commands:
+        return False
+    if entry["source_mtime"] == state["mtime"] and entry["source_size"] == state["size"]:
+        return True
+    if entry["source_checksum"] is None or entry["source_size"] != state["size"]:
+        return False
+    if state["checksum"] is None:
+        state["checksum"] = file_checksum(source_file)
+    return state["checksum"] == entry["source_checksum"]
+
+
+def manifest_changed(entry, state):
+    """Return True if the manifest entry of a derivative kept as up to date should be updated to state."""
+    if entry is None:
+        return True
+    return (entry["source_mtime"], entry["source_size"]) != (state["mtime"], state["size"]) or \
+        (state["checksum"] is not None and entry["source_checksum"] != state["checksum"])
+
+
+def load_manifest(source_files, derive_types):
+    """Return dict of (source file, derivative type): manifest row, for the given files."""
+    by_hash = dict((path_hash(f), f) for f in source_files)
+    hashes = list(by_hash)
+    manifest = {}
+    for i in range(0, len(hashes), MANIFEST_BATCH_SIZE):
+        rows = derivative_manifest.objects.filter(source_hash__in=hashes[i:i + MANIFEST_BATCH_SIZE], derive_type__in=derive_types).values(
+            "source_hash", "derive_type", "source_mtime", "source_size", "source_checksum", "command_hash")
+        for r in rows:
+            manifest[(by_hash[r["source_hash"]], r["derive_type"])] = r
+    return manifest
+
+
+def save_manifest(source_file, derive_type, state, commands):
+    """Record that the derivative is current for the source file's state and commands."""
+    values = {
+        "source_file": source_file,
+        "source_mtime": state["mtime"],
+        "source_size": state["size"],
+        "source_checksum": state.get("checksum"),
+        "command_hash": commands,
+        "updated": timezone.now(),
+    }
+    key = {"source_hash": path_hash(source_file), "derive_type": derive_type}
+    if derivative_manifest.objects.filter(**key).update(**values):
+        return
+    try:
+        with transaction.atomic():
+            values.update(key)
+            derivative_manifest.objects.create(**values)
+    except IntegrityError:
+        # Created by another job since the update above.
+        derivative_manifest.objects.filter(**key).update(**values)
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 15:47
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('swamplr_derivatives', '0002_auto_20180209_1310'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='derivative_files',
+            index=models.Index(fields=['job_derive_id', 'result_id'], name='deriv_file_job_result_idx'),
+        ),
+    ]
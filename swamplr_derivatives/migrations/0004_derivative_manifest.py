@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 15:57
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('swamplr_derivatives', '0003_result_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='derivative_manifest',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source_hash', models.CharField(max_length=40)),
+                ('source_file', models.CharField(max_length=255)),
+                ('derive_type', models.CharField(max_length=32)),
+                ('source_mtime', models.FloatField()),
+                ('source_size', models.BigIntegerField()),
+                ('source_checksum', models.CharField(max_length=40, null=True)),
+                ('command_hash', models.CharField(max_length=40)),
+                ('updated', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='derivative_jobs',
+            name='incremental',
+            field=models.CharField(blank=True, default='', max_length=1),
+        ),
+        migrations.AlterUniqueTogether(
+            name='derivative_manifest',
+            unique_together=set([('source_hash', 'derive_type')]),
+        ),
+    ]
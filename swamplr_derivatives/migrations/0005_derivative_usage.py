@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 16:04
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('swamplr_derivatives', '0004_derivative_manifest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='derivative_files',
+            name='cpu_time',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='derivative_files',
+            name='max_rss',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
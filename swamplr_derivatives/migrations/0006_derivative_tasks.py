@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 16:09
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('swamplr_derivatives', '0005_derivative_usage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='derivative_tasks',
+            fields=[
+                ('task_id', models.AutoField(primary_key=True, serialize=False)),
+                ('source_file', models.CharField(max_length=255)),
+                ('task', models.TextField()),
+                ('state', models.CharField(max_length=10)),
+                ('worker', models.CharField(blank=True, max_length=255)),
+                ('created', models.DateTimeField()),
+                ('heartbeat', models.DateTimeField(null=True)),
+                ('attempts', models.IntegerField(default=0)),
+                ('derive_id', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='swamplr_derivatives.derivative_jobs')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='derivative_tasks',
+            index=models.Index(fields=['state', 'task_id'], name='deriv_task_state_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='derivative_tasks',
+            index=models.Index(fields=['derive_id', 'state'], name='deriv_task_job_state_idx'),
+        ),
+    ]
@@ -9,6 +9,8 @@ class derivative_jobs(models.Model):
     job_id = models.ForeignKey('swamplr_jobs.jobs')
     source_dir = models.CharField(max_length=255)
     replace_on_duplicate = models.CharField(max_length=1)
+    # "y" to regenerate only derivatives whose source or commands changed since they were made.
+    incremental = models.CharField(max_length=1, blank=True, default="")
     subset = models.IntegerField(default=0)
     source_file_extension = models.CharField(max_length=10)
     contrast = models.IntegerField(default=0)
@@ -30,6 +32,12 @@ class derivative_files(models.Model):
     source_file = models.CharField(max_length=255)
     target_file = models.CharField(max_length=255, null=True)
     result_id = models.ForeignKey('derivative_results')
+    # CPU seconds and peak resident set size (KB) of the commands that made the derivative.
+    cpu_time = models.FloatField(null=True, blank=True)
+    max_rss = models.BigIntegerField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["job_derive_id", "result_id"], name="deriv_file_job_result_idx")]
 
 class derivative_results(models.Model):
 
@@ -37,4 +45,39 @@ class derivative_results(models.Model):
     label = models.CharField(max_length=32)
 
 
+class derivative_manifest(models.Model):
+    """Source file state and commands each derivative was last made from, for incremental jobs."""
+    # sha1 of source_file, so the unique key fits MySQL's index length limit.
+    source_hash = models.CharField(max_length=40)
+    source_file = models.CharField(max_length=255)
+    derive_type = models.CharField(max_length=32)
+    source_mtime = models.FloatField()
+    source_size = models.BigIntegerField()
+    source_checksum = models.CharField(max_length=40, null=True)
+    # sha1 of the commands, inputs and settings used.
+    command_hash = models.CharField(max_length=40)
+    updated = models.DateTimeField()
+
+    class Meta:
+        unique_together = ("source_hash", "derive_type")
+
+
+class derivative_tasks(models.Model):
+    """Groups of derivatives of a source file waiting for, or being made by, a derivative worker."""
+    task_id = models.AutoField(primary_key=True)
+    derive_id = models.ForeignKey('derivative_jobs')
+    source_file = models.CharField(max_length=255)
+    # JSON of the task passed to make_derivatives, with its timeout and cost.
+    task = models.TextField()
+    # "queued" or "running".
+    state = models.CharField(max_length=10)
+    worker = models.CharField(max_length=255, blank=True)
+    created = models.DateTimeField()
+    heartbeat = models.DateTimeField(null=True)
+    attempts = models.IntegerField(default=0)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["state", "task_id"], name="deriv_task_state_idx"),
+            models.Index(fields=["derive_id", "state"], name="deriv_task_job_state_idx"),
+        ]
@@ -0,0 +1,72 @@
+"""Plan derivatives that are made from other derivatives or intermediates, rather than from the source file."""
+
+
+def derivative_groups(selected, definitions):
+    """Split the derivatives to create for each source file into groups that depend on each other.
+
+    Each group is run as one task, so intermediates it needs are made once and shared within it.
+    Derivatives with no input and no dependents are groups of one, and run in parallel as before.
+
+    args:
+        selected(list): derivative types chosen for the job.
+        definitions(dict): derivative type: settings from get_derivative_settings, including intermediates.
+    returns:
+        (list): groups, each a list of (derivative type, save) in the order they must be made. save is False
+            for intermediates and for derivatives that are only needed as inputs.
+    """
+    needed = []
+    for derive_type in selected:
+        for name in input_chain(derive_type, definitions):
+            if name not in needed:
+                needed.append(name)
+
+    # Union derivatives with their inputs into groups.
+    parent = dict((name, name) for name in needed)
+
+    def root(name):
+        while parent[name] != name:
+            name = parent[name]
+        return name
+
+    for name in needed:
+        input_name = definitions[name].get("input")
+        if input_name:
+            parent[root(name)] = root(input_name)
+
+    groups = {}
+    order = []
+    for name in needed:
+        key = root(name)
+        if key not in groups:
+            groups[key] = []
+            order.append(key)
+        groups[key].append(name)
+
+    return [[(name, name in selected) for name in topological_order(groups[key], definitions)] for key in order]
+
+
+def input_chain(derive_type, definitions):
+    """Return derive_type and the derivatives and intermediates it is made from, inputs first.
+
+    Raises ValueError for unknown inputs or inputs that depend on each other in a cycle.
+    """
+    chain = []
+    name = derive_type
+    while name:
+        if name not in definitions:
+            raise ValueError("Unknown derivative input '{0}' for {1}.".format(name, derive_type))
+        if name in chain:
+            raise ValueError("Derivative inputs of {0} form a cycle: {1}.".format(derive_type, " -> ".join(chain + [name])))
+        chain.append(name)
+        name = definitions[name].get("input")
+    return list(reversed(chain))
+
+
+def topological_order(names, definitions):
+    """Order names so that each comes after its input, keeping the given order otherwise."""
+    ordered = []
+    for name in names:
+        for dep in input_chain(name, definitions):
+            if dep not in ordered:
+                ordered.append(dep)
+    return ordered
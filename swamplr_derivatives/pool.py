@@ -0,0 +1,246 @@
+"""Fixed-size pool of long-lived worker processes for running derivative commands."""
+from django import db
+from proclr.pchain import kill_running
+import collections
+import errno
+import logging
+import multiprocessing
+import os
+import select
+import signal
+import time
+
+# Seconds a worker has to stop its commands when killed, before it is killed outright.
+KILL_GRACE = 2
+
+
+def stop_worker(signum, frame):
+    """Kill the commands of the running task, which have process groups of their own, and exit."""
+    kill_running()
+    os._exit(1)
+
+
+def worker_loop(func, conn):
+    """Run tasks received on conn until None is received, sending back each result.
+
+    Each worker leads its own process group, so that a timed-out task can be stopped along with any commands
+    it started. Commands run by PChain lead groups of their own, so the worker kills them when terminated.
+
+    args:
+        func(callable): function called with each task, returning its result.
+        conn(Connection): worker end of a pipe to the parent.
+    """
+    os.setpgrp()
+    signal.signal(signal.SIGTERM, stop_worker)
+    while True:
+        task = conn.recv()
+        if task is None:
+            break
+        try:
+            result = func(task)
+        except Exception as e:
+            result = {"error": "{0}: {1}".format(type(e).__name__, e)}
+        conn.send(result)
+    conn.close()
+
+
+class Worker(object):
+
+    """A worker process, its pipe, and the task it is running."""
+
+    def __init__(self, func):
+        parent_conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=worker_loop, args=(func, child_conn))
+        self.process.daemon = True
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+        self.task = None
+        self.cost = None
+        self.timeout = None
+        self.deadline = None
+
+    def fileno(self):
+        return self.conn.fileno()
+
+    def send(self, task, timeout):
+        self.task = task
+        self.timeout = timeout
+        self.deadline = time.time() + timeout if timeout is not None else None
+        self.conn.send(task)
+
+    def kill(self):
+        """Kill the worker and any commands it started."""
+        self.process.terminate()
+        self.process.join(KILL_GRACE)
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except OSError:
+            # Already gone, with the rest of its process group.
+            pass
+        self.process.join()
+        self.conn.close()
+
+
+class WorkerPool(object):
+
+    """Run a function over tasks in up to `size` worker processes, which are reused from task to task.
+
+    Each worker gets its next task as soon as its last result is read, so up to `size` tasks are always
+    running while there is work. The parent waits on all workers at once with select, waking for the first
+    result or the earliest task deadline, so timeouts of all running tasks are enforced together: a worker
+    whose task passes its deadline is killed, with its child processes, and replaced.
+
+    Results are passed to `on_result(task, result)` in the parent process, so only the parent uses the
+    database. A task that raised, timed out or whose worker died has the result {"error": message}.
+
+    With a ResourceBudget, a task starts only once its cost fits alongside the running tasks. Submitted tasks
+    wait in a queue of up to `size`, and a task that fits may start ahead of one that doesn't, so cheap tasks
+    keep the machine busy while an expensive one waits; once `size` tasks have gone ahead of it, no other
+    starts until it does.
+    """
+
+    def __init__(self, func, size, on_result, timeout=None, budget=None):
+        """Workers are started as tasks are submitted.
+
+        args:
+            func(callable): module-level function run in the workers with each task; tasks and results must
+                be picklable.
+            size(int): maximum number of worker processes.
+            on_result(callable): called in the parent with each task and its result.
+        kwargs:
+            timeout(float): seconds a task may run before its worker is killed; no limit if None.
+            budget(ResourceBudget): admits tasks by their cost; only `size` limits them if None.
+        """
+        self.func = func
+        self.size = max(1, size)
+        self.on_result = on_result
+        self.timeout = timeout
+        self.budget = budget
+        self.workers = []
+        self.pending = collections.deque()
+        self.overtaken = 0
+
+    def busy(self):
+        return [w for w in self.workers if w.task is not None]
+
+    def submit(self, task, timeout=None, cost=None):
+        """Queue task to start as soon as a worker is idle and its cost fits, first waiting for running tasks
+        to finish while the queue is full.
+
+        kwargs:
+            timeout(float): seconds this task may run, instead of the pool's timeout.
+            cost(dict): cpu, memory and io the task needs, from resources.get_cost.
+        """
+        self.pending.append((task, timeout if timeout is not None else self.timeout, cost))
+        self.dispatch()
+        while len(self.pending) >= self.size:
+            self.collect()
+            self.dispatch()
+
+    def dispatch(self):
+        """Start queued tasks while workers are free and their costs fit."""
+        while self.pending and len(self.busy()) < self.size:
+            # Look past the first task only until it has been passed over `size` times.
+            lookahead = len(self.pending) if self.overtaken < self.size else 1
+            for i in range(lookahead):
+                cost = self.pending[i][2]
+                if self.budget is None or cost is None or self.budget.fits(cost):
+                    break
+            else:
+                return
+            task, timeout, cost = self.pending[i]
+            del self.pending[i]
+            self.overtaken = self.overtaken + 1 if i else 0
+            self.start(task, timeout, cost)
+
+    def start(self, task, timeout, cost):
+        idle = [w for w in self.workers if w.task is None]
+        if idle:
+            worker = idle[0]
+        else:
+            # Forked workers must not share the parent's database connections.
+            db.connections.close_all()
+            worker = Worker(self.func)
+            self.workers.append(worker)
+        if self.budget is not None and cost is not None:
+            self.budget.acquire(cost)
+            worker.cost = cost
+        worker.send(task, timeout)
+
+    def finish(self, worker):
+        """Return the task of worker, freeing the worker and the task's cost."""
+        task, worker.task = worker.task, None
+        if worker.cost is not None:
+            self.budget.release(worker.cost)
+            worker.cost = None
+        return task
+
+    def poll(self):
+        """Handle results and deadlines of running tasks and start queued tasks, without waiting."""
+        if self.busy():
+            self.collect(wait=0)
+        self.dispatch()
+
+    def collect(self, wait=None):
+        """Wait for the next result, or for the earliest deadline of the running tasks.
+
+        Returns early if a signal arrives, so its handler's effect (e.g. a shutdown) is seen by the caller.
+
+        kwargs:
+            wait(float): most seconds to wait; until a result or deadline if None.
+        """
+        busy = self.busy()
+        if not busy:
+            return
+        deadlines = [w.deadline for w in busy if w.deadline is not None]
+        if wait is not None:
+            deadlines.append(time.time() + wait)
+        wait = max(0, min(deadlines) - time.time()) if deadlines else None
+        try:
+            ready = select.select(busy, [], [], wait)[0]
+        except select.error as e:
+            if e.args[0] != errno.EINTR:
+                raise
+            ready = []
+        for worker in ready:
+            try:
+                result = worker.conn.recv()
+            except (EOFError, IOError):
+                self.remove(worker, "Worker process exited unexpectedly.")
+                continue
+            self.on_result(self.finish(worker), result)
+
+        now = time.time()
+        for worker in busy:
+            if worker.task is not None and worker.deadline is not None and worker.deadline <= now:
+                logging.warning("Worker {0} still running after {1}s, terminating.".format(worker.process.pid, worker.timeout))
+                self.remove(worker, "Timed out after {0} seconds.".format(worker.timeout))
+
+    def remove(self, worker, error):
+        """Kill worker and record its task as failed; another worker is started when needed."""
+        task = self.finish(worker)
+        worker.kill()
+        self.workers.remove(worker)
+        if task is not None:
+            self.on_result(task, {"error": error})
+
+    def join(self):
+        """Wait for all submitted tasks, then stop the workers."""
+        self.dispatch()
+        while self.busy():
+            self.collect()
+            self.dispatch()
+        for worker in self.workers:
+            worker.conn.send(None)
+        for worker in self.workers:
+            worker.process.join()
+            worker.conn.close()
+        self.workers = []
+
+    def terminate(self):
+        """Kill the workers and their running commands; tasks without a result are dropped."""
+        for worker in self.workers:
+            worker.kill()
+        self.workers = []
+        self.pending.clear()
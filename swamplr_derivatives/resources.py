@@ -0,0 +1,110 @@
+"""Admit derivative tasks by the cores, memory and I/O they need, rather than by a fixed number of processes.
+
+Each derivative in derive.cfg may name a cost class, a [cost.<name>] section with:
+
+    cpu = 1         cores the derivative's commands keep busy
+    memory = 512    megabytes they may use at peak
+    io = 1          share of disk bandwidth, against DERIVATIVE_IO_CAPACITY
+
+Derivatives without one use [cost.default], or DEFAULT_COST if that section is missing.
+"""
+import multiprocessing
+import time
+
+DEFAULT_COST = {"cpu": 1.0, "memory": 256.0, "io": 1.0}
+
+# Seconds a reading of /proc/meminfo is reused.
+MEMINFO_INTERVAL = 1.0
+
+
+def get_cost(config, option_key):
+    """Return the cost class of a derive.cfg section as a dict of cpu, memory (MB) and io."""
+    name = config.get(option_key, "cost").strip() if config.has_option(option_key, "cost") else "default"
+    section = "cost." + name
+    if not config.has_section(section):
+        if name != "default":
+            raise ValueError("Unknown cost class '{0}' for {1}.".format(name, option_key))
+        return dict(DEFAULT_COST)
+    return dict((k, config.getfloat(section, k) if config.has_option(section, k) else v) for k, v in DEFAULT_COST.items())
+
+
+def group_cost(costs):
+    """Return the cost of derivatives run one after another: the largest need of each kind."""
+    costs = [c for c in costs if c]
+    return dict((k, max([c[k] for c in costs] or [DEFAULT_COST[k]])) for k in DEFAULT_COST)
+
+
+def available_memory():
+    """Return megabytes of memory available to new processes, from /proc/meminfo, or None if unknown."""
+    try:
+        with open("/proc/meminfo") as f:
+            meminfo = dict((line.split(":")[0], line.split()[1]) for line in f if ":" in line)
+    except (IOError, OSError):
+        return None
+    if "MemAvailable" in meminfo:
+        return int(meminfo["MemAvailable"]) / 1024.0
+    # Kernels before 3.14.
+    return sum(int(meminfo.get(k, 0)) for k in ("MemFree", "Buffers", "Cached")) / 1024.0
+
+
+class ResourceBudget(object):
+
+    """Track the cost of running tasks against the cores, memory and I/O capacity of the machine.
+
+    The memory for tasks is what /proc/meminfo reports available while none are running, less
+    `memory_reserve`; the estimates of running tasks must fit within it, since they may not have reached
+    their peak yet. Each task must also fit in what is available now, in case other processes have grown.
+    A task is always admitted when nothing else is running, so one larger than the machine still runs, alone.
+    """
+
+    def __init__(self, cpus=None, memory_reserve=0, io_capacity=None):
+        """
+        kwargs:
+            cpus(float): cores to use; all of them if None.
+            memory_reserve(float): megabytes to leave free.
+            io_capacity(float): total io weight of tasks running at once; no limit if None.
+        """
+        self.cpus = cpus or multiprocessing.cpu_count()
+        self.memory_reserve = memory_reserve
+        self.io_capacity = io_capacity
+        self.used = dict((k, 0.0) for k in DEFAULT_COST)
+        self.running = 0
+        self.measured = None
+        self.memory = None
+        self.capacity = None
+
+    def current_memory(self):
+        """Return megabytes available now, less the reserve, or None if unknown."""
+        now = time.time()
+        if self.measured is None or now - self.measured >= MEMINFO_INTERVAL:
+            self.memory = available_memory()
+            self.measured = now
+        if self.memory is None:
+            return None
+        return self.memory - self.memory_reserve
+
+    def fits(self, cost):
+        """Return True if a task of cost can start now."""
+        if not self.running:
+            return True
+        if self.used["cpu"] + cost["cpu"] > self.cpus:
+            return False
+        if self.io_capacity is not None and self.used["io"] + cost["io"] > self.io_capacity:
+            return False
+        memory = self.current_memory()
+        if memory is None:
+            return True
+        return (self.capacity is None or self.used["memory"] + cost["memory"] <= self.capacity) and cost["memory"] <= memory
+
+    def acquire(self, cost):
+        if not self.running:
+            self.measured = None
+            self.capacity = self.current_memory()
+        for k in self.used:
+            self.used[k] += cost[k]
+        self.running += 1
+
+    def release(self, cost):
+        for k in self.used:
+            self.used[k] -= cost[k]
+        self.running -= 1
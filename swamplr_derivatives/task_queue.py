@@ -0,0 +1,207 @@
+"""Run derivative tasks on any number of hosts, through a shared table of tasks.
+
+With DERIVATIVE_DISTRIBUTED set, a derivatives job puts a row in derivative_tasks for each group of
+derivatives of each source file rather than running them itself, then waits for the rows to be done. Workers
+started with "manage.py run_derivative_worker", on any host that mounts the DATA_PATHS and reaches the
+database, claim rows, make the derivatives in their own WorkerPool and record the results in derivative_files.
+
+A claimed task gets a heartbeat from its worker; the job returns tasks of workers that stop sending them to
+the queue, and records them as failed after DERIVATIVE_TASK_ATTEMPTS tries.
+"""
+from datetime import timedelta
+from django import db
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from derivatives import Derivatives, make_derivatives
+from models import derivative_jobs, derivative_tasks
+from pool import WorkerPool
+from resources import ResourceBudget
+from swamplr_jobs.worker import worker_name
+import json
+import logging
+import signal
+import time
+
+# Tasks written per query.
+TASK_BATCH_SIZE = 500
+
+
+class TaskQueue(object):
+
+    """Queue derivative tasks of a job in derivative_tasks, in place of its WorkerPool."""
+
+    def __init__(self, recorder, cancel_token):
+        """
+        args:
+            recorder(Derivatives): the job's Derivatives, to record tasks that fail on every attempt.
+            cancel_token(CancellationToken): stops waiting for tasks when the job is cancelled.
+        """
+        self.recorder = recorder
+        self.derivative_job = recorder.derivative_job
+        self.cancel_token = cancel_token
+        self.batch = []
+        self.last_reclaim = time.time()
+        # Tasks left from an earlier run of the job, e.g. before its process was restarted.
+        derivative_tasks.objects.filter(derive_id=self.derivative_job).delete()
+
+    def submit(self, task, timeout=None, cost=None):
+        """Add task to the queue, written with the next batch."""
+        task = dict(task, timeout=timeout, cost=cost)
+        self.batch.append(derivative_tasks(derive_id=self.derivative_job, source_file=task["source_file"][:255],
+                                           task=json.dumps(task), state="queued", created=timezone.now()))
+        if len(self.batch) >= TASK_BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        derivative_tasks.objects.bulk_create(self.batch)
+        self.batch = []
+
+    def poll(self):
+        """Write tasks queued so far, so workers can start them, and reclaim tasks if due."""
+        if self.batch:
+            self.flush()
+        if time.time() - self.last_reclaim >= settings.WORKER_HEARTBEAT_INTERVAL:
+            self.last_reclaim = time.time()
+            self.reclaim()
+
+    def join(self):
+        """Wait until workers have done every task, or the job is cancelled."""
+        self.flush()
+        tasks = derivative_tasks.objects.filter(derive_id=self.derivative_job)
+        while tasks.exists():
+            if self.cancel_token.is_cancelled():
+                self.terminate()
+                return
+            self.poll()
+            time.sleep(settings.WORKER_POLL_INTERVAL)
+
+    def terminate(self):
+        """Remove the job's tasks; workers drop the results of those they are running."""
+        self.batch = []
+        derivative_tasks.objects.filter(derive_id=self.derivative_job).delete()
+
+    def reclaim(self):
+        """Return tasks whose worker stopped sending heartbeats to the queue, or fail them after
+        DERIVATIVE_TASK_ATTEMPTS tries."""
+        cutoff = timezone.now() - timedelta(seconds=settings.JOB_LEASE_TIMEOUT)
+        stale = derivative_tasks.objects.filter(derive_id=self.derivative_job, state="running", heartbeat__lt=cutoff)
+        for t in stale:
+            message = "No heartbeat from worker {0} since {1}.".format(t.worker, t.heartbeat)
+            if t.attempts >= settings.DERIVATIVE_TASK_ATTEMPTS:
+                with transaction.atomic():
+                    if derivative_tasks.objects.filter(task_id=t.task_id, heartbeat=t.heartbeat).delete()[0]:
+                        self.recorder.record_result(json.loads(t.task), {"error": message})
+                continue
+            # Only reclaim if nothing has changed since the task was read, e.g. a late heartbeat.
+            if derivative_tasks.objects.filter(task_id=t.task_id, state="running", heartbeat=t.heartbeat).update(
+                    state="queued", worker="", heartbeat=None):
+                logging.warning("Derivative task {0}: {1} Returned to queue.".format(t.task_id, message))
+
+
+def claim_task(worker):
+    """Mark the oldest queued task as running by worker; return it, or None if none could be claimed.
+
+    Uses SELECT ... FOR UPDATE SKIP LOCKED where the database supports it; otherwise the state is changed
+    with a conditional update. Either way a task can only be claimed by one worker.
+    """
+    now = timezone.now()
+    queued = derivative_tasks.objects.filter(state="queued").order_by("task_id")
+    if db.connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            task_ids = list(queued.select_for_update(skip_locked=True).values_list("task_id", flat=True)[:1])
+            if not task_ids:
+                return None
+            derivative_tasks.objects.filter(task_id=task_ids[0]).update(
+                state="running", worker=worker, heartbeat=now, attempts=F("attempts") + 1)
+            return derivative_tasks.objects.get(task_id=task_ids[0])
+
+    for task_id in queued.values_list("task_id", flat=True)[:10]:
+        claimed = derivative_tasks.objects.filter(task_id=task_id, state="queued").update(
+            state="running", worker=worker, heartbeat=now, attempts=F("attempts") + 1)
+        if claimed == 1:
+            return derivative_tasks.objects.get(task_id=task_id)
+    return None
+
+
+class DerivativeWorker(object):
+
+    """Claim derivative tasks from derivative_tasks and make them in a WorkerPool of up to `processes`.
+
+    Tasks are claimed one at a time while the pool can start them, so a worker never holds more than one
+    task it can't yet run. On SIGTERM or SIGINT the worker stops claiming tasks and waits for those it has.
+    """
+
+    def __init__(self, processes, poll_interval=5, heartbeat_interval=30):
+        """Set number of processes and intervals in seconds."""
+        self.name = worker_name()
+        self.processes = processes
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        # Task id: task, for tasks claimed and not yet recorded.
+        self.claimed = {}
+        # Derive id: Derivatives that records results of the job.
+        self.recorders = {}
+        self.stopping = False
+        self.last_heartbeat = 0
+
+    def run(self):
+        """Make derivatives until shut down."""
+        signal.signal(signal.SIGTERM, self.handle_signal)
+        signal.signal(signal.SIGINT, self.handle_signal)
+        budget = ResourceBudget(settings.DERIVATIVE_CPUS or None, settings.DERIVATIVE_MEMORY_RESERVE, settings.DERIVATIVE_IO_CAPACITY or None)
+        pool = WorkerPool(make_derivatives, self.processes, self.record, budget=budget)
+        logging.info("Derivative worker {0} started with {1} processes.".format(self.name, self.processes))
+        try:
+            while not self.stopping or self.claimed:
+                if not self.stopping:
+                    self.claim(pool)
+                self.heartbeat()
+                if pool.busy():
+                    pool.collect(wait=self.heartbeat_interval)
+                    pool.dispatch()
+                else:
+                    time.sleep(self.poll_interval)
+        finally:
+            pool.terminate()
+        logging.info("Derivative worker {0} stopped.".format(self.name))
+
+    def handle_signal(self, signum, frame):
+        logging.info("Shutting down after {0} claimed task(s) finish.".format(len(self.claimed)))
+        self.stopping = True
+
+    def claim(self, pool):
+        """Claim tasks while the pool has a worker free for them."""
+        while not self.stopping and not pool.pending and len(pool.busy()) < pool.size:
+            claimed = claim_task(self.name)
+            if claimed is None:
+                return
+            task = json.loads(claimed.task)
+            task["task_id"] = claimed.task_id
+            task["derive_id"] = claimed.derive_id_id
+            self.claimed[claimed.task_id] = task
+            pool.submit(task, timeout=task.get("timeout"), cost=task.get("cost"))
+
+    def heartbeat(self):
+        """If due, record that claimed tasks are still being worked on."""
+        if time.time() - self.last_heartbeat < self.heartbeat_interval:
+            return
+        self.last_heartbeat = time.time()
+        if self.claimed:
+            derivative_tasks.objects.filter(task_id__in=list(self.claimed), worker=self.name).update(heartbeat=timezone.now())
+
+    def record(self, task, result):
+        """Record results of a task in derivative_files, unless the task was cancelled or given to another worker."""
+        del self.claimed[task["task_id"]]
+        with transaction.atomic():
+            if not derivative_tasks.objects.filter(task_id=task["task_id"], worker=self.name).delete()[0]:
+                logging.info("Derivative task {0} is no longer held by this worker; result dropped.".format(task["task_id"]))
+                return
+            self.recorder(task["derive_id"]).record_result(task, result)
+
+    def recorder(self, derive_id):
+        if derive_id not in self.recorders:
+            self.recorders[derive_id] = Derivatives().load_job(derivative_jobs.objects.get(derive_id=derive_id))
+        return self.recorders[derive_id]
+
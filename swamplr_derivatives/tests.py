@@ -1,6 +1,453 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
-from django.test import TestCase
+from datetime import timedelta
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+from unittest import skipIf
+from derivatives import make_derivatives
+from engines import Image, brightness_contrast, fit_size, pyvips
+from manifest import file_checksum, is_up_to_date, source_state
+from plan import derivative_groups
+from pool import WorkerPool
+from proclr import PChain
+from resources import ResourceBudget
+from derivatives import Derivatives
+from discovery import SourceScanner, scan_source_files, source_filter
+from models import derivative_files, derivative_jobs, derivative_results, derivative_tasks, job_derivatives
+from swamplr_jobs.models import jobs, job_types, status
+from task_queue import DerivativeWorker, TaskQueue, claim_task
+import json
+import os
+import shutil
+import signal
+import tempfile
+import threading
+import time
 
-# Create your tests here.
+
+def square(n):
+    return n * n
+
+
+def sleep_or_fail(n):
+    if n < 0:
+        raise ValueError("negative")
+    time.sleep(n)
+    return os.getpid()
+
+
+class WorkerPoolTest(SimpleTestCase):
+
+    def run_pool(self, func, tasks, size, timeout=None):
+        results = []
+        pool = WorkerPool(func, size, lambda task, result: results.append((task, result)), timeout=timeout)
+        for task in tasks:
+            pool.submit(task)
+        pool.join()
+        return dict(results)
+
+    def test_results(self):
+        self.assertEqual(self.run_pool(square, range(20), 3), dict((n, n * n) for n in range(20)))
+
+    def test_workers_are_reused(self):
+        pids = self.run_pool(sleep_or_fail, [0.01 * n for n in range(1, 9)], 2)
+        self.assertEqual(len(set(pids.values())), 2)
+
+    def test_errors_and_timeouts(self):
+        start = time.time()
+        results = self.run_pool(sleep_or_fail, [30, 30, -1, 0], 3, timeout=0.5)
+        # Both slow tasks time out together, rather than one after the other.
+        self.assertLess(time.time() - start, 5)
+        self.assertEqual(results[30], {"error": "Timed out after 0.5 seconds."})
+        self.assertEqual(results[-1], {"error": "ValueError: negative"})
+        self.assertIsInstance(results[0], int)
+
+    def test_collect_interrupted_by_signal(self):
+        results = []
+        pool = WorkerPool(sleep_or_fail, 1, lambda task, result: results.append(result))
+        self.addCleanup(pool.terminate)
+        signals = []
+        previous = signal.signal(signal.SIGTERM, lambda signum, frame: signals.append(signum))
+        self.addCleanup(signal.signal, signal.SIGTERM, previous)
+        pool.submit(2)
+        # SIGTERM to this process during the select, as DerivativeWorker gets on shutdown.
+        timer = threading.Timer(0.5, os.kill, (os.getpid(), signal.SIGTERM))
+        timer.start()
+        start = time.time()
+        pool.collect(wait=30)
+        timer.join()
+        self.assertEqual(signals, [signal.SIGTERM])
+        self.assertLess(time.time() - start, 1.5)
+        # The task is still running and its result is collected.
+        self.assertEqual(len(pool.busy()), 1)
+        pool.join()
+        self.assertEqual(len(results), 1)
+        self.assertIsInstance(results[0], int)
+
+
+def sleep_span(n):
+    start = time.time()
+    time.sleep(n)
+    return start, time.time()
+
+
+class ResourceBudgetTest(SimpleTestCase):
+
+    def test_fits(self):
+        budget = ResourceBudget(cpus=2, memory_reserve=0, io_capacity=2)
+        heavy = {"cpu": 4, "memory": 1, "io": 1}
+        light = {"cpu": 1, "memory": 1, "io": 1}
+        # A task larger than the machine still runs when nothing else is.
+        self.assertTrue(budget.fits(heavy))
+        budget.acquire(light)
+        self.assertFalse(budget.fits(heavy))
+        self.assertTrue(budget.fits(light))
+        budget.acquire(light)
+        self.assertFalse(budget.fits(light))
+        budget.release(light)
+        budget.release(light)
+        self.assertTrue(budget.fits(heavy))
+
+    def test_memory(self):
+        budget = ResourceBudget(cpus=64, memory_reserve=0)
+        budget.acquire({"cpu": 1, "memory": 1, "io": 1})
+        self.assertFalse(budget.fits({"cpu": 1, "memory": budget.capacity, "io": 1}))
+        self.assertTrue(budget.fits({"cpu": 1, "memory": 1, "io": 1}))
+
+    def test_pool_admission(self):
+        spans = []
+        budget = ResourceBudget(cpus=2)
+        pool = WorkerPool(sleep_span, 4, lambda task, result: spans.append(result), budget=budget)
+        for n in range(3):
+            pool.submit(0.2, cost={"cpu": 2, "memory": 1, "io": 1})
+        pool.join()
+        spans.sort()
+        # Tasks needing both cores run one at a time, although four workers are allowed.
+        self.assertTrue(all(a[1] <= b[0] for a, b in zip(spans, spans[1:])))
+
+
+class PChainTest(SimpleTestCase):
+
+    def test_pipeline(self):
+        # More output than a pipe buffer holds passes between commands, and only the tail is kept.
+        pchain = PChain(capture_limit=1024)
+        pchain.add("head -c 5000000 /dev/zero", PChain.PIPE)
+        pchain.add("cat", PChain.PIPE)
+        pchain.add("wc -c")
+        self.assertEqual(pchain.run(), 0)
+        self.assertEqual(pchain.stdout().strip(), b"5000000")
+        self.assertEqual([u["exit_code"] for u in pchain.usage()], [0, 0, 0])
+        self.assertTrue(all(u["max_rss"] > 0 for u in pchain.usage()))
+
+        pchain = PChain(capture_limit=1024)
+        pchain.add("head -c 100000 /dev/zero")
+        self.assertEqual(pchain.run(), 0)
+        self.assertEqual(len(pchain.stdout()), 1024)
+
+    def test_and_or(self):
+        pchain = PChain()
+        pchain.add("false", PChain.OR)
+        pchain.add("echo second")
+        self.assertEqual(pchain.run(), 0)
+        self.assertEqual(pchain.stdout(), b"second\n")
+
+        pchain = PChain()
+        pchain.add("no-such-command-here")
+        pchain.add("echo second")
+        self.assertEqual(pchain.run(), 1)
+        self.assertIn(b"Could not run", pchain.stderr())
+
+    def test_timeouts(self):
+        start = time.time()
+        pchain = PChain()
+        pchain.add("sleep 30", timeout=0.2)
+        self.assertNotEqual(pchain.run(), 0)
+        self.assertTrue(pchain.usage()[0]["timed_out"])
+
+        # The chain's timeout stops commands the command started too.
+        pchain = PChain(timeout=0.2)
+        pchain.add("sh -c 'sleep 30 & sleep 30'")
+        self.assertNotEqual(pchain.run(), 0)
+        self.assertIn(b"Timed out", pchain.stderr())
+        self.assertLess(time.time() - start, 5)
+
+
+class DerivativeGroupsTest(SimpleTestCase):
+
+    definitions = {
+        "normalized": {"input": None},
+        "jpeg_low": {"input": "normalized"},
+        "jpeg_high": {"input": "normalized"},
+        "thumbnail": {"input": "jpeg_low"},
+        "jp2": {"input": None},
+    }
+
+    def test_groups(self):
+        groups = derivative_groups(["jp2", "thumbnail", "jpeg_high"], self.definitions)
+        self.assertEqual(groups, [
+            [("jp2", True)],
+            [("normalized", False), ("jpeg_low", False), ("thumbnail", True), ("jpeg_high", True)],
+        ])
+
+    def test_unknown_and_cyclic_inputs(self):
+        self.assertRaises(ValueError, derivative_groups, ["a"], {"a": {"input": "b"}})
+        self.assertRaises(ValueError, derivative_groups, ["a"], {"a": {"input": "b"}, "b": {"input": "a"}})
+
+
+class MakeDerivativesTest(SimpleTestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.source = os.path.join(self.dir, "page.tif")
+        with open(self.source, "w") as f:
+            f.write("master")
+
+    def step(self, name, save, input_name, command):
+        return {"derive_type": name, "save": save, "input": input_name, "output_file": "{0}_" + name.upper() + ".txt",
+                "commands": [(command, "AND")]}
+
+    def test_steps_share_intermediates(self):
+        task = {"source_file": self.source, "replace": False, "incremental": False, "brightness": 0, "contrast": 0, "steps": [
+            self.step("normalized", False, None, "cp {input_file} {output_file}"),
+            self.step("low", True, "normalized", "cp {input_file} {output_file}"),
+            self.step("broken", False, "normalized", "false"),
+            self.step("thumbnail", True, "broken", "cp {input_file} {output_file}"),
+        ]}
+        results = make_derivatives(task)
+        self.assertEqual(results["low"]["result"], "success")
+        self.assertEqual(open(os.path.join(self.dir, "page_LOW.txt")).read(), "master")
+        self.assertEqual(results["thumbnail"]["result"], "failure")
+        # The scratch directory holding the intermediates is removed.
+        self.assertFalse(os.path.exists(os.path.dirname(results["normalized"]["target_file"])))
+        self.assertEqual(sorted(os.listdir(self.dir)), ["page.tif", "page_LOW.txt"])
+
+
+class EngineTest(SimpleTestCase):
+
+    def test_fit_size(self):
+        self.assertEqual(fit_size(4000, 3000, "200x200"), (200, 150))
+        self.assertEqual(fit_size(4000, 3000, "2000"), (2000, 1500))
+        self.assertEqual(fit_size(4000, 3000, "x300"), (400, 300))
+        self.assertEqual(fit_size(4000, 3000, "50%"), (2000, 1500))
+        self.assertEqual(fit_size(100, 50, "200x200>"), (100, 50))
+        self.assertEqual(fit_size(100, 50, "200x200"), (200, 100))
+
+    def test_brightness_contrast(self):
+        slope, intercept = brightness_contrast(0, 0)
+        self.assertAlmostEqual(slope, 1.0)
+        self.assertAlmostEqual(intercept, 0.0)
+        # As ImageMagick's -brightness-contrast 10x20: slope tan(0.3 pi), centred then raised by 10%.
+        slope, intercept = brightness_contrast(10, 20)
+        self.assertAlmostEqual(slope, 1.37638, places=5)
+        self.assertAlmostEqual(intercept, -0.069371, places=5)
+
+    @skipIf(Image is None, "Pillow is not installed")
+    def test_pillow_engine(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        source = os.path.join(directory, "page.tif")
+        Image.new("RGBA", (400, 300), (0, 0, 0, 0)).save(source)
+        operations = {"flatten": "yes", "resize": "200x200", "adjust": "yes", "quality": "75"}
+        task = {"source_file": source, "replace": False, "incremental": False, "brightness": 10, "contrast": 0, "steps": [
+            {"derive_type": "thumbnail", "save": True, "input": None, "output_file": "{0}_TN.jpg", "commands": [],
+             "engine": "pillow", "operations": operations},
+        ]}
+        results = make_derivatives(task)
+        self.assertEqual(results["thumbnail"]["result"], "success")
+        thumbnail = Image.open(os.path.join(directory, "page_TN.jpg"))
+        self.assertEqual((thumbnail.format, thumbnail.mode, thumbnail.size), ("JPEG", "RGB", (200, 150)))
+        # Transparent pixels are flattened onto white.
+        self.assertTrue(min(thumbnail.getpixel((100, 75))) > 250)
+
+    @skipIf(pyvips is None or Image is None, "pyvips or Pillow is not installed")
+    def test_pyvips_engine(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        source = os.path.join(directory, "page.tif")
+        Image.new("RGBA", (400, 300), (0, 0, 0, 0)).save(source)
+        operations = {"flatten": "yes", "resize": "200x200", "adjust": "yes", "quality": "75", "density": "72"}
+        task = {"source_file": source, "replace": False, "incremental": False, "brightness": 10, "contrast": 0, "steps": [
+            {"derive_type": "thumbnail", "save": True, "input": None, "output_file": "{0}_TN.jpg", "commands": [],
+             "engine": "pyvips", "operations": operations},
+        ]}
+        results = make_derivatives(task)
+        self.assertEqual(results["thumbnail"]["result"], "success")
+        thumbnail = Image.open(os.path.join(directory, "page_TN.jpg"))
+        self.assertEqual((thumbnail.format, thumbnail.mode, thumbnail.size), ("JPEG", "RGB", (200, 150)))
+        self.assertEqual(tuple(int(round(d)) for d in thumbnail.info["dpi"]), (72, 72))
+        self.assertTrue(min(thumbnail.getpixel((100, 75))) > 250)
+
+
+class ManifestTest(SimpleTestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.source = os.path.join(self.dir, "page.tif")
+        self.target = os.path.join(self.dir, "page_TN.jpg")
+        for path in (self.source, self.target):
+            with open(path, "w") as f:
+                f.write("master")
+
+    def entry(self, **kwargs):
+        state = source_state(self.source)
+        entry = {"source_mtime": state["mtime"], "source_size": state["size"],
+                 "source_checksum": file_checksum(self.source), "command_hash": "c"}
+        entry.update(kwargs)
+        return entry
+
+    def test_is_up_to_date(self):
+        entry = self.entry()
+        self.assertTrue(is_up_to_date(self.source, self.target, entry, source_state(self.source), "c"))
+        self.assertFalse(is_up_to_date(self.source, self.target, entry, source_state(self.source), "changed"))
+        self.assertFalse(is_up_to_date(self.source, self.target + ".missing", entry, source_state(self.source), "c"))
+
+        # Touched, but the same content.
+        os.utime(self.source, (0, entry["source_mtime"] + 10))
+        self.assertTrue(is_up_to_date(self.source, self.target, entry, source_state(self.source), "c"))
+        self.assertFalse(is_up_to_date(self.source, self.target, self.entry(source_mtime=0, source_checksum=None),
+                                       source_state(self.source), "c"))
+
+        with open(self.source, "w") as f:
+            f.write("edited")
+        self.assertFalse(is_up_to_date(self.source, self.target, entry, source_state(self.source), "c"))
+
+    def test_no_manifest_entry(self):
+        os.utime(self.target, (0, os.path.getmtime(self.source) - 10))
+        self.assertFalse(is_up_to_date(self.source, self.target, None, source_state(self.source), "c"))
+        os.utime(self.target, (0, os.path.getmtime(self.source) + 10))
+        self.assertTrue(is_up_to_date(self.source, self.target, None, source_state(self.source), "c"))
+
+
+class NotCancelled(object):
+
+    def is_cancelled(self):
+        return False
+
+
+class TaskQueueTest(TestCase):
+
+    def setUp(self):
+        for label in ("Success", "Failure", "Skipped"):
+            derivative_results.objects.create(label=label)
+        job_status = status.objects.create(status="Test running", default="", failure="", running="y", success="")
+        job_type = job_types.objects.create(label="Derivatives", app_name="swamplr_derivatives")
+        job = jobs.objects.create(created=timezone.now(), status_id=job_status, type_id=job_type)
+        self.derivative_job = derivative_jobs.objects.create(job_id=job, source_dir="/tmp", replace_on_duplicate="",
+                                                             source_file_extension="tif")
+        job_derivatives.objects.create(derive_id=self.derivative_job, derive_type="thumbnail", parameters="")
+        self.queue = TaskQueue(Derivatives().load_job(self.derivative_job), NotCancelled())
+
+    def task(self, source_file):
+        return {"source_file": source_file, "steps": [{"derive_type": "thumbnail", "save": True, "output_file": "{0}_TN.jpg"}]}
+
+    def test_claim_and_record(self):
+        for n in range(2):
+            self.queue.submit(self.task("/tmp/{0}.tif".format(n)), timeout=10, cost={"cpu": 1, "memory": 1, "io": 1})
+        self.queue.flush()
+        first, second = claim_task("a"), claim_task("b")
+        self.assertEqual((first.source_file, first.worker), ("/tmp/0.tif", "a"))
+        self.assertEqual((second.source_file, second.worker), ("/tmp/1.tif", "b"))
+        self.assertIsNone(claim_task("c"))
+        self.assertEqual(json.loads(first.task)["timeout"], 10)
+
+        worker = DerivativeWorker(1)
+        worker.name = "a"
+        task = dict(json.loads(first.task), task_id=first.task_id, derive_id=first.derive_id_id)
+        worker.claimed[first.task_id] = task
+        worker.record(task, {"thumbnail": {"result": "success", "cpu": 0.5}})
+        row = derivative_files.objects.get()
+        self.assertEqual((row.source_file, row.target_file, row.result_id.label, row.cpu_time), ("/tmp/0.tif", "/tmp/0_TN.jpg", "Success", 0.5))
+        self.assertEqual(list(derivative_tasks.objects.values_list("task_id", flat=True)), [second.task_id])
+
+        # A result for a task this worker no longer holds is dropped.
+        task = dict(json.loads(second.task), task_id=second.task_id, derive_id=second.derive_id_id)
+        worker.claimed[second.task_id] = task
+        worker.record(task, {"thumbnail": {"result": "success"}})
+        self.assertEqual(derivative_files.objects.count(), 1)
+
+    def test_reclaim(self):
+        self.queue.submit(self.task("/tmp/0.tif"))
+        self.queue.flush()
+        stale = timezone.now() - timedelta(days=1)
+        claim_task("a")
+        derivative_tasks.objects.update(heartbeat=stale)
+        self.queue.reclaim()
+        self.assertEqual(derivative_tasks.objects.get().state, "queued")
+
+        # Failed once every attempt's worker has stopped.
+        derivative_tasks.objects.update(state="running", worker="b", heartbeat=stale, attempts=3)
+        self.queue.reclaim()
+        self.assertFalse(derivative_tasks.objects.exists())
+        self.assertEqual(derivative_files.objects.get().result_id.label, "Failure")
+
+
+class DiscoveryTest(SimpleTestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        os.makedirs(os.path.join(self.dir, "b"))
+        os.makedirs(os.path.join(self.dir, "a", "c"))
+        for name in ["1.tif", "2.TIF", "1_NEW.tif", "1_TN.jpg", "b/3.tif", "a/4.tif", "a/c/5.tif"]:
+            open(os.path.join(self.dir, name), "w").close()
+        os.symlink(os.path.join(self.dir, "a"), os.path.join(self.dir, "link"))
+        self.match = source_filter("tif", ["_NEW.tif", "_TN.jpg"])
+
+    def test_scan_matches_walk(self):
+        walked = []
+        for root, dirs, files in os.walk(self.dir):
+            for f in files:
+                f = f.replace(".TIF", ".tif")
+                if f.endswith(".tif") and not f.endswith(("_NEW.tif", "_TN.jpg")):
+                    walked.append(os.path.join(root, f))
+        scanned = list(scan_source_files(self.dir, self.match))
+        self.assertEqual(sorted(scanned), sorted(walked))
+        self.assertEqual(len(scanned), 5)
+        self.assertIn(os.path.join(self.dir, "2.tif"), scanned)
+        # Files of a directory come before those of its sub-directories.
+        self.assertLess(scanned.index(os.path.join(self.dir, "a", "4.tif")), scanned.index(os.path.join(self.dir, "a", "c", "5.tif")))
+
+    def test_scanner_batches(self):
+        scanner = SourceScanner(self.dir, self.match, size=2)
+        scanner.start()
+        batches = list(scanner.batches(2))
+        self.assertTrue(all(1 <= len(b) <= 2 for b in batches))
+        self.assertEqual(sorted(sum(batches, [])), sorted(scan_source_files(self.dir, self.match)))
+
+        scanner = SourceScanner(os.path.join(self.dir, "missing"), self.match)
+        scanner.start()
+        self.assertEqual(list(scanner.batches(10)), [])
+        self.assertEqual(len(scanner.errors), 1)
+
+    def test_on_wait_while_scan_is_slow(self):
+        def slow_match(name):
+            time.sleep(0.3)
+            return self.match(name)
+
+        waits = []
+        scanner = SourceScanner(self.dir, slow_match)
+        scanner.start()
+        files = sum(scanner.batches(10, lambda: waits.append(time.time()) and False), [])
+        self.assertEqual(sorted(files), sorted(scan_source_files(self.dir, self.match)))
+        self.assertGreater(len(waits), 5)
+
+        # Returning True, e.g. when the job is cancelled, stops waiting for files.
+        scanner = SourceScanner(self.dir, slow_match)
+        scanner.start()
+        start = time.time()
+        self.assertEqual(list(scanner.batches(10, lambda: True)), [])
+        self.assertLess(time.time() - start, 0.3)
+        scanner.stop()
+
+    def test_pool_poll(self):
+        results = []
+        pool = WorkerPool(square, 2, lambda task, result: results.append(result))
+        self.addCleanup(pool.terminate)
+        pool.submit(3)
+        deadline = time.time() + 5
+        while not results and time.time() < deadline:
+            pool.poll()
+        self.assertEqual(results, [9])
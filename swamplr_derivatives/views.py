@@ -10,11 +10,17 @@ from django.conf import settings
 from swamplr_jobs.models import status
 from models import derivative_files, derivative_jobs, job_derivatives, derivative_results
 from swamplr_jobs.views import add_job, job_status
+from swamplr_jobs.counters import get_counts
+from swamplr_jobs.paging import result_sums, combined_result, filter_combined_result, keyset_page
+from swamplr_jobs.export import iterate_rows
+from django.db.models import Count
 from apps import SwamplrDerivativesConfig
 from datetime import datetime
 import logging
 import sys
 from derivatives import Derivatives
+from engines import get_engine_options
+from resources import get_cost
 
 def get_nav_bar():
     """Set contents of navigation bar for current app."""
@@ -73,6 +79,18 @@ def get_command_list(config, source_type, option_key):
         command_list.append((config.get(option_key, "command"), "AND"))
     return command_list
 
+def get_step_timeouts(config, option_key):
+    """Get seconds each command of get_command_list may run, or None for no limit of its own."""
+    commands = config.options(option_key)
+    command_steps = sorted([int(c.split(".")[1]) for c in commands if c.startswith("step.") and c.endswith(".command")])
+    timeouts = []
+    for c in command_steps:
+        timeout_key = "step.{0}.timeout".format(c)
+        timeouts.append(config.getfloat(option_key, timeout_key) if config.has_option(option_key, timeout_key) else None)
+    if len(timeouts) == 0 and config.has_option(option_key, "command"):
+        timeouts.append(None)
+    return timeouts
+
 def get_derivative_settings(source_type):
     """Get the derivative types and settings for the specified source type."""
 
@@ -84,13 +102,36 @@ def get_derivative_settings(source_type):
     for opt in options:
 
         option_key = "derive."+source_type.lower()+"."+opt.lower()
-        command_list = get_command_list(config, source_type, option_key)
-        output_file = config.get(option_key, "output_file")
-        derive = {"derivative_type": opt, "commands": command_list, "output_file": output_file}
-        derive_settings.append(derive)
+        derive_settings.append(get_derive_step(config, source_type, opt, option_key))
+
+    # Intermediates are made only as inputs of other derivatives, and never saved.
+    prefix = "intermediate." + source_type.lower() + "."
+    for section in config.sections():
+        if section.startswith(prefix):
+            derive = get_derive_step(config, source_type, section[len(prefix):], section)
+            derive["intermediate"] = True
+            derive_settings.append(derive)
 
     return derive_settings
 
+def get_derive_step(config, source_type, name, option_key):
+    """Get command settings of a derivative or intermediate from its config section.
+
+    The optional input setting names the derivative or intermediate that {input_file} is made from; by
+    default it is the source file. The optional engine setting makes the derivative in process (see engines.py),
+    with the commands as a fallback if the engine isn't installed. The optional timeout setting is seconds all
+    the commands may run, instead of DERIVATIVE_TIMEOUT, and step.N.timeout limits a single command. The
+    optional cost setting names a [cost.<name>] section, the resources the derivative needs (see resources.py).
+    """
+    command_list = get_command_list(config, source_type, option_key)
+    timeout = config.getfloat(option_key, "timeout") if config.has_option(option_key, "timeout") else None
+    output_file = config.get(option_key, "output_file")
+    input_name = config.get(option_key, "input").strip() if config.has_option(option_key, "input") else None
+    engine, operations = get_engine_options(config, option_key)
+    return {"derivative_type": name, "commands": command_list, "output_file": output_file, "input": input_name or None,
+            "engine": engine, "operations": operations, "timeout": timeout, "step_timeouts": get_step_timeouts(config, option_key),
+            "cost": get_cost(config, option_key)}
+
 
 def get_configs():
     """Load derivative config file."""
@@ -136,13 +177,15 @@ def add_derivatives_job(request, item_type):
 
         object_derivatives = clean["derive_types"]
         replace = "y" if clean["replace_on_duplicate"] else ""
+        incremental = "y" if clean["incremental"] else ""
         subset = int(clean["subset_value"]) if clean["subset_value"] else 0
 
-        new_job = add_job(SwamplrDerivativesConfig.name)
+        new_job = add_job(SwamplrDerivativesConfig.name, priority=clean["priority"])
         derivative_job = derivative_jobs.objects.create(
             job_id=new_job,
             source_dir=clean["path_list_selected"],
             replace_on_duplicate=replace,
+            incremental=incremental,
             subset=subset,
             source_file_extension=item_type,
             brightness=clean["brightness_value"],
@@ -224,20 +267,39 @@ def get_derive_settings(item_type, derive_type):
 
 def get_status_info(job):
     """Required function: return infor about current job for display."""
-    job_id = job.job_id
+    return get_status_info_many([job])[job.job_id], []
 
-    # Get data about successes, skips, failures.
-    deriv_job = derivative_jobs.objects.get(job_id=job_id)
-    job_derives = job_derivatives.objects.filter(derive_id=deriv_job)
-    derive_types = ", ".join([j.derive_type for j in job_derives])
+def get_status_info_many(jobs):
+    """Return dict of job id: info for display, for a page of jobs, using a fixed number of queries."""
+    job_ids = [job.job_id for job in jobs]
+    deriv_jobs = dict((d.job_id_id, d) for d in derivative_jobs.objects.filter(job_id__in=job_ids))
 
-    result_display = "<span class='label label-success'>{0} Succeeded</span> <span class='label label-danger'>{1} Failed</span> <span class='label label-default'>{2} Skipped</span>"
-    results = get_job_objects(job_id)
-    result_message = result_display.format(results["status_count"]["Success"], results["status_count"]["Failure"], results["status_count"]["Skipped"])
-    info = ["Filetype: {0} <br/>".format(deriv_job.source_file_extension), "Derivatives: {0} <br/>".format(derive_types),
-            result_message]
+    derive_types = {}
+    for derive_id, derive_type in job_derivatives.objects.filter(derive_id__in=deriv_jobs.values()).values_list("derive_id", "derive_type"):
+        derive_types.setdefault(derive_id, []).append(derive_type)
+
+    # Get data about successes, skips, failures: totals of derivatives created.
+    counts = get_counts(job_ids)
 
-    return info, []
+    result_display = "<span class='label label-success'>{0} Succeeded</span> <span class='label label-danger'>{1} Failed</span> <span class='label label-default'>{2} Skipped</span>"
+    info = {}
+    for job_id in job_ids:
+        deriv_job = deriv_jobs[job_id]
+        result_message = result_display.format(counts[job_id]["Success"], counts[job_id]["Failure"], counts[job_id]["Skipped"])
+        info[job_id] = ["Filetype: {0} <br/>".format(deriv_job.source_file_extension),
+                        "Derivatives: {0} <br/>".format(", ".join(derive_types.get(deriv_job.derive_id, []))),
+                        result_message]
+    return info
+
+def get_result_counts(jobs):
+    """Return dict of job id: {result label: count}, counted from result rows; used to rebuild job totals."""
+    job_ids = [job.job_id for job in jobs]
+    counts = dict((job_id, {}) for job_id in job_ids)
+    rows = derivative_files.objects.filter(job_derive_id__derive_id__job_id__in=job_ids).values_list(
+        "job_derive_id__derive_id__job_id", "result_id__label").annotate(Count("pk"))
+    for job_id, label, count in rows:
+        counts[job_id][label] = count
+    return counts
 
 def get_job_objects(job_id, job_type=None):
     """Gather all objects created by the given job, and count successes/failures/skips."""
@@ -294,6 +356,58 @@ def get_job_objects(job_id, job_type=None):
 
     return results
 
+def get_job_objects_page(job, after=None, limit=50, result=None, datastream=None, prefix=None):
+    """Return one page of a job's source files for the object browser, grouped in SQL.
+
+    kwargs:
+        after(str): cursor from the previous page.
+        limit(int): source files per page.
+        result(str): only source files with this result (Success, Failure or Skipped).
+        datastream(str): only results for this derivative type.
+        prefix(str): only source files whose path starts with prefix.
+    returns:
+        (dict): "objects", and "next", the cursor for the following page or None.
+    """
+    rows = derivative_files.objects.filter(job_derive_id__derive_id__job_id=job)
+    if datastream:
+        rows = rows.filter(job_derive_id__derive_type=datastream)
+    if prefix:
+        rows = rows.filter(source_file__startswith=prefix)
+    groups = filter_combined_result(rows.values("source_file").annotate(**result_sums()), result)
+    page, next_key = keyset_page(groups, "source_file", after=after, limit=limit)
+
+    by_file = dict((g["source_file"], {"path": g["source_file"], "result": combined_result(g), "subs": []}) for g in page)
+    subs = rows.filter(source_file__in=by_file.keys()).order_by("source_file", "derive_file_id").values_list(
+        "source_file", "job_derive_id__derive_type", "target_file", "created", "result_id__label")
+    for source_file, derive_type, target_file, created, file_result in subs:
+        by_file[source_file]["subs"].append({
+            "name": derive_type,
+            "file": os.path.basename(target_file) if target_file else "~",
+            "created": created,
+            "result": file_result,
+        })
+
+    return {"objects": [by_file[g["source_file"]] for g in page], "next": next_key}
+
+def get_result_querysets(job):
+    """Return querysets of every per-file result row of job, for archiving."""
+    return [derivative_files.objects.filter(job_derive_id__derive_id__job_id=job)]
+
+def get_job_results(job, result=None):
+    """Return columns and an iterator over every derivative file result of job, for export.
+
+    kwargs:
+        result(str): only rows with this result label.
+    returns:
+        (list, iterator): column names, and rows as tuples in the same order.
+    """
+    rows = derivative_files.objects.filter(job_derive_id__derive_id__job_id=job)
+    if result:
+        rows = rows.filter(result_id__label=result)
+    columns = ["source_file", "derive_type", "target_file", "created", "result", "cpu_time", "max_rss"]
+    fields = ["source_file", "job_derive_id__derive_type", "target_file", "created", "result_id__label", "cpu_time", "max_rss"]
+    return columns, iterate_rows(rows, "derive_file_id", fields)
+
 def update_results(object_head, results, fail_id):
     """Update results object."""
     all_result_ids = [obj["result_id"] for obj in object_head["subs"]]
@@ -319,6 +433,7 @@ def get_job_details(job):
         ("Derivatives ID", deriv_job.derive_id),
         ("Source Directory", deriv_job.source_dir),
         ("Replace Existing Derivatives", "Y" if deriv_job.replace_on_duplicate == "y" else "N"),
+        ("Only Replace Changed Derivatives", "Y" if deriv_job.incremental == "y" else "N"),
         ("Items To Process", deriv_job.subset if deriv_job.subset != 0 else "All"),
         ("Brightness", deriv_job.brightness),
         ("Contrast", deriv_job.contrast)
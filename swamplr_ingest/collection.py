@@ -1,15 +1,26 @@
 """Generic collections class for others to inherit."""
 from __future__ import print_function
 from swamplr import settings
-from swamplr_jobs.models import job_messages, status, jobs
-from models import object_results, job_objects, datastreams
+from swamplr_jobs.models import job_messages, status
+from swamplr_jobs.cancellation import CancellationToken
 from django.utils import timezone
 from lxml import etree
 import os
 import json
 import logging
-from hint import HintFiles
+import threading
+import signal
+from hint import HintFiles, HintResolver
 from ingest import Ingest
+from pool import IngestPool
+from pids import PidPool
+from manifest import CollectionManifest
+from results import ResultRecorder
+
+
+def raise_system_exit(signum, frame):
+    """Signal handler: exit via SystemExit so that finally blocks run."""
+    raise SystemExit("Received signal {0}".format(signum))
 
 
 class CollectionIngest(object):
@@ -26,11 +37,23 @@ class CollectionIngest(object):
 
         self.id_prefix = ""
         self.root_dir = ""
+        # One-pass scan of the source directory, made at the start of the ingest.
+        self.manifest = None
+        # Parsed and merged hint files, shared by all objects.
+        self.hint_resolver = None
+        # Buffered job_objects rows.
+        self.recorder = None
+        # Checks whether the job has been stopped by the user.
+        self.cancel_token = None
 
         # Count outcomes for display to user.
         self.successful_objects = 0
         self.failed_objects = 0
         self.skipped_objects = 0
+        self.count_lock = threading.Lock()
+
+        # Per-thread state, so objects can be ingested in parallel (see INGEST_THREADS).
+        self.local = threading.local()
 
         self.job = {}
         self.collection = {}
@@ -42,10 +65,31 @@ class CollectionIngest(object):
         self.simple_content_models = ["large_image", "pdf", "newspaper_page", "oral_histories", "audio", "book_page"]
 
         self.pidcounter = 0
+        # New pids are reserved in blocks and shared by all objects in the job.
+        self.pid_pool = PidPool(block_size=settings.PID_BLOCK_SIZE)
         self.deleted_pid = ""
 
         self.error_messages = []
 
+    @property
+    def object_type(self):
+        """Object type assessed for the object being processed by the current thread."""
+        return getattr(self.local, "object_type", None)
+
+    @object_type.setter
+    def object_type(self, value):
+        self.local.object_type = value
+
+    def count_object(self, outcome):
+        """Increment outcome counter: 'successful', 'failed' or 'skipped'."""
+        with self.count_lock:
+            setattr(self, outcome + "_objects", getattr(self, outcome + "_objects") + 1)
+
+    def processed_count(self):
+        """Number of objects counted toward the job subset."""
+        with self.count_lock:
+            return self.successful_objects + self.failed_objects
+
     def start_ingest(self, ingest_job, datastreams, collection_configs, collection_defaults):
         """Initiate ingest according to parameters from job in database and settings in collections.json.
 
@@ -62,11 +106,31 @@ class CollectionIngest(object):
             created=timezone.now(),
             message="Initializing Ingest Job."
         )
+        self.scan_source_dir()
+        self.hint_resolver = HintResolver(manifest=self.manifest, check_interval=settings.HINT_CHECK_INTERVAL)
+
+        self.recorder = ResultRecorder(
+            ingest_job.job_id, batch_size=settings.RESULT_BATCH_SIZE, flush_interval=settings.RESULT_FLUSH_INTERVAL
+        )
+        self.cancel_token = CancellationToken(ingest_job.job_id.job_id)
+        previous_handler = self.handle_sigterm()
+        try:
+            status_id = self.ingest_root_dir(status_id)
+        finally:
+            # Write buffered results whether the ingest completed, was stopped or failed.
+            self.recorder.flush()
+            if previous_handler is not None:
+                signal.signal(signal.SIGTERM, previous_handler)
+
+        return status_id
+
+    def ingest_root_dir(self, status_id):
+        """Ingest object directories in root dir; return status id, which changes if job is cancelled."""
         # Find root_dir (folder should end in '_root'
         self.root_dir = self.get_root_dir()
         
         # Check if selected dir might perchance be an object directory itself. If so, process that object directory only. 
-        if any([f.endswith(".xml") for f in os.listdir(self.root_dir)]):
+        if any([f.endswith(".xml") for f in self.manifest.get_files(self.root_dir)]):
             logging.info("Found object dir at root: {0}".format(self.root_dir))
 
             full_path = self.root_dir
@@ -75,26 +139,46 @@ class CollectionIngest(object):
                 self.prepare(full_path, sequence=1)
 
         else:
-            for i, dir_x in enumerate(self.get_sub_dirs(self.root_dir)):
+            # Top-level objects are independent, so may be ingested in parallel.
+            pool = IngestPool(self, settings.INGEST_THREADS) if settings.INGEST_THREADS > 1 else None
 
-                logging.info("Processing {0}".format(dir_x))
+            try:
+                for i, dir_x in enumerate(self.get_sub_dirs(self.root_dir)):
 
-                # Check if job has been cancelled.
-                failure_status = jobs.objects.get(job_id=self.job.job_id.job_id).status_id.failure 
-                if failure_status == "manual":
-                    status_id = status.objects.get(status="Cancelled By User").status_id
-                    break
-                # Stop after processing specified number of items.
-                if ((self.successful_objects + self.failed_objects) >= self.job.subset > 0):
-                    break
+                    logging.info("Processing {0}".format(dir_x))
 
-                full_path = os.path.join(self.root_dir, dir_x)
+                    # Wait for a free worker; stop if one of them has failed.
+                    if pool and not pool.wait_for_slot(subset=self.job.subset):
+                        break
+
+                    # Check if job has been cancelled.
+                    if self.cancel_token.is_cancelled():
+                        status_id = status.objects.get(status="Cancelled By User").status_id
+                        break
+                    # Stop after processing specified number of items.
+                    if self.processed_count() >= self.job.subset > 0:
+                        break
 
-                # Move to next item if this path is set out to be excluded.
-                if any([ex in full_path for ex in self.collection["exclude_strings"]]):
-                    continue
+                    full_path = os.path.join(self.root_dir, dir_x)
+
+                    # Move to next item if this path is set out to be excluded.
+                    if any([ex in full_path for ex in self.collection["exclude_strings"]]):
+                        continue
+
+                    if pool:
+                        pool.submit(full_path, i)
+                    else:
+                        self.prepare(full_path, sequence=i)
+            except BaseException:
+                # Stopped (SIGTERM's SystemExit) or failed: objects not yet started are dropped, and those
+                # being ingested finish before the exception propagates.
+                if pool:
+                    pool.close(cancel=True)
+                raise
+            # Objects already started are allowed to finish, even if the job was cancelled.
+            if pool:
+                pool.close()
 
-                self.prepare(full_path, sequence=i)
         return status_id
 
     def prepare(self, full_path, sequence=1):
@@ -127,40 +211,49 @@ class CollectionIngest(object):
 
         in_object = Ingest(
             path, self.root_dir, self.job, self.collection, self.collection_defaults, self.datastreams,
-            self.object_type, child=child, compound=compound, parent_pid=parent_pid, sequence=sequence
+            self.object_type, child=child, compound=compound, parent_pid=parent_pid, sequence=sequence,
+            pid_pool=self.pid_pool, manifest=self.manifest, hint_resolver=self.hint_resolver,
+            recorder=self.recorder
         )
 
         # Check 'prognosis' for value of 'ingest' or 'skip'.
         if in_object.prognosis == "ingest":
 
             # Main function for building/updating objects.
-            in_object.create_object()
+            try:
+                in_object.create_object()
+            finally:
+                self.recorder.count_object(in_object.results)
 
             # Check success and process accordingly.
             if in_object.result == "success":
-                self.successful_objects += 1
+                self.count_object("successful")
             else:
-                self.failed_objects += 1
+                self.count_object("failed")
 
             if compound:
                 self.process_child_objects(path, in_object.pid)
 
         elif in_object.prognosis == "skip":
 
-            self.skipped_objects += 1
+            self.count_object("skipped")
             logging.info("Skipping object at {0}".format(path))
             
-            result_object = object_results.objects.get(label="Skipped")
             for ds in self.datastreams:
-                datastream_object = datastreams.objects.get(datastream_label=ds[0])
-                job_objects.objects.create(
-                    job_id=self.job.job_id,
-                    created=timezone.now(),
-                    obj_file=path + "/Not Applicable",
-                    result_id=result_object,
-                    pid=in_object.pid,
-                    datastream_id=datastream_object,
-            )
+                self.recorder.add(path + "/Not Applicable", ds[0], in_object.pid, status="Skipped")
+            if self.datastreams:
+                self.recorder.count_object(set(["Skipped"]))
+
+    def handle_sigterm(self):
+        """Exit via SystemExit when the job is stopped (SIGTERM), so buffered results are written.
+
+        returns:
+            previous handler, or None if signals can't be handled here (not the main thread).
+        """
+        try:
+            return signal.signal(signal.SIGTERM, raise_system_exit)
+        except ValueError:
+            return None
 
     def process_child_objects(self, path, parent_pid):
         """Check for sub-objects and process accordingly.
@@ -195,7 +288,7 @@ class CollectionIngest(object):
         """
         # Get type as defined in hint files.
         # Hint file data takes precedence over all other indicators, as long as it exists in configs.
-        hint = HintFiles(self.root_dir, path)
+        hint = HintFiles(self.root_dir, path, resolver=self.hint_resolver)
         hint_data = hint.get_hint_data()
         object_type = hint_data.get("type", "none")
 
@@ -278,8 +371,21 @@ class CollectionIngest(object):
 
     def get_sub_dirs(self, path):
         """Check for subdirectories in path."""
+        if self.manifest is not None:
+            return self.manifest.get_sub_dirs(path)
         return [f for f in sorted(os.listdir(path)) if os.path.isdir(os.path.join(path, f))]
 
+    def scan_source_dir(self):
+        """Build manifest of the job's source directory, saving it if INGEST_MANIFEST_DIR is set."""
+        self.manifest = CollectionManifest(self.job.source_dir)
+        self.manifest.scan()
+        if settings.INGEST_MANIFEST_DIR:
+            manifest_path = os.path.join(settings.INGEST_MANIFEST_DIR, "ingest_{0}.json".format(self.job.job_id.job_id))
+            try:
+                self.manifest.save(manifest_path)
+            except (IOError, OSError) as e:
+                logging.warning("Unable to save manifest to {0}: {1}".format(manifest_path, e))
+
     def _load_configs(self, setting):
         """Load json data from settings."""
         config_path = getattr(settings, setting)
@@ -326,13 +432,16 @@ class CollectionIngest(object):
         args:
             path(str): path to files to tally
         """
-        path = self.job.source_dir 
-        root_dir = path
-        if "_root" not in root_dir:
-            for root, dirs, files in os.walk(path):
-                for dirx in dirs:
-                    if dirx.endswith("_root"):
-                        root_dir = os.path.join(root, dirx)
-                        break
+        if self.manifest is not None:
+            root_dir = self.manifest.get_root_dir()
+        else:
+            path = self.job.source_dir
+            root_dir = path
+            if "_root" not in root_dir:
+                for root, dirs, files in os.walk(path):
+                    for dirx in dirs:
+                        if dirx.endswith("_root"):
+                            root_dir = os.path.join(root, dirx)
+                            break
         logging.info("Root dir set as: {0}".format(root_dir))
         return root_dir
@@ -9,6 +9,7 @@ from crispy_forms.layout import Submit, Layout, Field
 from django.core.exceptions import ValidationError
 from django.utils.translation import ugettext_lazy as _
 from django.conf import settings
+from swamplr_jobs.forms import priority_field
 
 def validate_path(value):
     if not any([value.startswith(path) for path in settings.DATA_PATHS]): 
@@ -119,3 +120,5 @@ class IngestForm(forms.Form):
             help_text="Optionally select a number of items to process. Leave blank to process all items."
         )
 
+        self.fields["priority"] = priority_field("ingest")
+
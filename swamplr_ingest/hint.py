@@ -1,45 +1,118 @@
 import logging
 import os
 import json
+import threading
+import time
 
 
-class HintFiles():
+class HintResolver(object):
 
-    """Get hint files for each directory from base_dir to object_dir and allow each sub-dir to overwrite/append."""
+    """Parse and merge hint files, caching results so they can be shared by all objects in a job.
 
-    def __init__(self, base_dir, object_dir):
-        """Load dirs and load hint files."""
-        self.hint_file_name = "hint.json"
-        self.base_dir = os.path.realpath(os.path.normpath(base_dir)).rstrip("/")
-        self.object_dir = os.path.realpath(os.path.normpath(object_dir)).rstrip("/")
-        self.hint_data = {}
+    Each hint file is parsed once and re-read only if its mtime changes. Merged data for a directory
+    is built from its parent's merged data, so siblings reuse everything above them.
+    """
 
-        # Make sure object_dir is a subdirectory of base_dir.
-        if self.object_dir.startswith(self.base_dir):
-            self._load_hint_data()
-        else:
-            logging.warning("Object path {0} not found in base path {1}.".format(self.object_dir, self.base_dir))
+    def __init__(self, manifest=None, check_interval=0, hint_file_name="hint.json"):
+        """Set up empty caches.
+
+        kwargs:
+            manifest(CollectionManifest): scan of the collection, used as the first source of hint files.
+            check_interval(float): seconds before a cached hint file's mtime is checked again; 0 checks every time.
+        """
+        self.manifest = manifest
+        self.check_interval = check_interval
+        self.hint_file_name = hint_file_name
+        self.lock = threading.Lock()
+
+        # Directory: (mtime of hint file or None, parsed data, time last checked).
+        self.hint_files = {}
+        # (base_dir, directory): (generation, merged data).
+        self.merged = {}
+        # Incremented whenever a hint file changes, invalidating all merged data.
+        self.generation = 0
+        # Normalized form of each path seen, as resolving real paths costs a stat per path component.
+        self.paths = {}
 
-    def _load_hint_data(self):
-        """Load each hint file successively."""
+    def normalize(self, path):
+        """Normalize path; manifest paths are as scanned, so aren't resolved to real paths."""
+        normalized = self.paths.get(path)
+        if normalized is None:
+            if self.manifest is not None:
+                normalized = os.path.normpath(path).rstrip("/")
+            else:
+                normalized = os.path.realpath(os.path.normpath(path)).rstrip("/")
+            self.paths[path] = normalized
+        return normalized
 
-        object_dir_parts = self.object_dir[len(self.base_dir):].split("/")
-        object_dirs = [""] + [part for part in object_dir_parts if part != ""]
+    def resolve(self, base_dir, object_dir):
+        """Return hint data merged from base_dir down to object_dir; deeper files overwrite/append.
 
-        current_dir = self.base_dir
+        args:
+            base_dir(str): top directory from which hint files apply.
+            object_dir(str): object directory at or below base_dir.
+        """
+        base_dir = self.normalize(base_dir)
+        object_dir = self.normalize(object_dir)
 
-        for part in object_dirs:
-            current_dir = os.path.join(current_dir, part)
-            self._load_hint_file(current_dir)
+        # Make sure object_dir is a subdirectory of base_dir.
+        if not object_dir.startswith(base_dir):
+            logging.warning("Object path {0} not found in base path {1}.".format(object_dir, base_dir))
+            return {}
+
+        with self.lock:
+            return dict(self._merged(base_dir, object_dir))
+
+    def _merged(self, base_dir, path):
+        """Return merged data for path, reusing cached data for each directory unless a hint file changed."""
+        dirs = [path]
+        while len(dirs[-1]) > len(base_dir):
+            dirs.append(os.path.dirname(dirs[-1]))
+        # Check every hint file on the way down first, so a change anywhere invalidates cached data.
+        hint_files = [self._hint_file(d) for d in dirs]
+
+        data = {}
+        for d, own in reversed(zip(dirs, hint_files)):
+            cached = self.merged.get((base_dir, d))
+            if cached is not None and cached[0] == self.generation:
+                data = cached[1]
+                continue
+            data = dict(data)
+            if own:
+                data.update(own)
+            self.merged[(base_dir, d)] = (self.generation, data)
+        return data
 
-    def _load_hint_file(self, path):
-        """Check for hint file in current directory."""
+    def _hint_file(self, path):
+        """Return parsed hint file in directory, or None; reload if its mtime has changed."""
+        now = time.time()
+        cached = self.hint_files.get(path)
+        if cached is not None and now - cached[2] < self.check_interval:
+            return cached[1]
 
         hint_path = os.path.join(path, self.hint_file_name)
+        if cached is None and self.manifest is not None:
+            entry = self.manifest.get_entry(path)
+            # A hint file the scan couldn't read is read here, so its error is raised.
+            if entry is not None and not entry.get("hint_error"):
+                mtime = entry["files"].get(self.hint_file_name, (None, None))[1]
+                self.hint_files[path] = (mtime, entry["hint"], now)
+                return entry["hint"]
 
-        if os.path.isfile(hint_path):
-            data = self._open_file(hint_path)
-            self.hint_data.update(data)
+        try:
+            mtime = os.stat(hint_path).st_mtime
+        except OSError:
+            mtime = None
+
+        if cached is not None and cached[0] == mtime:
+            self.hint_files[path] = (mtime, cached[1], now)
+            return cached[1]
+
+        data = self._open_file(hint_path) if mtime is not None else None
+        self.hint_files[path] = (mtime, data, now)
+        if cached is not None:
+            self.generation += 1
+        return data
 
     def _open_file(self, path):
         """Read json file."""
@@ -47,6 +120,21 @@ class HintFiles():
             data = json.load(f)
         return data
 
+
+class HintFiles():
+
+    """Get hint files for each directory from base_dir to object_dir and allow each sub-dir to overwrite/append."""
+
+    def __init__(self, base_dir, object_dir, resolver=None):
+        """Load dirs and load hint files.
+
+        kwargs:
+            resolver(HintResolver): shared cache of hint files; if None, files are read from disk.
+        """
+        if resolver is None:
+            resolver = HintResolver()
+        self.hint_data = resolver.resolve(base_dir, object_dir)
+
     def get_hint_data(self):
         """Return data."""
         return self.hint_data
@@ -4,12 +4,17 @@ import hashlib
 from lxml import etree
 from apps import SwamplrIngestConfig
 from fedora_api.api import FedoraApi
-from models import datastreams, job_objects, object_results
 from swamplr_jobs.models import job_messages
 from hint import HintFiles
+from relsext import RelsExt
+from manifest import CollectionManifest
+from matcher import get_matcher
+from results import ResultRecorder
 from operator import itemgetter
 from ConfigParser import ConfigParser
+from StringIO import StringIO
 from django.utils import timezone
+from django.conf import settings
 import os
 import re
 from rdflib.graph import Graph
@@ -21,7 +26,8 @@ class Ingest:
     """Process ingest of collection to Fedora Commons."""
 
     def __init__(self, path, root_dir, ingest_job, collection, defaults, datastreams, object_type,
-                 compound=False, child=False, parent_pid=None, sequence=None):
+                 compound=False, child=False, parent_pid=None, sequence=None, pid_pool=None, manifest=None,
+                 hint_resolver=None, recorder=None):
         """Prepare for ingest."""
         # Path to object directory (containing datastream files).
         self.path = path
@@ -51,13 +57,22 @@ class Ingest:
         # Future title.
         self.title = ""
 
+        # Scan of the collection directory, used in place of repeated filesystem calls.
+        self.manifest = manifest if manifest is not None else CollectionManifest(path)
+
         # Hint data.
         self.root_dir = root_dir
-        hint = HintFiles(self.root_dir, path)
+        hint = HintFiles(self.root_dir, path, resolver=hint_resolver)
         self.hint_data = hint.get_hint_data()
         # Pid progress.
         self.pids = None
         self.pid = None
+        # Source of new pids; if None, each new object requests its own from Fedora.
+        self.pid_pool = pid_pool
+        # Job results are buffered by the recorder; without one, each result is written immediately.
+        self.recorder = recorder if recorder is not None else ResultRecorder(ingest_job.job_id, batch_size=1)
+        # Results of this object's datastreams.
+        self.results = set()
 
         # Outlook and outcome.
         self.prognosis = "skip"
@@ -90,7 +105,8 @@ class Ingest:
         username = configs.get("fedora", "username")
         password = configs.get("fedora", "password")
 
-        return FedoraApi(username=username, password=password)
+        # Connection pool is shared with every other FedoraApi instance in this process.
+        return FedoraApi(username=username, password=password, **settings.FEDORA_SESSION)
 
     def create_object(self):
         """Create object for upload, whether a new object or amended."""
@@ -102,15 +118,17 @@ class Ingest:
 
         # Title is pulled from Dublin Core, and used as FC label.
         self.title = self.get_title(self.datastream_paths.get("DC", None))
+        # Pages are labelled with their sequence, set here rather than in a separate call after rels-ext.
+        label = u"{0} Page {1}".format(self.title, self.sequence) if self.is_page() else self.title
 
         logging.info(u"Processing object at {0}: {1}".format(self.pid, self.title))
 
         if self.new_object: 
             status, response = self.fedora_api.ingest_at_pid(
-                self.pid, label=self.title, ownerId="MSUL", logMessage="New object created at {0}".format(self.pid)
+                self.pid, label=label, ownerId="MSUL", logMessage="New object created at {0}".format(self.pid)
             )
         else:
-            status, response = self.fedora_api.modify_object(self.pid, label=self.title)
+            status, response = self.fedora_api.modify_object(self.pid, label=label)
 
         if status in [201, 200]:
             # Add rels-ext, metadata, files, then check outcome.
@@ -134,9 +152,37 @@ class Ingest:
         return ds_list
 
     def add_rels_ext(self):
-        """Add basic rels-ext for object."""
-        # Remove existing RELS-EXT datastream.
-        purged = self.fedora_api.purge_datastream(self.pid, "RELS-EXT")
+        """Build full rels-ext for object locally, then write it to Fedora in a single request."""
+        rels = self.build_rels_ext()
+
+        logging.info("Adding {0} relationships at {1}".format(len(rels), self.pid))
+
+        content = StringIO(rels.serialize())
+        ds_args = {
+            "dsLabel": "Fedora Object to Object Relationship Metadata.",
+            "mimeType": "application/rdf+xml",
+            "versionable": "true",
+        }
+        if self.new_object or "RELS-EXT" not in self.current_ds_list:
+            status, response = self.fedora_api.update_datastream_content(
+                self.pid, "RELS-EXT", content, controlGroup="X", **ds_args
+            )
+        else:
+            status, response = self.fedora_api.modify_datastream(self.pid, "RELS-EXT", file_object=content, **ds_args)
+
+        if status not in [200, 201]:
+            logging.error("Unable to write RELS-EXT at {0}. Error: {1}: {2}".format(self.pid, status, response))
+            return
+
+        # Previously: purge, one call per relationship, then modify_datastream (and a label update for pages).
+        saved = len(rels) + 1
+        if self.is_page():
+            saved += 1
+        logging.info("RELS-EXT written at {0}; {1} HTTP calls saved.".format(self.pid, saved))
+
+    def build_rels_ext(self):
+        """Return RelsExt graph with all relationships for the current object."""
+        rels = RelsExt(self.pid)
 
         # Load default settings for content model.
         has_model_object = self.defaults["content_models"][self.content_model]["has_model"]
@@ -144,84 +190,85 @@ class Ingest:
         # Root pid, e.g. "etd:root" made by joining namespace and "root".
         root_pid = ":".join([self.pid.split(":")[0], "root"])
 
-        logging.info("Adding relationships at {0}".format(self.pid))
-
-        self.fedora_api.add_relationship(self.pid, "info:fedora/fedora-system:def/model#hasModel", has_model_object)
-        self.fedora_api.modify_datastream(self.pid, "RELS-EXT", mimeType="application/rdf+xml", versionable="true")
+        rels.add_relationship("info:fedora/fedora-system:def/model#hasModel", has_model_object)
 
         if self.content_model == "newspaper_issue":
-            self.fedora_api.add_relationship(
-                self.pid, "info:fedora/fedora-system:def/relations-external#isMemberOf",
+            rels.add_relationship(
+                "info:fedora/fedora-system:def/relations-external#isMemberOf",
                 "info:fedora/{0}".format(root_pid.replace("root", "1"))
             )
-            self.fedora_api.add_relationship(
-                self.pid, "http://islandora.ca/ontology/relsext#isSequenceNumber", self.sequence, isLiteral=True, datatype="int"
+            rels.add_relationship(
+                "http://islandora.ca/ontology/relsext#isSequenceNumber", self.sequence, isLiteral=True, datatype="int"
             )
-            self.fedora_api.add_relationship(
-                self.pid, "http://islandora.ca/ontology/relsext#dateIssued",
+            rels.add_relationship(
+                "http://islandora.ca/ontology/relsext#dateIssued",
                 self.get_date(self.datastream_paths.get("DC", None)), isLiteral=True
             )
 
         elif self.content_model == "book":
-            self.fedora_api.add_relationship(
-                self.pid, "info:fedora/fedora-system:def/relations-external#isMemberOfCollection",
+            rels.add_relationship(
+                "info:fedora/fedora-system:def/relations-external#isMemberOfCollection",
                 "info:fedora/{0}".format(root_pid)
             )
 
         elif self.child:
 
-            if self.content_model in ["newspaper_page", "book_page"]:
-                self.fedora_api.add_relationship(
-                    self.pid, "http://islandora.ca/ontology/relsext#isSequenceNumber", self.sequence, isLiteral="true",
+            if self.is_page():
+                rels.add_relationship(
+                    "http://islandora.ca/ontology/relsext#isSequenceNumber", self.sequence, isLiteral="true",
                     datatype="int"
                 )
-                self.fedora_api.add_relationship(
-                    self.pid, "http://islandora.ca/ontology/relsext#isPageNumber", self.sequence, isLiteral="true",
+                rels.add_relationship(
+                    "http://islandora.ca/ontology/relsext#isPageNumber", self.sequence, isLiteral="true",
                     datatype="int"
                 )
-                self.fedora_api.add_relationship(
-                    self.pid, "http://islandora.ca/ontology/relsext#isPageOf", "info:fedora/{0}".format(self.parent_pid)
+                rels.add_relationship(
+                    "http://islandora.ca/ontology/relsext#isPageOf", "info:fedora/{0}".format(self.parent_pid)
                 )
-                self.fedora_api.add_relationship(
-                    self.pid, "info:fedora/fedora-system:def/relations-external#isMemberOf",
+                rels.add_relationship(
+                    "info:fedora/fedora-system:def/relations-external#isMemberOf",
                     "info:fedora/{0}".format(self.parent_pid)
                 )
-                new_title = u"{0} Page {1}".format(self.title, self.sequence)
-                self.fedora_api.modify_object(self.pid, label=new_title, logMessage="Update paged content title")
 
             else:
                 # Child object is 'constituent of' parent.
-                self.fedora_api.add_relationship(
-                    self.pid, "info:fedora/fedora-system:def/relations-external#isConstituentOf",
+                rels.add_relationship(
+                    "info:fedora/fedora-system:def/relations-external#isConstituentOf",
                     "info:fedora/{0}".format(self.parent_pid))
 
                 sequence_predicate = self.set_sequence_predicate()
-                self.fedora_api.add_relationship(self.pid, sequence_predicate, self.sequence, isLiteral="true", datatype="int")
-                self.fedora_api.add_relationship(
-                    self.pid, "info:fedora/fedora-system:def/relations-external#isMemberOfCollection",
+                rels.add_relationship(sequence_predicate, self.sequence, isLiteral="true", datatype="int")
+                rels.add_relationship(
+                    "info:fedora/fedora-system:def/relations-external#isMemberOfCollection",
                     "info:fedora/{0}".format(root_pid)
                 )
 
         else:
 
-            self.fedora_api.add_relationship(
-                self.pid, "info:fedora/fedora-system:def/relations-external#isMemberOfCollection",
+            rels.add_relationship(
+                "info:fedora/fedora-system:def/relations-external#isMemberOfCollection",
                 "info:fedora/{0}".format(root_pid)
             )
 
         if self.hint_data.get("sequence", "false") == "true":
- 
+
             # Set values for sequence name and sequence value.
             self.process_dir_sequence()
-            self.fedora_api.add_relationship(
-                self.pid, "http://islandora.ca/ontology/relsext#isSequenceNumber", self.sequence_value,
+            rels.add_relationship(
+                "http://islandora.ca/ontology/relsext#isSequenceNumber", self.sequence_value,
                 isLiteral="true", datatype="int"
             )
-            self.fedora_api.add_relationship(
-                self.pid, "http://islandora.ca/ontology/relsext#isSequenceOf", self.sequence_term,
+            rels.add_relationship(
+                "http://islandora.ca/ontology/relsext#isSequenceOf", self.sequence_term,
                 isLiteral="true"
             )
 
+        return rels
+
+    def is_page(self):
+        """Check if object is a page of a book or newspaper issue."""
+        return self.child and self.content_model in ["newspaper_page", "book_page"]
+
     def process_dir_sequence(self):
         """Use sequence settings in hint file to assign appropriate sequence RELS-EXT."""
         
@@ -250,7 +297,7 @@ class Ingest:
 
         filtered = []
 
-        for sub in [f for f in sorted(os.listdir(sort_path)) if os.path.isdir(os.path.join(sort_path, f))]:
+        for sub in self.manifest.get_sub_dirs(sort_path):
 
             current_object = False
             subterm, subkey = self.get_matches(pattern, sub, filter_key, sort_key)
@@ -437,17 +484,8 @@ class Ingest:
         """Set datastream result. 
         Valid options for status: Success, Failure, Skipped
         """
-        result_object = object_results.objects.get(label=status)
-        datastream_object = datastreams.objects.get(datastream_label=ds)
-        job_objects.objects.create(
-            job_id=self.ingest_job.job_id,
-            created=timezone.now(),
-            obj_file=path,
-            result_id=result_object,
-            pid=self.pid,
-            datastream_id=datastream_object,
-            new_object="y" if self.new_object else None,
-            )
+        self.results.add(status)
+        self.recorder.add(path, ds, self.pid, status=status, new_object=self.new_object)
 
     def set_ds_label(self, ds, name):
         """Establish label for datastream.
@@ -643,8 +681,11 @@ class Ingest:
 
     def no_pid_returned(self):
         """If no pid is found for current object, create new one."""
-        status, pid_xml = self.fedora_api.get_next_pid(self.namespace)
-        self.pid = self.extract_pid(pid_xml)
+        if self.pid_pool is not None:
+            self.pid = self.pid_pool.get_pid(self.namespace, self.fedora_api)
+        else:
+            status, pid_xml = self.fedora_api.get_next_pid(self.namespace)
+            self.pid = self.extract_pid(pid_xml)
 
     def gather_paths(self):
         """Gather paths for all derivatives.
@@ -657,11 +698,10 @@ class Ingest:
         all_datastreams.update(self.metadata_datastreams)
 
         # Attempt to match file in the directory that matches a given datastream.
-        for f in os.listdir(self.path):
-            for ds_name, ds_pattern in all_datastreams.items():
-                # Check if any of the included patterns match the file.
-                if any([ds.lower() in f.lower() for ds in ds_pattern]) and not f.startswith("."):
-                    datastream_paths[ds_name] = os.path.join(self.path, f)
+        matcher = get_matcher(all_datastreams)
+        for ds_name, f in matcher.classify(self.manifest.get_files(self.path)).items():
+            datastream_paths[ds_name] = os.path.join(self.path, f)
+        self.manifest.set_datastream_paths(self.path, datastream_paths)
         return datastream_paths
 
     def get_preferred_identifier(self, dc_path):
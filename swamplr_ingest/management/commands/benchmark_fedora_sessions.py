@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand
+from fedora_api.api import FedoraApi, get_session
+from fedora_api.standin import KeepAliveHandler, StandInServer
+import logging
+import requests
+import threading
+import time
+
+
+class Command(BaseCommand):
+    help = ('Times Fedora API calls made with requests.request per call against the pooled get_session, '
+            'on a local stand-in Fedora server')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help='Number of calls of each kind.')
+
+    def handle(self, *args, **options):
+        server = StandInServer(("127.0.0.1", 0), KeepAliveHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        # urllib3 logs every new connection; keep the timings readable.
+        logging.disable(logging.INFO)
+        try:
+            base_url = "http://127.0.0.1:{0}/fedora".format(server.server_port)
+            url = base_url + "/objects"
+            auth = ("benchmark", "benchmark")
+            count = options['requests']
+            self.stdout.write("{0} calls of each kind to {1}".format(count, base_url))
+
+            self.time_calls("requests.request per call", count,
+                            lambda: requests.request("GET", url, params={"resultFormat": "xml"}, auth=auth))
+            session = get_session(base_url=base_url, username=auth[0])
+            self.time_calls("get_session", count,
+                            lambda: session.request("GET", url, params={"resultFormat": "xml"}, auth=auth))
+            api = FedoraApi(base_url=base_url, username=auth[0], password=auth[1])
+            self.time_calls("FedoraApi.call_api", count, lambda: self.call_api(api))
+        finally:
+            logging.disable(logging.NOTSET)
+            server.shutdown()
+            server.server_close()
+
+    def call_api(self, api):
+        api.set_url("objects")
+        return api.call_api()[0]
+
+    def time_calls(self, label, count, call):
+        """Make count calls and report calls per second, and any that didn't succeed."""
+        failed = 0
+        start = time.time()
+        for n in range(count):
+            res = call()
+            if getattr(res, "status_code", res) != 200:
+                failed += 1
+        elapsed = time.time() - start
+        self.stdout.write("{0}: {1:.2f}s, {2:.0f} calls/s{3}".format(
+            label, elapsed, count / elapsed if elapsed else 0, " ({0} failed)".format(failed) if failed else ""))
@@ -0,0 +1,79 @@
+from django.core.management.base import BaseCommand
+from swamplr_ingest.hint import HintFiles, HintResolver
+from swamplr_ingest.manifest import CollectionManifest
+import json
+import os
+import shutil
+import tempfile
+import time
+
+
+class Command(BaseCommand):
+    help = 'Times hint file resolution with and without HintResolver on a synthetic collection'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--objects', type=int, default=50000, help='Number of object directories.')
+        parser.add_argument('--batch-size', type=int, default=500, help='Objects per batch directory.')
+        parser.add_argument('--hint-every', type=int, default=50, help='Give every nth object a hint file.')
+        parser.add_argument('--dir', help='Directory to build the collection in; a temporary one if not given.')
+
+    def handle(self, *args, **options):
+        base_dir = options['dir'] or tempfile.mkdtemp()
+        try:
+            object_dirs = self.build(base_dir, options['objects'], options['batch_size'], options['hint_every'])
+            self.stdout.write("{0} objects in {1}".format(len(object_dirs), base_dir))
+
+            # Each object's hints are resolved twice, by CollectionIngest.assess and by Ingest.
+            expected, elapsed = self.time_resolve(base_dir, object_dirs, None)
+            self.stdout.write("HintFiles, no cache: {0:.2f}s".format(elapsed))
+
+            for label, interval in (("HintResolver, interval 60", 60), ("HintResolver, interval 0", 0)):
+                data, elapsed = self.time_resolve(base_dir, object_dirs, HintResolver(check_interval=interval))
+                self.report(label, elapsed, data == expected)
+
+            start = time.time()
+            manifest = CollectionManifest(base_dir)
+            manifest.scan()
+            self.stdout.write("Manifest scan: {0:.2f}s".format(time.time() - start))
+            resolver = HintResolver(manifest=manifest, check_interval=60)
+            data, elapsed = self.time_resolve(base_dir, object_dirs, resolver)
+            self.report("HintResolver, seeded from manifest", elapsed, data == expected)
+        finally:
+            if not options['dir']:
+                shutil.rmtree(base_dir)
+
+    def build(self, base_dir, objects, batch_size, hint_every):
+        """Create object directories in batches, with hint files at the top, in each batch and in some objects."""
+        self.write_hint(base_dir, {"sort_by": "name", "sequence": "false"})
+        object_dirs = []
+        for n in range(objects):
+            batch_dir = os.path.join(base_dir, "batch{0:04d}".format(n // batch_size))
+            if n % batch_size == 0:
+                os.makedirs(batch_dir)
+                self.write_hint(batch_dir, {"sequence": "true", "batch": n // batch_size})
+            object_dir = os.path.join(batch_dir, "obj{0:06d}".format(n))
+            os.makedirs(object_dir)
+            if hint_every and n % hint_every == 0:
+                self.write_hint(object_dir, {"sort_direction": "desc"})
+            object_dirs.append(object_dir)
+        return object_dirs
+
+    def write_hint(self, path, data):
+        with open(os.path.join(path, "hint.json"), "w") as f:
+            json.dump(data, f)
+
+    def time_resolve(self, base_dir, object_dirs, resolver):
+        """Return hint data of each object, and seconds taken to resolve it twice per object."""
+        start = time.time()
+        data = []
+        for object_dir in object_dirs:
+            for n in range(2):
+                if resolver is None:
+                    hint = HintFiles(base_dir, object_dir).get_hint_data()
+                else:
+                    hint = HintFiles(base_dir, object_dir, resolver=resolver).get_hint_data()
+            data.append(hint)
+        return data, time.time() - start
+
+    def report(self, label, elapsed, same):
+        self.stdout.write("{0}: {1:.2f}s{2}".format(label, elapsed, "" if same else " (DIFFERENT RESULTS)"))
@@ -0,0 +1,145 @@
+"""Single-pass scan of an ingest source directory."""
+import json
+import logging
+import os
+try:
+    from os import scandir
+except ImportError:
+    # Python 2: backport package.
+    from scandir import scandir
+
+
+class CollectionManifest(object):
+
+    """In-memory index of every directory, file and hint file below an ingest source directory.
+
+    The tree is read once with scandir; later stages of the ingest look up directory listings,
+    file sizes and mtimes, and hint data here instead of asking the filesystem again.
+    Paths not covered by the scan fall back to the filesystem.
+    """
+
+    def __init__(self, source_dir, hint_file_name="hint.json"):
+        """Set directory to scan.
+
+        args:
+            source_dir(str): top directory of the ingest job.
+        """
+        self.job_source_dir = source_dir
+        self.source_dir = os.path.normpath(source_dir)
+        self.hint_file_name = hint_file_name
+        # Key is normalized directory path, value is dict of "dirs", "files", "hint" and "hint_error" (why the
+        # hint file couldn't be read), plus "datastreams" once the object in that directory has been matched.
+        self.directories = {}
+        self.found_root_dir = None
+
+    def scan(self):
+        """Walk source directory once, recording sub-directories, files and hint files.
+
+        Links to directories are followed, but each directory is scanned once, however many paths lead to it.
+        """
+        found_root = None
+        stack = [self.source_dir]
+        # (st_dev, st_ino) of each directory scanned.
+        visited = set()
+
+        while stack:
+            path = stack.pop()
+            dirs, files = [], {}
+            try:
+                st = os.stat(path)
+                if (st.st_dev, st.st_ino) in visited:
+                    logging.debug("Skipping {0}, already scanned through another path.".format(path))
+                    continue
+                visited.add((st.st_dev, st.st_ino))
+                for entry in scandir(path):
+                    try:
+                        if entry.is_dir():
+                            dirs.append(entry.name)
+                            continue
+                        st = entry.stat()
+                    except OSError as e:
+                        # e.g. a broken link; left out of the listing rather than failing the directory.
+                        logging.warning("Unable to read {0}: {1}".format(entry.path, e))
+                        continue
+                    files[entry.name] = (st.st_size, st.st_mtime)
+            except OSError as e:
+                logging.warning("Unable to scan {0}: {1}".format(path, e))
+                continue
+
+            dirs.sort()
+            hint = None
+            hint_error = None
+            if self.hint_file_name in files:
+                try:
+                    hint = self.read_hint(os.path.join(path, self.hint_file_name))
+                except (IOError, ValueError) as e:
+                    # Raised again by HintResolver when an object below this directory is ingested.
+                    logging.warning("Unable to read hint file in {0}: {1}".format(path, e))
+                    hint_error = str(e)
+            self.directories[path] = {"dirs": dirs, "files": files, "hint": hint, "hint_error": hint_error}
+
+            # Matches previous os.walk logic: first '_root' sub-dir of each directory, last one found wins.
+            root_dirs = [d for d in dirs if d.endswith("_root")]
+            if root_dirs:
+                found_root = os.path.join(path, root_dirs[0])
+
+            # Push in reverse so directories are visited in sorted, top-down order.
+            for d in reversed(dirs):
+                stack.append(os.path.join(path, d))
+
+        self.found_root_dir = found_root
+        logging.info("Scanned {0} directories in {1}".format(len(self.directories), self.source_dir))
+
+    def read_hint(self, path):
+        """Read json hint file."""
+        with open(path) as f:
+            return json.load(f)
+
+    def get_entry(self, path):
+        """Return scanned details for directory, or None if it was not part of the scan."""
+        return self.directories.get(os.path.normpath(path))
+
+    def get_root_dir(self):
+        """Return root dir: source dir if it contains '_root', otherwise the '_root' dir found in the scan."""
+        if "_root" in self.job_source_dir or self.found_root_dir is None:
+            return self.job_source_dir
+        return self.found_root_dir
+
+    def get_sub_dirs(self, path):
+        """Return sorted sub-directory names of path."""
+        entry = self.get_entry(path)
+        if entry is None:
+            return [f for f in sorted(os.listdir(path)) if os.path.isdir(os.path.join(path, f))]
+        return list(entry["dirs"])
+
+    def get_files(self, path):
+        """Return sorted names of files in path."""
+        entry = self.get_entry(path)
+        if entry is None:
+            return sorted(f for f in os.listdir(path) if not os.path.isdir(os.path.join(path, f)))
+        return sorted(entry["files"])
+
+    def get_file_info(self, path):
+        """Return (size, mtime) of file, from the scan if possible."""
+        entry = self.get_entry(os.path.dirname(path))
+        name = os.path.basename(path)
+        if entry is not None and name in entry["files"]:
+            return entry["files"][name]
+        st = os.stat(path)
+        return st.st_size, st.st_mtime
+
+    def set_datastream_paths(self, path, datastream_paths):
+        """Record datastream files matched for the object in path."""
+        entry = self.get_entry(path)
+        if entry is not None:
+            entry["datastreams"] = dict(datastream_paths)
+
+    def save(self, path):
+        """Write manifest to json file."""
+        with open(path, "w") as f:
+            json.dump({
+                "source_dir": self.source_dir,
+                "root_dir": self.get_root_dir(),
+                "directories": self.directories,
+            }, f)
+        logging.info("Saved manifest of {0} to {1}".format(self.source_dir, path))
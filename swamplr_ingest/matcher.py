@@ -0,0 +1,83 @@
+"""Match files in an object directory to datastreams using a single precompiled pattern."""
+import re
+import threading
+
+# Matchers already built, keyed by datastream patterns.
+_matchers = {}
+_matchers_lock = threading.Lock()
+
+
+def get_matcher(datastream_patterns):
+    """Return DatastreamMatcher for patterns, building it only the first time they are seen.
+
+    args:
+        datastream_patterns(dict): datastream id as key, list of filename markers as value.
+    """
+    key = tuple(sorted((ds, tuple(patterns)) for ds, patterns in datastream_patterns.items()))
+    with _matchers_lock:
+        matcher = _matchers.get(key)
+        if matcher is None:
+            matcher = DatastreamMatcher(datastream_patterns)
+            _matchers[key] = matcher
+    return matcher
+
+
+class DatastreamMatcher(object):
+
+    """Classify filenames by datastream: a file matches a datastream if any of its markers is in the filename.
+
+    Matching is case-insensitive and skips hidden files. All markers are combined into one regex of
+    overlapping lookaheads, tried longest first. A shorter marker starting at the same position as a
+    longer one is not reported by the regex, so each marker also maps to every marker it contains.
+    """
+
+    def __init__(self, datastream_patterns):
+        """Build combined regex.
+
+        args:
+            datastream_patterns(dict): datastream id as key, list of filename markers as value.
+        """
+        # Lowercased marker: datastreams it indicates.
+        marker_datastreams = {}
+        # Datastreams with an empty marker, which matches every file.
+        self.match_all = set()
+        for ds, patterns in datastream_patterns.items():
+            for p in patterns:
+                p = p.lower()
+                if p:
+                    marker_datastreams.setdefault(p, set()).add(ds)
+                else:
+                    self.match_all.add(ds)
+
+        # Found marker: datastreams indicated by it and by every marker it contains.
+        self.datastreams = {}
+        for marker in marker_datastreams:
+            found = set(self.match_all)
+            for other, ds_set in marker_datastreams.items():
+                if other in marker:
+                    found.update(ds_set)
+            self.datastreams[marker] = found
+
+        self.regex = None
+        if marker_datastreams:
+            markers = sorted(marker_datastreams, key=lambda m: (-len(m), m))
+            # Markers loaded from JSON are unicode, and may not be ASCII.
+            self.regex = re.compile(u"(?=({0}))".format("|".join(re.escape(m) for m in markers)), re.DOTALL)
+
+    def match(self, filename):
+        """Return set of datastreams the filename matches."""
+        if filename.startswith("."):
+            return set()
+        found = set(self.match_all)
+        if self.regex is not None:
+            for marker in self.regex.findall(filename.lower()):
+                found.update(self.datastreams[marker])
+        return found
+
+    def classify(self, filenames):
+        """Return dict of datastream id: filename; where several files match, the last one wins."""
+        matches = {}
+        for f in filenames:
+            for ds in self.match(f):
+                matches[ds] = f
+        return matches
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('swamplr_ingest', '0008_pathauto_objects'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='reserved_pids',
+            fields=[
+                ('reserved_id', models.AutoField(primary_key=True, serialize=False)),
+                ('namespace', models.CharField(max_length=64)),
+                ('pid', models.CharField(max_length=64, unique=True)),
+                ('reserved', models.DateTimeField()),
+            ],
+        ),
+    ]
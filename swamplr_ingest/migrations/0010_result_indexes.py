@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 15:47
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('swamplr_ingest', '0009_reserved_pids'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='pathauto_objects',
+            index=models.Index(fields=['job_id', 'result_id'], name='pathauto_obj_job_result_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='job_objects',
+            index=models.Index(fields=['job_id', 'result_id'], name='job_obj_job_result_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='job_objects',
+            index=models.Index(fields=['job_id', 'pid'], name='job_obj_job_pid_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='delete_objects',
+            index=models.Index(fields=['job_id', 'result_id'], name='delete_obj_job_result_idx'),
+        ),
+    ]
@@ -34,6 +34,9 @@ class delete_objects(models.Model):
     pid = models.CharField(max_length=64, null=True)
     deleted = models.DateTimeField(null=True)
 
+    class Meta:
+        indexes = [models.Index(fields=["job_id", "result_id"], name="delete_obj_job_result_idx")]
+
 class job_datastreams(models.Model):
 
     job_datastream_id = models.AutoField(primary_key=True)
@@ -61,6 +64,13 @@ class job_objects(models.Model):
     datastream_id = models.ForeignKey('datastreams')
     new_object = models.CharField(max_length=1, null=True)
 
+    class Meta:
+        # Results are read per job: counted by result, and grouped or looked up by pid.
+        indexes = [
+            models.Index(fields=["job_id", "result_id"], name="job_obj_job_result_idx"),
+            models.Index(fields=["job_id", "pid"], name="job_obj_job_pid_idx"),
+        ]
+
 class object_results(models.Model):
 
     result_id = models.AutoField(primary_key=True)
@@ -80,3 +90,13 @@ class pathauto_objects(models.Model):
     result_id = models.ForeignKey('object_results')
     pid = models.CharField(max_length=64, null=True)
     generated = models.DateTimeField(null=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["job_id", "result_id"], name="pathauto_obj_job_result_idx")]
+
+class reserved_pids(models.Model):
+    """PIDs reserved from Fedora in blocks but not yet assigned to an object."""
+    reserved_id = models.AutoField(primary_key=True)
+    namespace = models.CharField(max_length=64)
+    pid = models.CharField(max_length=64, unique=True)
+    reserved = models.DateTimeField()
@@ -0,0 +1,71 @@
+"""Reserve new PIDs from Fedora in blocks rather than one request per object."""
+import logging
+import threading
+from lxml import etree
+from django.utils import timezone
+from models import reserved_pids
+
+
+class PidPool(object):
+
+    """Hand out PIDs from blocks reserved with nextPID's numPIDs parameter.
+
+    Unused reservations are stored in the reserved_pids table, so PIDs left over when a job ends
+    (or crashes) are used by the next job instead of being wasted. A PID is claimed by deleting its
+    row; only the process whose delete succeeds may use it, so a PID is never handed out twice.
+    """
+
+    def __init__(self, block_size=1):
+        """Set up pool.
+
+        kwargs:
+            block_size(int): number of PIDs to request from Fedora at a time.
+        """
+        self.block_size = max(1, block_size)
+        self.lock = threading.Lock()
+
+    def get_pid(self, namespace, fedora_api):
+        """Return an unused PID in namespace, reserving a new block if none are left.
+
+        args:
+            namespace(str): PID namespace.
+            fedora_api(FedoraApi): connection of the calling ingest, used if a new block is needed.
+        returns:
+            (str): new PID, or None if Fedora did not return any.
+        """
+        with self.lock:
+            while True:
+                reserved = reserved_pids.objects.filter(namespace=namespace).order_by("reserved_id").first()
+                if reserved is None:
+                    if not self.reserve(namespace, fedora_api):
+                        return None
+                    continue
+                # Another process may have claimed the same row first.
+                deleted, _ = reserved_pids.objects.filter(reserved_id=reserved.reserved_id).delete()
+                if deleted == 1:
+                    return reserved.pid
+
+    def reserve(self, namespace, fedora_api):
+        """Request block of PIDs from Fedora and store them for use.
+
+        returns:
+            (int): number of PIDs reserved.
+        """
+        status, pid_xml = fedora_api.get_next_pid(namespace, numPIDs=self.block_size)
+        if status != 200:
+            logging.error("Unable to reserve PIDs in {0}. Error: {1}: {2}".format(namespace, status, pid_xml))
+            return 0
+        now = timezone.now()
+        pids = self.extract_pids(pid_xml)
+        reserved_pids.objects.bulk_create([reserved_pids(namespace=namespace, pid=p, reserved=now) for p in pids])
+        logging.info("Reserved {0} PIDs in {1}".format(len(pids), namespace))
+        return len(pids)
+
+    def extract_pids(self, xml):
+        """Extract all pids from nextPID response.
+
+        args:
+            xml(str): xml content in string.
+        """
+        tree = etree.fromstring(xml)
+        return [p.text for p in tree.getchildren()]
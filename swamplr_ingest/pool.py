@@ -0,0 +1,115 @@
+"""Thread pool for ingesting top-level objects in parallel."""
+import logging
+import Queue
+import sys
+import threading
+from django.db import connection
+
+
+class IngestPool(object):
+
+    """Run CollectionIngest.prepare for independent object directories on a fixed set of threads.
+
+    Ingest is dominated by waiting on Fedora, so threads are enough to overlap the network time.
+    Compound objects are handled entirely within one worker, so children keep their order.
+
+    Workers are daemon threads, so close must be called before the job process exits; it waits for
+    objects being ingested to finish, so none is left half-ingested.
+    """
+
+    def __init__(self, collection_ingest, workers):
+        """Start worker threads.
+
+        args:
+            collection_ingest(CollectionIngest): ingest whose prepare method each worker calls.
+            workers(int): number of objects to ingest at once.
+        """
+        self.collection_ingest = collection_ingest
+        self.workers = workers
+        self.tasks = Queue.Queue()
+
+        # Guards in_flight and exc_info; notified whenever an object finishes.
+        self.condition = threading.Condition()
+        self.in_flight = 0
+        self.exc_info = None
+        # Set when the job is stopping: queued objects not yet started are dropped.
+        self.cancelled = False
+
+        self.threads = []
+        for n in range(workers):
+            t = threading.Thread(target=self.run, name="ingest-worker-{0}".format(n))
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+
+    def wait_for_slot(self, subset=0):
+        """Block until a worker is free and in-flight objects can no longer push the job past its subset.
+
+        kwargs:
+            subset(int): maximum number of objects to process, 0 for no limit.
+        returns:
+            (bool): False if a worker has failed and no more objects should be submitted.
+        """
+        with self.condition:
+            while self.in_flight and self.exc_info is None and (
+                    self.in_flight >= self.workers or
+                    self.collection_ingest.processed_count() + self.in_flight >= subset > 0):
+                # Timeout lets the main thread handle signals while waiting.
+                self.condition.wait(1)
+            return self.exc_info is None
+
+    def submit(self, full_path, sequence):
+        """Queue object directory for ingest."""
+        with self.condition:
+            self.in_flight += 1
+        self.tasks.put((full_path, sequence))
+
+    def run(self):
+        """Worker loop: ingest queued objects until told to stop."""
+        try:
+            while True:
+                task = self.tasks.get()
+                if task is None:
+                    break
+                try:
+                    if self.exc_info is None and not self.cancelled:
+                        self.collection_ingest.prepare(task[0], sequence=task[1])
+                except Exception:
+                    logging.exception("Error ingesting {0}".format(task[0]))
+                    with self.condition:
+                        if self.exc_info is None:
+                            self.exc_info = sys.exc_info()
+                finally:
+                    with self.condition:
+                        self.in_flight -= 1
+                        self.condition.notify_all()
+        finally:
+            # Each thread has its own database connection.
+            connection.close()
+
+    def close(self, cancel=False):
+        """Wait for queued objects to finish, then re-raise the first worker error, if any.
+
+        If SIGTERM's SystemExit arrives while waiting, objects not yet started are dropped and the
+        SystemExit is raised once the objects being ingested have finished.
+
+        kwargs:
+            cancel(bool): drop objects not yet started, and don't raise worker errors (they are logged),
+                e.g. when the job is already stopping because of another exception.
+        """
+        self.cancelled = self.cancelled or cancel
+        for t in self.threads:
+            self.tasks.put(None)
+        interrupted = None
+        for t in self.threads:
+            while t.is_alive():
+                try:
+                    t.join(1)
+                except SystemExit as e:
+                    logging.warning("Stopping ingest once objects in progress have finished.")
+                    self.cancelled = True
+                    interrupted = e
+        if interrupted is not None:
+            raise interrupted
+        if self.exc_info is not None and not cancel:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
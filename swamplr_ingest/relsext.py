@@ -0,0 +1,77 @@
+"""Build RELS-EXT datastreams locally so they can be written to Fedora in a single request."""
+import logging
+from lxml import etree
+from fedora_api.api import validate_datatype
+
+RDF_NS = "http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+
+# Prefixes used by Fedora and Islandora when they serialize RELS-EXT themselves.
+PREFIXES = {
+    "info:fedora/fedora-system:def/model#": "fedora-model",
+    "info:fedora/fedora-system:def/relations-external#": "fedora",
+    "http://islandora.ca/ontology/relsext#": "islandora",
+}
+
+class RelsExt(object):
+
+    """RDF/XML graph of relationships for one object, mirroring FedoraApi.add_relationship."""
+
+    def __init__(self, pid):
+        """Start an empty graph for the given pid."""
+        self.pid = pid
+        self.relationships = []
+
+    def __len__(self):
+        return len(self.relationships)
+
+    def add_relationship(self, predicate, obj, isLiteral=False, datatype=None):
+        """Add relationship to graph; arguments and validation match FedoraApi.add_relationship.
+
+        Returns False, without adding the relationship, if the object is missing or the datatype is not allowed.
+        """
+        if obj is None:
+            logging.warning("Skipping {0} for {1}: no object value.".format(predicate, self.pid))
+            return False
+        literal = bool(isLiteral)
+        dt = None
+        if datatype and literal:
+            dt = validate_datatype(datatype)
+            if not dt:
+                logging.warning("Skipping {0} for {1}: invalid datatype '{2}'.".format(predicate, self.pid, datatype))
+                return False
+        self.relationships.append((predicate, obj, literal, dt))
+        return True
+
+    def serialize(self):
+        """Return RELS-EXT as UTF-8 encoded RDF/XML."""
+        nsmap = {"rdf": RDF_NS}
+        elements = []
+        for predicate, obj, literal, dt in self.relationships:
+            namespace, name = self.split_predicate(predicate)
+            if namespace not in nsmap.values():
+                prefix = PREFIXES.get(namespace, "ns{0}".format(len(nsmap)))
+                nsmap[prefix] = namespace
+            elements.append(("{{{0}}}{1}".format(namespace, name), obj, literal, dt))
+
+        root = etree.Element("{{{0}}}RDF".format(RDF_NS), nsmap=nsmap)
+        description = etree.SubElement(root, "{{{0}}}Description".format(RDF_NS))
+        description.set("{{{0}}}about".format(RDF_NS), "info:fedora/{0}".format(self.pid))
+
+        for tag, obj, literal, dt in elements:
+            element = etree.SubElement(description, tag)
+            if literal:
+                element.text = obj if isinstance(obj, basestring) else unicode(obj)
+                if dt:
+                    element.set("{{{0}}}datatype".format(RDF_NS), dt)
+            else:
+                element.set("{{{0}}}resource".format(RDF_NS), obj)
+
+        return etree.tostring(root, pretty_print=True, encoding="UTF-8", xml_declaration=True)
+
+    def split_predicate(self, predicate):
+        """Split predicate uri into namespace and local name."""
+        if "#" in predicate:
+            namespace, name = predicate.rsplit("#", 1)
+            return namespace + "#", name
+        namespace, name = predicate.rsplit("/", 1)
+        return namespace + "/", name
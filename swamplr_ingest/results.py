@@ -0,0 +1,117 @@
+"""Buffered recording of per-datastream ingest results."""
+import logging
+import os
+import threading
+import time
+from django.db import transaction
+from django.utils import timezone
+from swamplr_jobs.counters import increment_counts
+from models import object_results, datastreams, job_objects
+
+
+def object_result(results):
+    """Return result of an object from the set of its datastream results.
+
+    The object has its datastreams' result if they all agree, else Failure if any failed, else Success.
+    """
+    if len(results) == 1:
+        return list(results)[0]
+    elif "Failure" in results:
+        return "Failure"
+    return "Success"
+
+
+def object_path(obj_file):
+    """Return path of the object a result row belongs to: the directory of its file."""
+    return os.path.dirname(obj_file.rstrip("/")) if obj_file else None
+
+
+class ResultRecorder(object):
+
+    """Collect job_objects rows and write them with bulk_create.
+
+    Result and datastream lookups are loaded once per job. Rows are written when batch_size rows are
+    waiting, or when flush is called, which the ingest does on completion, cancellation or error. There
+    is no timer: whether flush_interval seconds have passed since the last write is checked as each row
+    is added and each object is counted, so rows wait at most until the next result after the interval.
+    Object totals for the job are written in the same transaction as the rows.
+    """
+
+    def __init__(self, job, batch_size=500, flush_interval=10):
+        """Load lookup tables.
+
+        args:
+            job(jobs): job the results belong to.
+        kwargs:
+            batch_size(int): number of rows to buffer before writing.
+            flush_interval(float): seconds after the last write from which the next add or count_object writes.
+        """
+        self.job = job
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.results = dict((r.label, r) for r in object_results.objects.all())
+        self.datastreams = dict((d.datastream_label, d) for d in datastreams.objects.all())
+        self.rows = []
+        self.counts = {}
+        self.last_flush = time.time()
+        self.lock = threading.Lock()
+
+    def add(self, path, ds, pid, status="Success", new_object=False):
+        """Record result for one datastream.
+
+        args:
+            path(str): file uploaded for the datastream.
+            ds(str): datastream label.
+            pid(str): object pid.
+        kwargs:
+            status(str): "Success", "Failure" or "Skipped".
+            new_object(bool): True if the object was created by this job.
+        """
+        row = job_objects(
+            job_id=self.job,
+            created=timezone.now(),
+            obj_file=path,
+            result_id=self.results[status],
+            pid=pid,
+            datastream_id=self.datastreams[ds],
+            new_object="y" if new_object else None,
+        )
+        with self.lock:
+            self.rows.append(row)
+            if len(self.rows) >= self.batch_size or self._due():
+                self._flush()
+
+    def count_object(self, results):
+        """Add finished object to job totals.
+
+        Objects with no datastream results are not counted.
+
+        args:
+            results(set): results of the object's datastreams.
+        """
+        if not results:
+            return
+        result = object_result(results)
+        with self.lock:
+            self.counts[result] = self.counts.get(result, 0) + 1
+            if self._due():
+                self._flush()
+
+    def _due(self):
+        return time.time() - self.last_flush >= self.flush_interval
+
+    def flush(self):
+        """Write all buffered rows."""
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        """Write buffered rows; caller must hold lock."""
+        if self.rows or self.counts:
+            with transaction.atomic():
+                job_objects.objects.bulk_create(self.rows, batch_size=self.batch_size)
+                increment_counts(self.job, self.counts)
+            logging.debug("Recorded {0} datastream results".format(len(self.rows)))
+            self.rows = []
+            self.counts = {}
+        self.last_flush = time.time()
@@ -1,3 +1,615 @@
-from django.test import TestCase
+from BaseHTTPServer import HTTPServer
+from django.core.management import call_command
+from django.db.models.signals import pre_delete
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from django.utils import timezone
+from swamplr_jobs.models import jobs, job_types, status
+from hint import HintFiles, HintResolver
+from manifest import CollectionManifest
+from matcher import DatastreamMatcher, get_matcher
+from models import datastreams, job_objects, object_results, reserved_pids
+from collection import CollectionIngest, raise_system_exit
+from pids import PidPool
+from rdflib import Graph, Literal, URIRef
+from relsext import RelsExt
+from pool import IngestPool
+from results import ResultRecorder
+from swamplr_jobs.counters import get_counts
+from swamplr_jobs.views import job_objects as job_objects_view
+from StringIO import StringIO
+from fedora_api.api import FedoraApi
+from fedora_api.standin import CookieHandler
+from views import get_job_objects_page
+import views
+import json
+import os
+import random
+import shutil
+import signal
+import tempfile
+import threading
+import time
 
-# Create your tests here.
+
+def gather_paths_reference(filenames, datastream_patterns):
+    """Original nested-loop matching from Ingest.gather_paths."""
+    paths = {}
+    for f in filenames:
+        for ds_name, ds_pattern in datastream_patterns.items():
+            if any([ds.lower() in f.lower() for ds in ds_pattern]) and not f.startswith("."):
+                paths[ds_name] = f
+    return paths
+
+
+class DatastreamMatcherTest(SimpleTestCase):
+
+    patterns = {
+        "OBJ": [".tif"],
+        "TN": ["_TN.jpg"],
+        "JP2": ["_JP2.jp2"],
+        "JPG": ["_JPG_HIGH.jpg", "_JPG.jpg"],
+        "DC": ["_DC.xml"],
+        "MODS": ["_MODS.xml"],
+    }
+
+    def test_collection_markers(self):
+        files = ["obj_1.tif", "obj_1_TN.jpg", "obj_1_JP2.jp2", "obj_1_JPG_HIGH.jpg", "obj_1_DC.xml", "obj_1_MODS.xml",
+                 "notes.txt"]
+        matches = DatastreamMatcher(self.patterns).classify(files)
+        self.assertEqual(matches, gather_paths_reference(files, self.patterns))
+        self.assertEqual(matches["JPG"], "obj_1_JPG_HIGH.jpg")
+        self.assertNotIn("notes.txt", matches.values())
+
+    def test_last_match_wins(self):
+        files = ["a_DC.xml", "b_DC.xml", "c_dc.XML"]
+        self.assertEqual(DatastreamMatcher(self.patterns).classify(files)["DC"], "c_dc.XML")
+
+    def test_case_insensitive(self):
+        self.assertEqual(DatastreamMatcher(self.patterns).match("OBJ_1_tn.JPG"), set(["TN"]))
+
+    def test_hidden_files_skipped(self):
+        self.assertEqual(DatastreamMatcher(self.patterns).match("._obj_1.tif"), set())
+
+    def test_file_matches_several_datastreams(self):
+        patterns = {"A": ["tn"], "B": ["tn.jpg"], "C": ["n.j"], "D": ["x"]}
+        self.assertEqual(DatastreamMatcher(patterns).match("page_tn.jpg"), set(["A", "B", "C"]))
+
+    def test_overlapping_markers(self):
+        patterns = {"A": ["aa"], "B": ["aab"]}
+        self.assertEqual(DatastreamMatcher(patterns).match("aaab"), set(["A", "B"]))
+
+    def test_empty_marker_matches_everything(self):
+        patterns = {"ANY": [""], "DC": ["_DC.xml"]}
+        matcher = DatastreamMatcher(patterns)
+        self.assertEqual(matcher.match("a_DC.xml"), set(["ANY", "DC"]))
+        self.assertEqual(matcher.match(".hidden"), set())
+
+    def test_regex_characters_in_markers(self):
+        patterns = {"A": ["(1).tif"], "B": ["[x]"]}
+        matcher = DatastreamMatcher(patterns)
+        self.assertEqual(matcher.match("scan(1).TIF"), set(["A"]))
+        self.assertEqual(matcher.match("scan1xtif"), set())
+
+    def test_non_ascii_markers(self):
+        patterns = {"A": [u"_\xe9t\xe9.tif"], "TN": [u"_TN.jpg"]}
+        matcher = DatastreamMatcher(patterns)
+        self.assertEqual(matcher.match(u"page_\xc9T\xc9.TIF"), set(["A"]))
+        self.assertEqual(matcher.match(u"page_\xe9t\xe9_TN.jpg"), set(["TN"]))
+        self.assertEqual(matcher.match("page_TN.jpg"), set(["TN"]))
+
+    def test_matches_reference_on_random_names(self):
+        rng = random.Random(7)
+        alphabet = "abAB_.x"
+        for _ in range(200):
+            patterns = {}
+            for ds in range(rng.randint(1, 5)):
+                patterns["DS{0}".format(ds)] = ["".join(rng.choice(alphabet) for _ in range(rng.randint(0, 3)))
+                                                for _ in range(rng.randint(1, 3))]
+            files = ["".join(rng.choice(alphabet) for _ in range(rng.randint(1, 8))) for _ in range(10)]
+            self.assertEqual(DatastreamMatcher(patterns).classify(files), gather_paths_reference(files, patterns))
+
+    def test_matcher_cached_per_config(self):
+        self.assertIs(get_matcher(dict(self.patterns)), get_matcher(dict(self.patterns)))
+
+
+class JobObjectsPageTest(TestCase):
+
+    def setUp(self):
+        job_status = status.objects.create(status="Test success", default="", failure="", running="", success="y")
+        job_type = job_types.objects.get_or_create(label="ingest", defaults={"app_name": "swamplr_ingest"})[0]
+        self.job = jobs.objects.create(created=timezone.now(), status_id=job_status, type_id=job_type)
+        results = dict((label, object_results.objects.get_or_create(label=label)[0])
+                       for label in ["Success", "Failure", "Skipped"])
+        ds = dict((label, datastreams.objects.get_or_create(datastream_label=label, defaults={"is_object": "y"})[0])
+                  for label in ["OBJ", "MODS"])
+        for n in range(12):
+            pid = "test:{0:02d}".format(n)
+            obj_result = "Failure" if n % 4 == 0 else "Success"
+            for label, result in [("OBJ", obj_result), ("MODS", "Success")]:
+                job_objects.objects.create(job_id=self.job, created=timezone.now(), obj_file="/src/{0}/{1}".format(n, label),
+                                           result_id=results[result], pid=pid, datastream_id=ds[label])
+
+    def get_all(self, **filters):
+        objects, after = [], None
+        while True:
+            page = get_job_objects_page(self.job, after=after, limit=5, **filters)
+            objects.extend(page["objects"])
+            after = page["next"]
+            if after is None:
+                return objects
+
+    def test_pages_cover_all_objects(self):
+        objects = self.get_all()
+        self.assertEqual([o["pid"] for o in objects], ["test:{0:02d}".format(n) for n in range(12)])
+        self.assertEqual(objects[0]["path"], "/src/0")
+        self.assertEqual(objects[0]["result"], "Failure")
+        self.assertEqual([d["name"] for d in objects[0]["subs"]], ["OBJ", "MODS"])
+
+    def test_filters(self):
+        self.assertEqual([o["pid"] for o in self.get_all(result="Failure")], ["test:00", "test:04", "test:08"])
+        self.assertEqual(len(self.get_all(result="Success")), 9)
+        self.assertEqual(self.get_all(result="Success", datastream="MODS")[0]["subs"][0]["name"], "MODS")
+        self.assertEqual(len(self.get_all(result="Success", datastream="MODS")), 12)
+        self.assertEqual([o["pid"] for o in self.get_all(prefix="test:1")], ["test:10", "test:11"])
+
+    def test_skipped_objects(self):
+        skipped = object_results.objects.get(label="Skipped")
+        # Rows of one skipped object need not be next to each other.
+        for ds in datastreams.objects.filter(datastream_label__in=["OBJ", "MODS"]):
+            for n in range(4):
+                job_objects.objects.create(job_id=self.job, created=timezone.now(), obj_file="/skip/{0}/Not Applicable".format(n),
+                                           result_id=skipped, pid=None, datastream_id=ds)
+        objects = self.get_all()
+        self.assertEqual([o["pid"] for o in objects[:12]], ["test:{0:02d}".format(n) for n in range(12)])
+        self.assertFalse(any(o["skipped"] for o in objects[:12]))
+        self.assertEqual([(o["pid"], o["skipped"]) for o in objects[12:]], [(None, True)] * 4)
+        self.assertEqual([len(o["subs"]) for o in objects], [2] * 16)
+        self.assertEqual([o["path"] for o in objects[12:]], ["/skip/{0}".format(n) for n in range(4)])
+        self.assertEqual([o["path"] for o in self.get_all(result="Skipped")], ["/skip/{0}".format(n) for n in range(4)])
+
+    def test_sparse_filter_is_one_page(self):
+        success = object_results.objects.get(label="Success")
+        job_objects.objects.filter(job_id=self.job).update(result_id=success)
+        job_objects.objects.filter(job_id=self.job, pid="test:11", datastream_id__datastream_label="OBJ").update(
+            result_id=object_results.objects.get(label="Failure"))
+        # Objects are grouped and filtered in SQL, then the page's rows are read, whatever the job's size.
+        with self.assertNumQueries(3):
+            page = get_job_objects_page(self.job, limit=5, result="Failure")
+        self.assertEqual([o["pid"] for o in page["objects"]], ["test:11"])
+        self.assertIsNone(page["next"])
+
+    def test_skipped_rows_read_per_page(self):
+        skipped = object_results.objects.get(label="Skipped")
+        ds = datastreams.objects.get(datastream_label="OBJ")
+        for n in range(5):
+            job_objects.objects.create(job_id=self.job, created=timezone.now(), obj_file="/skip/{0}/Not Applicable".format(n),
+                                       result_id=skipped, pid=None, datastream_id=ds)
+        self.addCleanup(setattr, views, "MAX_SCAN_ROWS", views.MAX_SCAN_ROWS)
+        views.MAX_SCAN_ROWS = 2
+        page = get_job_objects_page(self.job, after="test:11", limit=5, result="Failure")
+        self.assertEqual(page["objects"], [])
+        self.assertTrue(page["next"].startswith("~"))
+        self.assertEqual([o["pid"] for o in self.get_all(result="Failure")], ["test:00", "test:04", "test:08"])
+        self.assertEqual([o["path"] for o in self.get_all(result="Skipped")], ["/skip/{0}".format(n) for n in range(5)])
+
+    def test_view_rejects_bad_parameters(self):
+        request = RequestFactory().get("/", {"limit": "ten"})
+        self.assertEqual(job_objects_view(request, self.job.job_id).status_code, 400)
+        request = RequestFactory().get("/", {"limit": "5"})
+        page = json.loads(job_objects_view(request, self.job.job_id).content)
+        self.assertEqual(len(page["objects"]), 5)
+        self.assertEqual(page["next"], "test:04")
+
+        delete_type = job_types.objects.get_or_create(label="delete", defaults={"app_name": "swamplr_ingest"})[0]
+        delete_job = jobs.objects.create(created=timezone.now(), status_id=self.job.status_id, type_id=delete_type)
+        request = RequestFactory().get("/", {"after": "test:04"})
+        self.assertEqual(job_objects_view(request, delete_job.job_id).status_code, 400)
+
+
+class CollectionManifestTest(SimpleTestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        for d in ["a/obj1", "b_root/obj2"]:
+            os.makedirs(os.path.join(self.dir, d))
+        for f in ["a/obj1/OBJ.tif", "b_root/obj2/OBJ.tif", "b_root/obj2/MODS.xml"]:
+            with open(os.path.join(self.dir, f), "w") as out:
+                out.write("data")
+        with open(os.path.join(self.dir, "a", "hint.json"), "w") as f:
+            json.dump({"sequence": "true"}, f)
+
+    def scan(self):
+        manifest = CollectionManifest(self.dir)
+        manifest.scan()
+        return manifest
+
+    def test_scan(self):
+        manifest = self.scan()
+        self.assertEqual(manifest.get_sub_dirs(self.dir), ["a", "b_root"])
+        self.assertEqual(manifest.get_files(os.path.join(self.dir, "b_root", "obj2")), ["MODS.xml", "OBJ.tif"])
+        self.assertEqual(manifest.get_file_info(os.path.join(self.dir, "a", "obj1", "OBJ.tif"))[0], 4)
+        self.assertEqual(manifest.get_entry(os.path.join(self.dir, "a"))["hint"], {"sequence": "true"})
+        self.assertEqual(manifest.get_root_dir(), os.path.join(self.dir, "b_root"))
+
+    def test_unreadable_entry_skipped(self):
+        os.symlink(os.path.join(self.dir, "missing"), os.path.join(self.dir, "a", "obj1", "broken.tif"))
+        entry = self.scan().get_entry(os.path.join(self.dir, "a", "obj1"))
+        self.assertIsNotNone(entry)
+        self.assertEqual(list(entry["files"]), ["OBJ.tif"])
+
+    def test_link_loops(self):
+        os.symlink(self.dir, os.path.join(self.dir, "a", "obj1", "up"))
+        os.symlink(os.path.join(self.dir, "b_root"), os.path.join(self.dir, "a", "b_link"))
+        os.symlink(os.path.join(self.dir, "a", "b_link"), os.path.join(self.dir, "b_root", "obj2", "loop"))
+        manifest = self.scan()
+        # Each directory is scanned once, through the first path that reaches it.
+        self.assertEqual(len(manifest.directories), 5)
+        self.assertIsNotNone(manifest.get_entry(os.path.join(self.dir, "a", "b_link", "obj2")))
+        self.assertIsNone(manifest.get_entry(os.path.join(self.dir, "b_root")))
+
+    def test_malformed_hint_file(self):
+        with open(os.path.join(self.dir, "a", "hint.json"), "w") as f:
+            f.write("{'sequence': true")
+        manifest = self.scan()
+        self.assertTrue(manifest.get_entry(os.path.join(self.dir, "a"))["hint_error"])
+        resolver = HintResolver(manifest=manifest)
+        self.assertRaises(ValueError, resolver.resolve, self.dir, os.path.join(self.dir, "a", "obj1"))
+        self.assertEqual(resolver.resolve(self.dir, os.path.join(self.dir, "b_root", "obj2")), {})
+
+
+class StubFedoraApi(object):
+
+    """Stands in for FedoraApi.get_next_pid, numbering PIDs from 1 in each namespace."""
+
+    def __init__(self, status=200):
+        self.status = status
+        self.requests = []
+        self.next = {}
+
+    def get_next_pid(self, namespace, numPIDs=1):
+        self.requests.append((namespace, numPIDs))
+        start = self.next.get(namespace, 1)
+        self.next[namespace] = start + numPIDs
+        pids = "".join("<pid>{0}:{1}</pid>".format(namespace, n) for n in range(start, start + numPIDs))
+        return self.status, '<pidList xmlns="http://www.fedora.info/definitions/1/0/management/">{0}</pidList>'.format(pids)
+
+
+class PidPoolTest(TestCase):
+
+    def test_block_refill(self):
+        fedora = StubFedoraApi()
+        pool = PidPool(block_size=3)
+        pids = [pool.get_pid("test", fedora) for _ in range(4)]
+        self.assertEqual(pids, ["test:1", "test:2", "test:3", "test:4"])
+        self.assertEqual(fedora.requests, [("test", 3), ("test", 3)])
+        # Unused PIDs of the block stay reserved for the next pool.
+        self.assertEqual(list(reserved_pids.objects.values_list("pid", flat=True)), ["test:5", "test:6"])
+        self.assertEqual(PidPool(block_size=3).get_pid("test", fedora), "test:5")
+        self.assertEqual(pool.get_pid("other", fedora), "other:1")
+
+    def test_fedora_error(self):
+        self.assertIsNone(PidPool(block_size=3).get_pid("test", StubFedoraApi(status=500)))
+
+    def test_claimers_never_share_a_pid(self):
+        fedora = StubFedoraApi()
+        first, second = PidPool(block_size=2), PidPool(block_size=2)
+        pids = [pool.get_pid("test", fedora) for _ in range(5) for pool in (first, second)]
+        self.assertEqual(len(set(pids)), 10)
+        self.assertEqual(len(fedora.requests), 5)
+
+    def test_row_claimed_by_another_process(self):
+        fedora = StubFedoraApi()
+        pool = PidPool(block_size=3)
+        pool.reserve("test", fedora)
+        stolen = []
+
+        def claim_first(sender, instance, **kwargs):
+            # Another process deletes the row between this pool reading and deleting it.
+            if not stolen:
+                stolen.append(instance.pid)
+                reserved_pids.objects.filter(reserved_id=instance.reserved_id).delete()
+
+        pre_delete.connect(claim_first, sender=reserved_pids)
+        self.addCleanup(pre_delete.disconnect, claim_first, sender=reserved_pids)
+        self.assertEqual(pool.get_pid("test", fedora), "test:2")
+        self.assertEqual(stolen, ["test:1"])
+
+
+class ResultRecorderTest(TestCase):
+
+    def setUp(self):
+        job_status = status.objects.create(status="Test running", default="", failure="", running="y", success="")
+        job_type = job_types.objects.get_or_create(label="ingest", defaults={"app_name": "swamplr_ingest"})[0]
+        self.job = jobs.objects.create(created=timezone.now(), status_id=job_status, type_id=job_type)
+        for label in ["Success", "Failure", "Skipped"]:
+            object_results.objects.get_or_create(label=label)
+        for label in ["OBJ", "MODS"]:
+            datastreams.objects.get_or_create(datastream_label=label, defaults={"is_object": "y"})
+
+    def written(self):
+        return job_objects.objects.filter(job_id=self.job).count()
+
+    def add_object(self, recorder, n, status="Success"):
+        recorder.add("/src/{0}/OBJ.tif".format(n), "OBJ", "test:{0}".format(n), status=status)
+        recorder.add("/src/{0}/MODS.xml".format(n), "MODS", "test:{0}".format(n))
+        recorder.count_object(set([status, "Success"]))
+
+    def test_batches(self):
+        recorder = ResultRecorder(self.job, batch_size=3, flush_interval=3600)
+        self.add_object(recorder, 0)
+        self.assertEqual(self.written(), 0)
+        self.add_object(recorder, 1, status="Failure")
+        self.assertEqual(self.written(), 3)
+        recorder.flush()
+        self.assertEqual(self.written(), 4)
+        self.assertEqual(get_counts([self.job.job_id])[self.job.job_id], {"Success": 1, "Failure": 1, "Skipped": 0})
+
+    def test_flush_interval(self):
+        recorder = ResultRecorder(self.job, batch_size=100, flush_interval=3600)
+        self.add_object(recorder, 0)
+        self.assertEqual(self.written(), 0)
+        # Once the interval has passed, the next row or finished object writes what is waiting.
+        recorder.last_flush -= 3600
+        recorder.count_object(set(["Success"]))
+        self.assertEqual(self.written(), 2)
+        recorder.last_flush -= 3600
+        recorder.add("/src/1/OBJ.tif", "OBJ", "test:1")
+        self.assertEqual(self.written(), 3)
+
+    def test_backfill_matches_recorded_totals(self):
+        recorder = ResultRecorder(self.job, batch_size=100, flush_interval=3600)
+        self.add_object(recorder, 0)
+        self.add_object(recorder, 1, status="Failure")
+        # Skipped objects have no pid and a row per datastream, as CollectionIngest.ingest writes them.
+        for n in range(3):
+            for ds in ["OBJ", "MODS"]:
+                recorder.add("/skip/{0}/Not Applicable".format(n), ds, None, status="Skipped")
+            recorder.count_object(set(["Skipped"]))
+        recorder.flush()
+        recorded = get_counts([self.job.job_id])[self.job.job_id]
+        self.assertEqual(recorded, {"Success": 1, "Failure": 1, "Skipped": 3})
+
+        call_command("backfill_job_counts", str(self.job.job_id), stdout=StringIO())
+        self.assertEqual(get_counts([self.job.job_id])[self.job.job_id], recorded)
+
+
+class FakeIngest(CollectionIngest):
+
+    """Ingests each object by waiting, recording the object type its thread sees throughout."""
+
+    def __init__(self, delay=0.05, fail=None):
+        super(FakeIngest, self).__init__()
+        self.delay = delay
+        self.fail = fail
+        self.started = []
+        self.finished = []
+        self.threads = set()
+        self.lock = threading.Lock()
+
+    def prepare(self, full_path, sequence=1):
+        with self.lock:
+            self.started.append(full_path)
+            self.threads.add(threading.current_thread().name)
+        self.object_type = full_path
+        time.sleep(self.delay)
+        if full_path == self.fail:
+            raise ValueError("bad object")
+        # Objects ingested at the same time on other threads don't change this thread's object type.
+        self.count_object("successful" if self.object_type == full_path else "failed")
+        with self.lock:
+            self.finished.append((full_path, sequence))
+
+
+class IngestPoolTest(SimpleTestCase):
+
+    def run_objects(self, ingest, pool, n):
+        for i in range(n):
+            if not pool.wait_for_slot():
+                break
+            pool.submit("/src/obj{0}".format(i), i)
+
+    def test_objects_ingested_in_parallel(self):
+        ingest = FakeIngest()
+        pool = IngestPool(ingest, 3)
+        self.run_objects(ingest, pool, 9)
+        pool.close()
+        self.assertEqual(sorted(ingest.finished), sorted(("/src/obj{0}".format(i), i) for i in range(9)))
+        self.assertEqual((ingest.successful_objects, ingest.failed_objects), (9, 0))
+        self.assertEqual(len(ingest.threads), 3)
+        self.assertIsNone(ingest.object_type)
+
+    def test_subset(self):
+        ingest = FakeIngest()
+        pool = IngestPool(ingest, 3)
+        for i in range(9):
+            if not pool.wait_for_slot(subset=4) or ingest.processed_count() >= 4:
+                break
+            pool.submit("/src/obj{0}".format(i), i)
+        pool.close()
+        self.assertEqual(ingest.processed_count(), 4)
+
+    def test_worker_error(self):
+        ingest = FakeIngest(fail="/src/obj1")
+        pool = IngestPool(ingest, 2)
+        self.run_objects(ingest, pool, 20)
+        self.assertRaises(ValueError, pool.close)
+        self.assertLess(len(ingest.started), 20)
+
+    def test_cancel(self):
+        ingest = FakeIngest(delay=0.3)
+        pool = IngestPool(ingest, 2)
+        for i in range(4):
+            pool.submit("/src/obj{0}".format(i), i)
+        time.sleep(0.1)
+        pool.close(cancel=True)
+        # Objects being ingested finish; those not yet started are dropped.
+        self.assertEqual(sorted(p for p, s in ingest.finished), ["/src/obj0", "/src/obj1"])
+        self.assertFalse(any(t.is_alive() for t in pool.threads))
+
+    def test_sigterm_waits_for_objects_in_progress(self):
+        previous = signal.signal(signal.SIGTERM, raise_system_exit)
+        self.addCleanup(signal.signal, signal.SIGTERM, previous)
+        ingest = FakeIngest(delay=1)
+        pool = IngestPool(ingest, 2)
+        for i in range(4):
+            pool.submit("/src/obj{0}".format(i), i)
+        timer = threading.Timer(0.2, os.kill, (os.getpid(), signal.SIGTERM))
+        timer.start()
+        self.assertRaises(SystemExit, pool.close)
+        timer.join()
+        self.assertEqual(sorted(p for p, s in ingest.finished), ["/src/obj0", "/src/obj1"])
+        self.assertFalse(any(t.is_alive() for t in pool.threads))
+
+
+class CountingHintResolver(HintResolver):
+
+    """Counts hint files parsed."""
+
+    def __init__(self, *args, **kwargs):
+        super(CountingHintResolver, self).__init__(*args, **kwargs)
+        self.parsed = []
+
+    def _open_file(self, path):
+        self.parsed.append(path)
+        return super(CountingHintResolver, self)._open_file(path)
+
+
+class HintResolverTest(SimpleTestCase):
+
+    def setUp(self):
+        self.dir = os.path.realpath(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.dir)
+        for d in ["batch1/obj1", "batch1/obj2", "batch2/obj3"]:
+            os.makedirs(os.path.join(self.dir, d))
+        self.write_hint("", {"sort_by": "name", "sequence": "false"})
+        self.write_hint("batch1", {"sequence": "true"})
+        self.mtime = 1000000000
+
+    def write_hint(self, subdir, data):
+        with open(os.path.join(self.dir, subdir, "hint.json"), "w") as f:
+            json.dump(data, f)
+
+    def touch(self, subdir):
+        """Give the hint file a new mtime, as filesystem timestamps may not change within a test."""
+        self.mtime += 10
+        os.utime(os.path.join(self.dir, subdir, "hint.json"), (self.mtime, self.mtime))
+
+    def resolve(self, resolver, subdir):
+        return resolver.resolve(self.dir, os.path.join(self.dir, subdir))
+
+    def test_merged_like_hint_files(self):
+        resolver = HintResolver()
+        for d in ["batch1/obj1", "batch2/obj3", "batch1"]:
+            self.assertEqual(self.resolve(resolver, d), HintFiles(self.dir, os.path.join(self.dir, d)).get_hint_data())
+        self.assertEqual(self.resolve(resolver, "batch1/obj2"), {"sort_by": "name", "sequence": "true"})
+        self.assertEqual(resolver.resolve(os.path.join(self.dir, "batch1"), os.path.join(self.dir, "batch2")), {})
+
+    def test_cache_hit(self):
+        resolver = CountingHintResolver(check_interval=60)
+        for d in ["batch1/obj1", "batch1/obj2", "batch1/obj1", "batch2/obj3"]:
+            self.resolve(resolver, d)
+        # Each hint file is parsed once, however many objects are below it.
+        self.assertEqual(sorted(resolver.parsed), [os.path.join(self.dir, "batch1", "hint.json"), os.path.join(self.dir, "hint.json")])
+        # Returned data can be changed without affecting the cache.
+        self.resolve(resolver, "batch1/obj1")["sequence"] = "changed"
+        self.assertEqual(self.resolve(resolver, "batch1/obj1")["sequence"], "true")
+
+    def test_file_changed(self):
+        resolver = CountingHintResolver(check_interval=0)
+        self.touch("")
+        self.assertEqual(self.resolve(resolver, "batch2/obj3")["sort_by"], "name")
+        self.write_hint("", {"sort_by": "date"})
+        self.touch("")
+        # A change to the top hint file invalidates merged data of every directory below it.
+        self.assertEqual(self.resolve(resolver, "batch2/obj3"), {"sort_by": "date"})
+        self.assertEqual(self.resolve(resolver, "batch1/obj1"), {"sort_by": "date", "sequence": "true"})
+        self.assertEqual(len(resolver.parsed), 3)
+
+        # Within check_interval, the cached data is used without checking the file.
+        resolver.check_interval = 3600
+        self.write_hint("", {"sort_by": "size"})
+        self.touch("")
+        self.assertEqual(self.resolve(resolver, "batch2/obj3"), {"sort_by": "date"})
+
+    def test_file_removed_and_added(self):
+        resolver = HintResolver(check_interval=0)
+        self.assertEqual(self.resolve(resolver, "batch1/obj1")["sequence"], "true")
+        os.remove(os.path.join(self.dir, "batch1", "hint.json"))
+        self.assertEqual(self.resolve(resolver, "batch1/obj1"), {"sort_by": "name", "sequence": "false"})
+        self.write_hint("batch2/obj3", {"sequence": "true"})
+        self.assertEqual(self.resolve(resolver, "batch2/obj3")["sequence"], "true")
+
+    def test_seeded_from_manifest(self):
+        manifest = CollectionManifest(self.dir)
+        manifest.scan()
+        resolver = CountingHintResolver(manifest=manifest, check_interval=60)
+        self.assertEqual(self.resolve(resolver, "batch1/obj1"), {"sort_by": "name", "sequence": "true"})
+        self.assertEqual(resolver.parsed, [])
+
+
+class RelsExtTest(SimpleTestCase):
+
+    def test_round_trip(self):
+        rels = RelsExt("test:1")
+        subject = URIRef("info:fedora/test:1")
+        relsext = "http://islandora.ca/ontology/relsext#"
+        expected = set()
+        for predicate, obj, literal, datatype, value in [
+            ("info:fedora/fedora-system:def/model#hasModel", "info:fedora/islandora:sp_large_image_cmodel", False, None,
+             URIRef("info:fedora/islandora:sp_large_image_cmodel")),
+            ("info:fedora/fedora-system:def/relations-external#isMemberOfCollection", "info:fedora/test:collection",
+             False, None, URIRef("info:fedora/test:collection")),
+            (relsext + "isSequenceNumber", 3, True, "int",
+             Literal("3", datatype=URIRef("http://www.w3.org/2001/XMLSchema#int"))),
+            (relsext + "dateIssued", "2018-01-01T00:00:00Z", "true", "http://www.w3.org/2001/XMLSchema#dateTime",
+             Literal("2018-01-01T00:00:00Z", datatype=URIRef("http://www.w3.org/2001/XMLSchema#dateTime"))),
+            ("http://example.org/terms/title", u"Caf\xe9", True, None, Literal(u"Caf\xe9")),
+        ]:
+            self.assertTrue(rels.add_relationship(predicate, obj, isLiteral=literal, datatype=datatype))
+            expected.add((subject, URIRef(predicate), value))
+
+        self.assertFalse(rels.add_relationship(relsext + "isPageNumber", 1, isLiteral=True, datatype="string"))
+        self.assertFalse(rels.add_relationship(relsext + "isPageOf", None))
+        self.assertEqual(len(rels), 5)
+
+        xml = rels.serialize()
+        self.assertTrue(xml.startswith("<?xml version='1.0' encoding='UTF-8'?>"))
+        self.assertIn("xmlns:fedora-model=", xml)
+        graph = Graph()
+        graph.parse(data=xml, format="xml")
+        self.assertEqual(set(graph), expected)
+
+
+class FedoraApiSessionTest(SimpleTestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(("127.0.0.1", 0), CookieHandler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = "http://127.0.0.1:{0}/fedora".format(self.server.server_port)
+
+    def call(self, api):
+        api.set_url("objects")
+        status, content = api.call_api()
+        self.assertEqual(status, 200)
+        return content
+
+    def test_credentials_do_not_share_auth_state(self):
+        alice = FedoraApi(base_url=self.url, username="alice", password="a")
+        bob = FedoraApi(base_url=self.url, username="bob", password="b")
+        alice_again = FedoraApi(base_url=self.url, username="alice", password="a")
+        self.assertIsNot(alice.session, bob.session)
+        # Instances with the same credentials share the connection pool.
+        self.assertIs(alice.session, alice_again.session)
+
+        self.assertEqual(self.call(alice), "")
+        self.assertTrue(self.call(alice).startswith("session="))
+        # Neither another user nor another instance gets the cookie alice's requests were given.
+        self.assertEqual(self.call(bob), "")
+        self.assertEqual(self.call(alice_again), "")
+        self.assertEqual(len(alice.session.cookies), 0)
+        self.assertNotEqual(alice.cookies.get("session"), bob.cookies.get("session"))
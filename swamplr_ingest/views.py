@@ -1,10 +1,15 @@
 from django.shortcuts import render, redirect
 from django.http import HttpResponse, JsonResponse
 from django.utils import timezone
-from django.db.models import Count
+from django.db.models import Count, Q
 from apps import SwamplrIngestConfig
 from models import ingest_jobs, delete_jobs, delete_objects, job_datastreams, datastreams, job_objects, object_results, pathauto_jobs, pathauto_objects
-from swamplr_jobs.models import status, job_types, jobs
+from swamplr_jobs.models import status, job_types
+from swamplr_jobs.cancellation import CancellationToken
+from swamplr_jobs.counters import increment_counts, get_counts
+from swamplr_jobs.paging import MAX_SCAN_ROWS, result_sums, combined_result, filter_combined_result, keyset_page
+from swamplr_jobs.export import iterate_rows
+from results import object_path, object_result
 from collection import CollectionIngest
 from forms import IngestForm
 from swamplr_jobs.views import add_job, job_status 
@@ -15,7 +20,7 @@ import sys
 import os
 import json
 from django.conf import settings
-from django.db import connections
+from django.db import connections, transaction
 
 def manage(request):
     """Manage existing services and add new ones."""
@@ -68,6 +73,7 @@ def process_pathauto(current_job):
     messages = []
     generated = []
     status_id = None
+    cancel_token = CancellationToken(current_job.job_id)
 
     try:
         for o in objects_to_generate:
@@ -77,8 +83,7 @@ def process_pathauto(current_job):
             else:
                 generated.append(pid)
             # check if the job is still active (i.e. not cancelled by the user)
-            failure_status = jobs.objects.get(job_id=current_job.job_id).status_id.failure
-            if failure_status == "manual":
+            if cancel_token.is_cancelled():
                 messages.append("Job manually stopped by user.")
                 status_id = status.objects.get(status="Cancelled By User").status_id
                 break
@@ -100,12 +105,14 @@ def process_pathauto(current_job):
                     messages.append("Could not create pathauto URL for {0}. Error: {1}".format(pid, e))
                 finally:
                     # Insert into job objects table
-                    pathauto_objects.objects.create(
-                        job_id=current_job,
-                        generated=timezone.now(),
-                        result_id=result_id,
-                        pid=pid,
-                    )
+                    with transaction.atomic():
+                        pathauto_objects.objects.create(
+                            job_id=current_job,
+                            generated=timezone.now(),
+                            result_id=result_id,
+                            pid=pid,
+                        )
+                        increment_counts(current_job, {result_id.label: 1})
         status_id = status.objects.get(status="Complete").status_id
   
     except Exception as e:
@@ -135,12 +142,14 @@ def process_delete(current_job):
                 if o.pid not in skipped:
                     result_id = object_results.objects.get(label="Skipped")
 
-                    delete_objects.objects.create(
-                        job_id=current_job,
-                        deleted=timezone.now(),
-                        result_id=result_id,
-                        pid=o.pid,
-                        )
+                    with transaction.atomic():
+                        delete_objects.objects.create(
+                            job_id=current_job,
+                            deleted=timezone.now(),
+                            result_id=result_id,
+                            pid=o.pid,
+                            )
+                        increment_counts(current_job, {result_id.label: 1})
                     skipped.append(o.pid)
                 else:
                     pass
@@ -155,7 +164,7 @@ def process_delete(current_job):
 
 def delete_object(current_job, pid):
     """Delete object by pid."""
-    api = FedoraApi(username=settings.GSEARCH_USER, password=settings.GSEARCH_PASSWORD)
+    api = FedoraApi(username=settings.GSEARCH_USER, password=settings.GSEARCH_PASSWORD, **settings.FEDORA_SESSION)
     response, output = api.purge_object(pid)
     if response in [200, 201]:
         result = "Success"
@@ -163,12 +172,14 @@ def delete_object(current_job, pid):
         result = "Failure"
     result_id = object_results.objects.get(label=result)
 
-    delete_objects.objects.create(
-        job_id=current_job,
-        deleted=timezone.now(),
-        result_id=result_id,
-        pid=pid,
-    )
+    with transaction.atomic():
+        delete_objects.objects.create(
+            job_id=current_job,
+            deleted=timezone.now(),
+            result_id=result_id,
+            pid=pid,
+        )
+        increment_counts(current_job, {result_id.label: 1})
     return response
 
 def add_ingest_job(request, collection_name):
@@ -212,7 +223,7 @@ def add_ingest_job(request, collection_name):
         replace_on_duplicate = "y" if clean["replace_on_duplicate"] else ""
         subset = int(clean["subset_value"]) if clean["subset_value"] else 0
 
-        new_job = add_job(SwamplrIngestConfig.name, job_type_label="ingest")
+        new_job = add_job(SwamplrIngestConfig.name, job_type_label="ingest", priority=clean["priority"])
         ingest_job = ingest_jobs.objects.create(
             job_id=new_job,
             source_dir=clean["path_list_selected"],          
@@ -342,31 +353,76 @@ def get_job_details(job):
 
 def get_status_info(job):
     """Required function: return info about current job for display."""
-    job_id = job.job_id
+    return get_status_info_many([job])[job.job_id], []
 
+def get_status_info_many(jobs):
+    """Return dict of job id: info for display, for a page of jobs, using a fixed number of queries."""
     result_display = "<span class='label label-success'>{0} Succeeded</span> <span class='label label-danger'>{1} Failed</span> <span class='label label-default'>{2} Skipped</span>"
-    info = [] 
-    if job.type_id.label == "delete":
-        delete_job = delete_jobs.objects.get(job_id=job_id)
-        delete_id = delete_job.source_job.job_id_id
-        info = ["Deleting From: <span class='job-data'>Job {0}</span> <br/>".format(delete_id)]
-
-    elif job.type_id.label == "pathauto":
-        pathauto_job = pathauto_jobs.objects.get(job_id=job_id)
-        pathauto_id = pathauto_job.source_job.job_id_id
-        info = ["Generating Pathauto For: <span class='job-data'>Job {0}</span> <br/>".format(pathauto_id)]
-    elif job.type_id.label == "ingest":
-        # Get data about successes, skips, failures.
-        ingest_job = ingest_jobs.objects.get(job_id=job_id)
-        ingest_data = get_ingest_data(ingest_job.collection_name)
-        collection_label = ingest_data["label"]
-        info = ["Namespace: {0} <br/>".format(ingest_job.namespace), "Collection: {0} <br/>".format(collection_label)]
-    
-    results = get_job_objects(job_id, job_type=job.type_id.label)
-    result_message = result_display.format(results["status_count"]["Success"], results["status_count"]["Failure"], results["status_count"]["Skipped"])
-    info.append(result_message) 
-
-    return info, []
+    job_ids = {}
+    for job in jobs:
+        job_ids.setdefault(job.type_id.label, []).append(job.job_id)
+
+    info = dict((job.job_id, []) for job in jobs)
+    if job_ids.get("delete"):
+        for delete_job in delete_jobs.objects.filter(job_id__in=job_ids["delete"]).select_related("source_job"):
+            info[delete_job.job_id_id] = ["Deleting From: <span class='job-data'>Job {0}</span> <br/>".format(delete_job.source_job.job_id_id)]
+
+    if job_ids.get("pathauto"):
+        for pathauto_job in pathauto_jobs.objects.filter(job_id__in=job_ids["pathauto"]).select_related("source_job"):
+            info[pathauto_job.job_id_id] = ["Generating Pathauto For: <span class='job-data'>Job {0}</span> <br/>".format(pathauto_job.source_job.job_id_id)]
+
+    if job_ids.get("ingest"):
+        ingest_data = load_ingest_data()
+        for ingest_job in ingest_jobs.objects.filter(job_id__in=job_ids["ingest"]):
+            collection_label = ingest_data[ingest_job.collection_name]["label"]
+            info[ingest_job.job_id_id] = ["Namespace: {0} <br/>".format(ingest_job.namespace), "Collection: {0} <br/>".format(collection_label)]
+
+    counts = get_counts(info.keys())
+    for job_id in info:
+        status_count = counts[job_id]
+        info[job_id].append(result_display.format(status_count["Success"], status_count["Failure"], status_count["Skipped"]))
+
+    return info
+
+def get_result_counts(jobs):
+    """Return dict of job id: {result label: count}, counted from result rows; used to rebuild job totals."""
+    job_ids = {}
+    for job in jobs:
+        job_ids.setdefault(job.type_id.label, []).append(job.job_id)
+    counts = {}
+    counts.update(count_results(delete_objects, job_ids.get("delete", [])))
+    counts.update(count_results(pathauto_objects, job_ids.get("pathauto", [])))
+    counts.update(count_object_results(job_ids.get("ingest", [])))
+    return counts
+
+def count_results(model, job_ids):
+    """Return dict of job id: {result label: count} for delete or pathauto objects of jobs."""
+    counts = dict((job_id, {}) for job_id in job_ids)
+    rows = model.objects.filter(job_id__in=job_ids).values_list("job_id", "result_id__label").annotate(Count("pk"))
+    for job_id, label, count in rows:
+        counts[job_id][label] = count
+    return counts
+
+def count_object_results(job_ids):
+    """Return dict of job id: {result label: count} for objects of ingest jobs.
+
+    Counted per object as ResultRecorder counts them: objects with a pid by pid, and rows without a
+    pid (skipped objects) by object path.
+    """
+    results = {}
+    rows = job_objects.objects.filter(job_id__in=job_ids, pid__isnull=False).values_list(
+        "job_id", "pid", "result_id__label").distinct()
+    for job_id, pid, label in rows:
+        results.setdefault((job_id, pid), set()).add(label)
+    rows = job_objects.objects.filter(job_id__in=job_ids, pid__isnull=True).values_list(
+        "job_id", "obj_file", "result_id__label").distinct()
+    for job_id, obj_file, label in rows:
+        results.setdefault((job_id, None, object_path(obj_file)), set()).add(label)
+
+    counts = dict((job_id, {"Success": 0, "Failure": 0, "Skipped": 0}) for job_id in job_ids)
+    for key, labels in results.items():
+        counts[key[0]][object_result(labels)] += 1
+    return counts
 
 def get_actions(job):
     """Required function: return actions to populate in job table."""
@@ -498,9 +554,7 @@ def get_job_objects(job_id, job_type="ingest"):
         }
             results["objects"].append(object_data)
 
-        results["status_count"]["Success"] = delete_objects.objects.filter(job_id=job_id, result_id=success_id).count()
-        results["status_count"]["Skipped"] = delete_objects.objects.filter(job_id=job_id, result_id=skip_id).count()
-        results["status_count"]["Failure"] = delete_objects.objects.filter(job_id=job_id, result_id=fail_id).count()
+        results["status_count"] = get_counts([int(job_id)])[int(job_id)]
         return results
 
     if job_type == "pathauto":
@@ -514,9 +568,7 @@ def get_job_objects(job_id, job_type="ingest"):
         }
             results["objects"].append(object_data)
 
-        results["status_count"]["Success"] = pathauto_objects.objects.filter(job_id=job_id, result_id=success_id).count()
-        results["status_count"]["Skipped"] = pathauto_objects.objects.filter(job_id=job_id, result_id=skip_id).count()
-        results["status_count"]["Failure"] = pathauto_objects.objects.filter(job_id=job_id, result_id=fail_id).count()
+        results["status_count"] = get_counts([int(job_id)])[int(job_id)]
         return results
 
     
@@ -554,6 +606,160 @@ def get_job_objects(job_id, job_type="ingest"):
     results = update_results(object_head, results, fail_id)
     return results
 
+def get_job_objects_page(job, after=None, limit=50, result=None, datastream=None, prefix=None):
+    """Return one page of a job's objects for the object browser.
+
+    Objects with a pid are grouped and filtered by pid in SQL and paged on pid. Then rows without a
+    pid (skipped objects) are paged on object_id and listed once per object path, flagged "skipped";
+    at most MAX_SCAN_ROWS of them are read per page, so a page may hold fewer objects than limit
+    and still have a cursor for the following page.
+
+    args:
+        job(jobs): job to list objects of.
+    kwargs:
+        after(str): cursor from the previous page.
+        limit(int): objects per page.
+        result(str): only objects with this result (Success, Failure or Skipped).
+        datastream(str): only results for this datastream label (ingest jobs).
+        prefix(str): only pids starting with prefix.
+    returns:
+        (dict): "objects", and "next", the cursor for the following page or None.
+
+    Raises ValueError if after is not a cursor of this job type.
+    """
+    job_type = job.type_id.label
+    if job_type in ["delete", "pathauto"]:
+        if after is not None:
+            after = int(after)
+        model, date_field = (delete_objects, "deleted") if job_type == "delete" else (pathauto_objects, "generated")
+        rows = model.objects.filter(job_id=job)
+        if result:
+            rows = rows.filter(result_id__label=result)
+        if prefix:
+            rows = rows.filter(pid__startswith=prefix)
+        page, next_key = keyset_page(rows.values("object_id", "pid", date_field, "result_id__label"), "object_id",
+                                     after=after, limit=limit)
+        objects = [{"pid": r["pid"], "completed": r[date_field], "result": r["result_id__label"], "subs": []} for r in page]
+        return {"objects": objects, "next": next_key}
+
+    rows = job_objects.objects.filter(job_id=job)
+    if datastream:
+        rows = rows.filter(datastream_id__datastream_label=datastream)
+    if prefix:
+        rows = rows.filter(pid__startswith=prefix)
+
+    # Cursors of the pass over skipped objects are "~" and the last object_id read.
+    objects = []
+    if after is None or not after.startswith("~"):
+        objects, next_key = get_pid_objects(rows, after, limit, result)
+        if next_key is not None:
+            return {"objects": objects, "next": next_key}
+        after = 0
+    else:
+        after = int(after[1:])
+    skipped, next_key = get_skipped_objects(rows, after, limit - len(objects), result)
+    return {"objects": objects + skipped, "next": next_key}
+
+def get_pid_objects(rows, after, limit, result):
+    """Return a page of the objects of rows with a pid, after the pid after, and the next pid cursor.
+
+    Objects are grouped and their result filtered in SQL, over the (job_id, pid) index; then the rows of
+    the page's pids are read.
+    """
+    groups = filter_combined_result(rows.filter(pid__isnull=False).values("pid").annotate(**result_sums()), result)
+    page, next_key = keyset_page(groups, "pid", after=after, limit=limit)
+
+    by_pid = dict((g["pid"], {"pid": g["pid"], "skipped": False, "path": None, "result": combined_result(g), "subs": []})
+                  for g in page)
+    subs = rows.filter(pid__in=by_pid.keys()).order_by("pid", "object_id").values_list(
+        "pid", "datastream_id__datastream_label", "obj_file", "created", "result_id__label")
+    for pid, ds, obj_file, created, ds_result in subs:
+        obj = by_pid[pid]
+        if obj["path"] is None:
+            obj["path"] = object_path(obj_file)
+        obj["subs"].append(object_sub(ds, obj_file, created, ds_result))
+
+    return [by_pid[g["pid"]] for g in page], next_key
+
+def get_skipped_objects(rows, after, limit, result):
+    """Return up to limit objects of rows without a pid, after the object_id after, and the next cursor.
+
+    Rows are grouped by object path, and an object is listed at its first row, so objects whose rows
+    are spread out are listed once. At most MAX_SCAN_ROWS rows are read; if they hold fewer than limit
+    matching objects, the cursor is the last row read.
+    """
+    rows = rows.filter(pid__isnull=True)
+    batch = list(rows.filter(object_id__gt=after).order_by("object_id").values_list(
+        "object_id", "obj_file")[:MAX_SCAN_ROWS])
+    if not batch:
+        return [], None
+
+    paths = set(object_path(obj_file) for object_id, obj_file in batch)
+    path_rows = Q(obj_file__isnull=True) if None in paths else Q()
+    for path in paths - set([None]):
+        path_rows |= Q(obj_file__startswith=path + "/")
+    by_path = {}
+    subs = rows.filter(path_rows).order_by("object_id").values_list(
+        "object_id", "datastream_id__datastream_label", "obj_file", "created", "result_id__label")
+    for object_id, ds, obj_file, created, ds_result in subs:
+        path = object_path(obj_file)
+        if path not in paths:
+            continue
+        if path not in by_path:
+            by_path[path] = (object_id, {"pid": None, "skipped": True, "path": path, "subs": []})
+        by_path[path][1]["subs"].append(object_sub(ds, obj_file, created, ds_result))
+
+    objects = []
+    for object_id, obj_file in batch:
+        first_id, obj = by_path[object_path(obj_file)]
+        if object_id != first_id:
+            continue
+        obj["result"] = object_result(set(sub["result"] for sub in obj["subs"]))
+        if result and obj["result"] != result:
+            continue
+        if len(objects) == limit:
+            return objects, "~{0}".format(after)
+        objects.append(obj)
+        after = object_id
+    if len(batch) == MAX_SCAN_ROWS:
+        return objects, "~{0}".format(batch[-1][0])
+    return objects, None
+
+def object_sub(ds, obj_file, created, ds_result):
+    """Return datastream entry of an object in the object browser."""
+    return {
+        "name": ds,
+        "file": os.path.basename(obj_file) if obj_file else "Null",
+        "created": created,
+        "result": ds_result,
+    }
+
+def get_result_querysets(job):
+    """Return querysets of every per-object result row of job, for archiving."""
+    return [model.objects.filter(job_id=job) for model in (job_objects, delete_objects, pathauto_objects)]
+
+def get_job_results(job, result=None):
+    """Return columns and an iterator over every per-object result row of job, for export.
+
+    kwargs:
+        result(str): only rows with this result label.
+    returns:
+        (list, iterator): column names, and rows as tuples in the same order.
+    """
+    job_type = job.type_id.label
+    if job_type in ["delete", "pathauto"]:
+        model, date_field = (delete_objects, "deleted") if job_type == "delete" else (pathauto_objects, "generated")
+        columns = ["pid", date_field, "result"]
+        fields = ["pid", date_field, "result_id__label"]
+    else:
+        model = job_objects
+        columns = ["pid", "datastream", "file", "created", "new_object", "result"]
+        fields = ["pid", "datastream_id__datastream_label", "obj_file", "created", "new_object", "result_id__label"]
+    rows = model.objects.filter(job_id=job)
+    if result:
+        rows = rows.filter(result_id__label=result)
+    return columns, iterate_rows(rows, "object_id", fields)
+
 def update_results(object_head, results, fail_id):
     """Update results object."""
     all_result_ids = [obj["result_id"] for obj in object_head["subs"]]
@@ -0,0 +1,157 @@
+"""Move per-object results of archived jobs out of the results tables into gzipped files, and back on demand.
+
+Each archive is a gzipped file of JSON lines, one per result row: {"model": "app_label.model", "fields": {...}}.
+Result totals (job_counts) stay in the database, so job lists show the same counts either way.
+"""
+from datetime import datetime, timedelta
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from models import jobs, job_archives
+import gzip
+import json
+import logging
+import os
+
+# Rows read, written or deleted per query.
+ARCHIVE_BATCH_SIZE = 2000
+
+
+def can_archive(app):
+    """Return True if app provides get_result_querysets."""
+    return hasattr(app.views, "get_result_querysets") and callable(getattr(app.views, "get_result_querysets"))
+
+
+def archive_path(job):
+    """Return path of the archive file of job."""
+    return os.path.join(settings.RESULTS_ARCHIVE_DIR, "job-{0}-results.jsonl.gz".format(getattr(job, "pk", job)))
+
+
+def encode_value(value):
+    """Return value in a form json can write."""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def archive_rows(queryset):
+    """Yield (pk, line) for each row of queryset, in batches ordered by primary key."""
+    model = queryset.model
+    label = model._meta.label
+    attnames = [f.attname for f in model._meta.concrete_fields]
+    pk = model._meta.pk.attname
+    queryset = queryset.order_by(pk)
+    last = None
+    while True:
+        batch = queryset if last is None else queryset.filter(pk__gt=last)
+        n = 0
+        for row in batch.values(*attnames)[:ARCHIVE_BATCH_SIZE].iterator():
+            last = row[pk]
+            n += 1
+            fields = dict((k, encode_value(v)) for k, v in row.items())
+            yield last, json.dumps({"model": label, "fields": fields}) + "\n"
+        if n < ARCHIVE_BATCH_SIZE:
+            break
+
+
+def delete_rows(queryset, pks):
+    """Delete rows of queryset with primary keys pks, a batch at a time."""
+    for i in range(0, len(pks), ARCHIVE_BATCH_SIZE):
+        queryset.model.objects.filter(pk__in=pks[i:i + ARCHIVE_BATCH_SIZE]).delete()
+
+
+def archive_job(app, job):
+    """Write result rows of job to its archive file, then remove them from the results tables.
+
+    The file is complete and synced before any row is deleted, and rows are deleted in the same
+    transaction that records the archive, so a failure part way leaves the rows where they were.
+
+    args:
+        app(module): app package of the job, with views.get_result_querysets.
+        job(jobs): job to archive.
+    returns:
+        (int): number of rows archived, or None if the job was already archived.
+    """
+    if job_archives.objects.filter(job_id=job).exists():
+        return None
+
+    path = archive_path(job)
+    if not os.path.isdir(settings.RESULTS_ARCHIVE_DIR):
+        os.makedirs(settings.RESULTS_ARCHIVE_DIR)
+
+    querysets = app.views.get_result_querysets(job)
+    archived = []
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb") as f:
+            for queryset in querysets:
+                pks = []
+                for pk, line in archive_rows(queryset):
+                    f.write(line)
+                    pks.append(pk)
+                archived.append((queryset, pks))
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.rename(tmp_path, path)
+
+    total = sum(len(pks) for q, pks in archived)
+    with transaction.atomic():
+        job_archives.objects.create(job_id=job, path=path, rows=total, archived=timezone.now())
+        for queryset, pks in archived:
+            delete_rows(queryset, pks)
+
+    logging.info("Archived {0} result rows of job {1} to {2}.".format(total, job.job_id, path))
+    return total
+
+
+def decode_row(model, fields):
+    """Return instance of model from archived fields."""
+    by_attname = dict((f.attname, f) for f in model._meta.concrete_fields)
+    values = {}
+    for name, value in fields.items():
+        field = by_attname[name]
+        # to_python of a foreign key delegates to the target field, so ids come back as ids.
+        values[name] = field.to_python(value) if value is not None else None
+    return model(**values)
+
+
+def restore_job(job):
+    """Load result rows of job back from its archive file into the results tables.
+
+    returns:
+        (int): number of rows restored, or None if the job isn't archived.
+    """
+    try:
+        archive = job_archives.objects.get(job_id=job)
+    except job_archives.DoesNotExist:
+        return None
+
+    total = 0
+    with transaction.atomic():
+        batches = {}
+        with gzip.open(archive.path, "rb") as f:
+            for line in f:
+                row = json.loads(line)
+                model = apps.get_model(row["model"])
+                batch = batches.setdefault(model, [])
+                batch.append(decode_row(model, row["fields"]))
+                if len(batch) >= ARCHIVE_BATCH_SIZE:
+                    model.objects.bulk_create(batch)
+                    total += len(batch)
+                    batches[model] = []
+        for model, batch in batches.items():
+            model.objects.bulk_create(batch)
+            total += len(batch)
+        archive.delete()
+
+    os.remove(archive.path)
+    logging.info("Restored {0} result rows of job {1}.".format(total, job.job_id))
+    return total
+
+
+def jobs_to_archive(retention_days=None):
+    """Return removed jobs completed over retention_days ago whose results are still in the results tables."""
+    retention_days = settings.RESULTS_RETENTION_DAYS if retention_days is None else retention_days
+    cutoff = timezone.now() - timedelta(days=retention_days)
+    return jobs.objects.filter(archived="y", completed__lt=cutoff, job_archives__isnull=True).select_related("type_id")
@@ -0,0 +1,41 @@
+"""Check whether a running job has been stopped, without querying the database for every item."""
+import time
+from django.conf import settings
+from models import jobs, status
+
+
+class CancellationToken(object):
+
+    """Report whether a job has been stopped by the user.
+
+    The job's status is read from the database at most once every CANCEL_CHECK_INTERVAL seconds;
+    between reads the last answer is used. Once cancelled, the token stays cancelled.
+    """
+
+    def __init__(self, job_id, interval=None):
+        """Load statuses that mean the job was stopped.
+
+        args:
+            job_id(int): id of the job to watch.
+        kwargs:
+            interval(float): seconds between database reads; defaults to CANCEL_CHECK_INTERVAL.
+        """
+        self.job_id = job_id
+        self.interval = settings.CANCEL_CHECK_INTERVAL if interval is None else interval
+        self.manual_status_ids = set(status.objects.filter(failure="manual").values_list("status_id", flat=True))
+        self.cancelled = False
+        self.last_check = None
+
+    def is_cancelled(self):
+        """Return True if the job has been stopped."""
+        if not self.cancelled:
+            now = time.time()
+            if self.last_check is None or now - self.last_check >= self.interval:
+                self.last_check = now
+                status_id = jobs.objects.filter(job_id=self.job_id).values_list("status_id", flat=True).first()
+                self.cancelled = status_id in self.manual_status_ids
+        return self.cancelled
+
+    def cancel(self):
+        """Mark job as stopped without waiting for the next database read."""
+        self.cancelled = True
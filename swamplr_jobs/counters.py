@@ -0,0 +1,47 @@
+"""Per-job result totals, kept up to date as results are recorded so job pages don't count result rows."""
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from models import job_counts
+
+RESULT_LABELS = ["Success", "Failure", "Skipped"]
+
+
+def increment_counts(job, counts):
+    """Add to result totals of job.
+
+    Call inside the transaction that writes the result rows, so totals and rows stay in step.
+
+    args:
+        job(jobs or int): job or job id.
+        counts(dict): result label: number to add.
+    """
+    job_id = getattr(job, "pk", job)
+    for label, n in counts.items():
+        if not n:
+            continue
+        if job_counts.objects.filter(job_id=job_id, result=label).update(count=F("count") + n):
+            continue
+        try:
+            with transaction.atomic():
+                job_counts.objects.create(job_id_id=job_id, result=label, count=n)
+        except IntegrityError:
+            # Created by another process since the update above.
+            job_counts.objects.filter(job_id=job_id, result=label).update(count=F("count") + n)
+
+
+def set_counts(job, counts):
+    """Replace result totals of job, e.g. when recounting from result rows."""
+    job_id = getattr(job, "pk", job)
+    with transaction.atomic():
+        job_counts.objects.filter(job_id=job_id).delete()
+        job_counts.objects.bulk_create(
+            [job_counts(job_id_id=job_id, result=label, count=n) for label, n in counts.items() if n]
+        )
+
+
+def get_counts(job_ids):
+    """Return dict of job id: {result label: total} for jobs, with one query."""
+    counts = dict((job_id, dict.fromkeys(RESULT_LABELS, 0)) for job_id in job_ids)
+    for job_id, label, n in job_counts.objects.filter(job_id__in=job_ids).values_list("job_id", "result", "count"):
+        counts[job_id][label] = n
+    return counts
@@ -0,0 +1,89 @@
+"""Stream per-object results of a job as CSV or JSON lines, without loading the job's rows into memory."""
+from datetime import datetime
+import csv
+import json
+
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "jsonl": "application/x-ndjson",
+}
+
+# Rows fetched per query while exporting.
+EXPORT_BATCH_SIZE = 2000
+
+
+def iterate_rows(queryset, key, fields, batch_size=EXPORT_BATCH_SIZE):
+    """Yield values_list() rows of queryset in batches, paging on key.
+
+    MySQLdb fetches a whole result set into memory even with .iterator(), so rows are read in keyset batches
+    of batch_size; each batch is read with .iterator() so it isn't cached on the queryset.
+
+    args:
+        queryset(QuerySet): rows to export.
+        key(str): unique, ordered field to page on; not included in the yielded rows.
+        fields(list): fields to yield, as for values_list().
+    """
+    queryset = queryset.order_by(key)
+    last = None
+    while True:
+        batch = queryset if last is None else queryset.filter(**{key + "__gt": last})
+        n = 0
+        for row in batch.values_list(key, *fields)[:batch_size].iterator():
+            last = row[0]
+            n += 1
+            yield row[1:]
+        if n < batch_size:
+            break
+
+
+def export_value(value):
+    """Return value as a string for export."""
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, unicode):
+        return value
+    return unicode(value)
+
+
+class Echo(object):
+
+    """File-like object whose write returns the value written, so csv.writer can produce lines one by one."""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(columns, rows):
+    """Yield CSV lines (utf-8) for a header of columns, then rows."""
+    writer = csv.writer(Echo())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow([export_value(v).encode("utf-8") for v in row])
+
+
+def jsonl_lines(columns, rows):
+    """Yield one JSON object per row, keyed by columns."""
+    for row in rows:
+        yield json.dumps(dict(zip(columns, [None if v is None else export_value(v) for v in row]))) + "\n"
+
+
+def export_lines(app, job, export_format="csv", result=None):
+    """Yield lines of an export of job's per-object results.
+
+    args:
+        app(module): app package of the job, with views.get_job_results.
+        job(jobs): job to export.
+    kwargs:
+        export_format(str): key of EXPORT_FORMATS.
+        result(str): only rows with this result label.
+    """
+    columns, rows = app.views.get_job_results(job, result=result)
+    lines = csv_lines if export_format == "csv" else jsonl_lines
+    return lines(columns, rows)
+
+
+def can_export(app):
+    """Return True if app provides get_job_results."""
+    return hasattr(app.views, "get_job_results") and callable(getattr(app.views, "get_job_results"))
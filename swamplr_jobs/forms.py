@@ -0,0 +1,12 @@
+from django import forms
+from scheduler import default_priority
+
+
+def priority_field(job_type_label):
+    """Return field for the priority of a new job, defaulting to the configured priority of its type."""
+    return forms.IntegerField(
+        required=False,
+        label="Priority",
+        initial=default_priority(job_type_label),
+        help_text="Queued jobs with higher priority start first. Leave blank for the default of this job type."
+    )
@@ -1,6 +1,7 @@
 from django.utils import timezone
 import os
 from models import *
+from counters import get_counts
 import logging
 
 
@@ -20,20 +21,21 @@ class JobQueue():
 	"""Get all jobs matching selected filters."""
         # TODO - add filters.
         
-        job_data = jobs.objects.all().order_by('-created')
+        job_data = list(jobs.objects.all().select_related('status_id', 'type_id').order_by('-created'))
+        counts = get_counts([job.job_id for job in job_data])
         current_jobs = {}
         
         for job in job_data:
 
             currjobData = {}
             currjobData['job_id'] = job.job_id
-            currjobData['status'] = status.objects.get(status_id=job.status_id_id).status
-            currjobData['type'] = job_types.objects.get(type_id=job.type_id_id).label
+            currjobData['status'] = job.status_id.status
+            currjobData['type'] = job.type_id.label
             currjobData['started'] = job.started
             currjobData['completed'] = job.completed
-            currjobData['success_count'] = get_job_status_count(job.job_id, "success") 
-            currjobData['failed_count'] = get_job_status_count(job.job_id, "failure") 
-            currjobData['skipped_count'] = get_job_status_count(job.job_id, "skipped") 
+            currjobData['success_count'] = counts[job.job_id]["Success"]
+            currjobData['failed_count'] = counts[job.job_id]["Failure"]
+            currjobData['skipped_count'] = counts[job.job_id]["Skipped"]
         
             current_jobs[job.job_id] = currjobData
         
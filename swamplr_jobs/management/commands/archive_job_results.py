@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from swamplr_jobs import views
+from swamplr_jobs.archive import archive_job, can_archive, jobs_to_archive
+from swamplr_jobs.models import jobs
+import logging
+
+
+class Command(BaseCommand):
+    help = 'Moves per-object results of removed jobs past the retention period into compressed archive files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('job_ids', nargs='*', type=int,
+                            help='Jobs to archive, whether removed or not; by default, jobs past the retention period.')
+        parser.add_argument('--days', type=int,
+                            help='Archive removed jobs completed more than this many days ago (default RESULTS_RETENTION_DAYS).')
+
+    def handle(self, *args, **options):
+        views.load_installed_apps()
+
+        if options['job_ids']:
+            job_list = jobs.objects.filter(job_id__in=options['job_ids']).select_related("type_id")
+        else:
+            job_list = jobs_to_archive(options['days'])
+
+        archived = 0
+        for job in job_list.order_by("job_id").iterator():
+            app = views.import_apps.get(job.type_id.app_name)
+            if app is None or not can_archive(app):
+                continue
+            rows = archive_job(app, job)
+            if rows is not None:
+                archived += 1
+            else:
+                logging.info("Results of job {0} are already archived.".format(job.job_id))
+
+        self.stdout.write("Archived results of {0} job(s).".format(archived))
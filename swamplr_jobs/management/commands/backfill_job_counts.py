@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from swamplr_jobs import views
+from swamplr_jobs.counters import set_counts
+from swamplr_jobs.models import jobs
+import logging
+
+
+class Command(BaseCommand):
+    help = 'Recounts job result totals from result rows, e.g. for jobs run before totals were kept'
+
+    def add_arguments(self, parser):
+        parser.add_argument('job_ids', nargs='*', type=int,
+                            help='Jobs to recount; all jobs if none given.')
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Number of jobs to recount per query.')
+
+    def handle(self, *args, **options):
+        views.load_installed_apps()
+
+        job_list = jobs.objects.select_related("type_id").order_by("job_id")
+        if options['job_ids']:
+            job_list = job_list.filter(job_id__in=options['job_ids'])
+
+        total = 0
+        last_id = 0
+        while True:
+            batch = list(job_list.filter(job_id__gt=last_id)[:options['batch_size']])
+            if not batch:
+                break
+            last_id = batch[-1].job_id
+
+            by_app = {}
+            for j in batch:
+                by_app.setdefault(j.type_id.app_name, []).append(j)
+
+            for app_name, app_jobs in by_app.items():
+                app = views.import_apps.get(app_name)
+                if app is None or not callable(getattr(app.views, "get_result_counts", None)):
+                    continue
+                for job_id, counts in app.views.get_result_counts(app_jobs).items():
+                    set_counts(job_id, counts)
+                    total += 1
+
+            logging.info("Recounted results up to job {0}.".format(last_id))
+
+        self.stdout.write("Recounted results for {0} job(s).".format(total))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+from swamplr_jobs import views
+from swamplr_jobs.export import EXPORT_FORMATS, can_export, export_lines
+from swamplr_jobs.models import jobs
+import sys
+
+
+class Command(BaseCommand):
+    help = 'Writes every per-object result of a job as CSV or JSON lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('job_id', type=int)
+        parser.add_argument('--format', dest='format', choices=sorted(EXPORT_FORMATS), default='csv',
+                            help='Output format.')
+        parser.add_argument('--result', help='Only export rows with this result, e.g. Failure.')
+        parser.add_argument('--output', help='File to write to; standard output if not given.')
+
+    def handle(self, *args, **options):
+        views.load_installed_apps()
+
+        try:
+            job = jobs.objects.select_related("type_id").get(job_id=options['job_id'])
+        except jobs.DoesNotExist:
+            raise CommandError("No job {0}".format(options['job_id']))
+        app = views.import_apps.get(job.type_id.app_name)
+        if app is None or not can_export(app):
+            raise CommandError("Results of {0} jobs can't be exported.".format(job.type_id.label))
+
+        lines = export_lines(app, job, export_format=options['format'], result=options['result'])
+        if options['output']:
+            with open(options['output'], 'wb') as f:
+                for line in lines:
+                    f.write(line)
+        else:
+            # Write to the command's stdout (rather than the encoding wrapper) so bytes pass through as-is.
+            out = getattr(self.stdout, '_out', sys.stdout)
+            for line in lines:
+                out.write(line)
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand, CommandError
+from swamplr_jobs.archive import restore_job
+from swamplr_jobs.models import jobs
+
+
+class Command(BaseCommand):
+    help = 'Loads archived per-object results of jobs back into the results tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('job_ids', nargs='+', type=int)
+
+    def handle(self, *args, **options):
+        for job in jobs.objects.filter(job_id__in=options['job_ids']).order_by("job_id"):
+            rows = restore_job(job)
+            if rows is None:
+                raise CommandError("Results of job {0} aren't archived.".format(job.job_id))
+            self.stdout.write("Restored {0} result rows of job {1}.".format(rows, job.job_id))
@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from swamplr_jobs.worker import JobWorker
+
+
+class Command(BaseCommand):
+    help = 'Runs queued jobs continuously until stopped with SIGTERM or SIGINT'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=settings.WORKER_CONCURRENCY,
+                            help='Number of jobs to run at once.')
+        parser.add_argument('--poll-interval', type=float, default=settings.WORKER_POLL_INTERVAL,
+                            help='Seconds between checks of the job queue.')
+        parser.add_argument('--heartbeat-interval', type=float, default=settings.WORKER_HEARTBEAT_INTERVAL,
+                            help='Seconds between heartbeats of running jobs.')
+        parser.add_argument('--pre-process-interval', type=float, default=settings.PRE_PROCESS_INTERVAL,
+                            help='Seconds between runs of app pre_process functions.')
+
+    def handle(self, *args, **options):
+        worker = JobWorker(
+            concurrency=options['concurrency'],
+            poll_interval=options['poll_interval'],
+            heartbeat_interval=options['heartbeat_interval'],
+            pre_process_interval=options['pre_process_interval'],
+        )
+        worker.run()
@@ -1,21 +1,29 @@
+from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
 from swamplr_jobs import views
-from swamplr_jobs.models import jobs, status
+from swamplr_jobs.worker import claim_next_job, reclaim_stale_jobs, worker_name, Heartbeat
 import logging
 
 class Command(BaseCommand):
     help = 'Starts a new job from the DB'
 
     def handle(self, *args, **options):
-	# Perform any necessary pre-processing required by the installed apps
-	views.pre_process()
+        # Perform any necessary pre-processing required by the installed apps
+        views.pre_process()
 
-        job_queued_status_id = status.objects.get(default="y")
-        incomplete_job = jobs.objects.filter(status_id_id=job_queued_status_id).first()
+        reclaim_stale_jobs()
+
+        # Claim atomically, so that a job is never started by two processes.
+        worker = worker_name()
+        incomplete_job = claim_next_job(worker)
         if not incomplete_job:
 
             return None
 
         else:
-            views.process_job(incomplete_job)
-
+            heartbeat = Heartbeat(incomplete_job.job_id, worker, settings.WORKER_HEARTBEAT_INTERVAL)
+            heartbeat.start()
+            try:
+                views.process_job(incomplete_job)
+            finally:
+                heartbeat.stop()
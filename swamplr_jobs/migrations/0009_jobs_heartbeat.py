@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('swamplr_jobs', '0008_auto_20180221_1708'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='jobs',
+            name='heartbeat',
+            field=models.DateTimeField(blank=True, null=True),
+        )
+    ]
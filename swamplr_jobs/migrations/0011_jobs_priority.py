@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('swamplr_jobs', '0010_jobs_worker'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='jobs',
+            name='priority',
+            field=models.IntegerField(default=0),
+        )
+    ]
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('swamplr_jobs', '0011_jobs_priority'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='job_counts',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('result', models.CharField(max_length=32)),
+                ('count', models.IntegerField(default=0)),
+                ('job_id', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='swamplr_jobs.jobs')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='job_counts',
+            unique_together=set([('job_id', 'result')]),
+        ),
+    ]
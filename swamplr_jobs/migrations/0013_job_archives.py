@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 15:47
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('swamplr_jobs', '0012_job_counts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='job_archives',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=255)),
+                ('rows', models.IntegerField(default=0)),
+                ('archived', models.DateTimeField()),
+                ('job_id', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='swamplr_jobs.jobs')),
+            ],
+        ),
+    ]
@@ -27,6 +27,11 @@ class jobs(models.Model):
     type_id = models.ForeignKey("job_types")
     process_id = models.IntegerField(default=0)
     archived = models.CharField(max_length=1, blank=True)
+    # Higher priority jobs are started first.
+    priority = models.IntegerField(default=0)
+    # Worker (host:pid) that claimed the job, and last time it reported the job as still running.
+    worker = models.CharField(max_length=255, blank=True)
+    heartbeat = models.DateTimeField(blank=True, null=True)
 
 class status(models.Model):
     """Status of the job: running, failed, successful, etc."""
@@ -36,3 +41,19 @@ class status(models.Model):
     failure = models.CharField(max_length=20)
     running = models.CharField(max_length=1)
     success = models.CharField(max_length=1)
+
+class job_counts(models.Model):
+    """Running total of results of each kind (Success, Failure, Skipped) for a job."""
+    job_id = models.ForeignKey("jobs")
+    result = models.CharField(max_length=32)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ("job_id", "result")
+
+class job_archives(models.Model):
+    """Per-object results of a job moved out of the results tables into a compressed file."""
+    job_id = models.OneToOneField("jobs", on_delete=models.CASCADE)
+    path = models.CharField(max_length=255)
+    rows = models.IntegerField(default=0)
+    archived = models.DateTimeField()
@@ -0,0 +1,61 @@
+"""Keyset pagination of job result rows for the object browser on the job page."""
+from django.db.models import Case, IntegerField, Sum, When
+from counters import RESULT_LABELS
+
+# Largest page the object browser may request.
+MAX_PAGE_SIZE = 500
+
+# Most result rows read for a page where objects are grouped outside SQL; such a page may then be short
+# and still have a cursor for the following page.
+MAX_SCAN_ROWS = 5000
+
+
+def result_sums(field="result_id__label"):
+    """Return annotations counting rows of each result in a group: success, failure and skipped."""
+    return dict(
+        (label.lower(), Sum(Case(When(then=1, **{field: label}), default=0, output_field=IntegerField())))
+        for label in RESULT_LABELS
+    )
+
+
+def combined_result(group):
+    """Return result of a group annotated with result_sums.
+
+    As elsewhere, a group that had any failure failed; otherwise it succeeded if anything succeeded.
+    """
+    if group["failure"]:
+        return "Failure"
+    if group["success"]:
+        return "Success"
+    return "Skipped"
+
+
+def filter_combined_result(groups, result):
+    """Keep groups annotated with result_sums whose combined result is result."""
+    if result == "Failure":
+        return groups.filter(failure__gt=0)
+    if result == "Success":
+        return groups.filter(failure=0, success__gt=0)
+    if result == "Skipped":
+        return groups.filter(failure=0, success=0, skipped__gt=0)
+    return groups
+
+
+def keyset_page(queryset, key, after=None, limit=50):
+    """Return one page of values() rows ordered by key, and the cursor for the next page.
+
+    args:
+        queryset(QuerySet): values() queryset including key.
+        key(str): unique, ordered field to page on.
+    kwargs:
+        after: key of the last row of the previous page, or None for the first page.
+        limit(int): rows per page.
+    returns:
+        (list, value): rows, and key of the last row or None if there are no more rows.
+    """
+    if after is not None:
+        queryset = queryset.filter(**{key + "__gt": after})
+    rows = list(queryset.order_by(key)[:limit + 1])
+    if len(rows) > limit:
+        return rows[:limit], rows[limit - 1][key]
+    return rows, None
@@ -0,0 +1,115 @@
+"""Choose which queued job runs next: priority with aging, and limits on running jobs per job type."""
+import heapq
+from collections import defaultdict
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from models import jobs, status
+
+# Number of recently completed jobs per type used to estimate run time.
+DURATION_SAMPLE = 20
+
+
+def default_priority(job_type_label):
+    """Return configured priority for new jobs of type."""
+    return settings.JOB_TYPE_PRIORITY.get(job_type_label, 0)
+
+
+def effective_priority(job, now, aging_interval=None):
+    """Return job priority plus one point for every aging_interval seconds it has been queued."""
+    aging_interval = settings.JOB_AGING_INTERVAL if aging_interval is None else aging_interval
+    priority = job.priority
+    if aging_interval > 0:
+        priority += max(0, (now - job.created).total_seconds()) / aging_interval
+    return priority
+
+
+def is_over_limit(job):
+    """Return True if job is running but beyond the limit of running jobs for its type.
+
+    Used after a claim, since two workers may claim jobs of the same type at once. Jobs that started
+    earlier keep their place, so only the later claim is given up.
+    """
+    limit = settings.JOB_TYPE_MAX_RUNNING.get(job.type_id.label)
+    if not limit:
+        return False
+    first = jobs.objects.filter(type_id=job.type_id, status_id__running="y").order_by("started", "job_id")
+    return job.job_id not in list(first.values_list("job_id", flat=True)[:limit])
+
+
+class Schedule(object):
+
+    """Snapshot of the queue, ordered by effective priority, then by job id."""
+
+    def __init__(self, now=None):
+        """Load queued and running jobs."""
+        self.now = now or timezone.now()
+        queued = status.objects.get(default="y")
+        self.queue = sorted(
+            jobs.objects.filter(status_id=queued).select_related("type_id"),
+            key=lambda j: (-effective_priority(j, self.now), j.job_id)
+        )
+        self.running = list(jobs.objects.filter(status_id__running="y").select_related("type_id"))
+
+    def runnable(self):
+        """Return queued jobs whose type is below its running limit, in the order they should start."""
+        counts = defaultdict(int)
+        for j in self.running:
+            counts[j.type_id.label] += 1
+        limits = settings.JOB_TYPE_MAX_RUNNING
+        return [j for j in self.queue if not limits.get(j.type_id.label) or counts[j.type_id.label] < limits[j.type_id.label]]
+
+    def average_durations(self):
+        """Return dict of job type label: average run time (timedelta) of its recently completed jobs."""
+        samples = defaultdict(list)
+        done = jobs.objects.filter(started__isnull=False, completed__isnull=False).order_by("-job_id")
+        for label, started, completed in done.values_list("type_id__label", "started", "completed")[:DURATION_SAMPLE * 20]:
+            if len(samples[label]) < DURATION_SAMPLE and completed >= started:
+                samples[label].append(completed - started)
+        return dict((label, sum(d, timedelta()) / len(d)) for label, d in samples.items())
+
+    def estimates(self, slots=None):
+        """Estimate queue position and start time of each queued job.
+
+        Running and queued jobs are assumed to take the average time of recent jobs of their type, and
+        `slots` jobs to run at once (by default WORKER_CONCURRENCY, or more if more are running).
+
+        returns:
+            (dict): job id: (position, estimated start time or None if there is no history to go on).
+        """
+        durations = self.average_durations()
+        overall = sum(durations.values(), timedelta()) / len(durations) if durations else None
+        slots = max(slots or settings.WORKER_CONCURRENCY, len(self.running), 1)
+        limits = settings.JOB_TYPE_MAX_RUNNING
+
+        # End times of jobs in each slot, and of jobs of each type with a running limit.
+        free = []
+        type_ends = defaultdict(list)
+        for j in self.running:
+            duration = durations.get(j.type_id.label, overall)
+            end = max(self.now, (j.started or self.now) + duration) if duration is not None else self.now
+            free.append(end)
+            if limits.get(j.type_id.label):
+                type_ends[j.type_id.label].append(end)
+        free.extend([self.now] * (slots - len(free)))
+        heapq.heapify(free)
+        for ends in type_ends.values():
+            heapq.heapify(ends)
+
+        estimates = {}
+        for position, j in enumerate(self.queue, 1):
+            label = j.type_id.label
+            duration = durations.get(label, overall)
+            if duration is None:
+                estimates[j.job_id] = (position, None)
+                continue
+            start = heapq.heappop(free)
+            limit = limits.get(label)
+            if limit:
+                ends = type_ends[label]
+                if len(ends) >= limit:
+                    start = max(start, heapq.heappop(ends))
+                heapq.heappush(ends, start + duration)
+            heapq.heappush(free, start + duration)
+            estimates[j.job_id] = (position, start)
+        return estimates
@@ -1,3 +1,424 @@
+import json
+from datetime import timedelta
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import tempfile
+from StringIO import StringIO
+from django import db
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from counters import get_counts, increment_counts
+from export import iterate_rows
+from archive import archive_path, jobs_to_archive
+from cancellation import CancellationToken
+from models import jobs, job_messages, job_types, status
+from scheduler import Schedule, is_over_limit
+from worker import JobWorker, claim_job, claim_next_job, reclaim_stale_jobs, send_heartbeat
+from views import add_job, cancel_job, load_installed_apps, process_job, set_jobs_info
 
-# Create your tests here.
+
+class JobListQueryCountTest(TestCase):
+
+    """A page of jobs should cost the same number of queries however many jobs it holds."""
+
+    def setUp(self):
+        load_installed_apps()
+        self.status = status.objects.create(status="Test success", default="", failure="", running="", success="y")
+        self.results = {}
+
+    def job_type(self, label, app_name):
+        return job_types.objects.get_or_create(label=label, defaults={"app_name": app_name})[0]
+
+    def add_job(self, label, app_name):
+        return jobs.objects.create(created=timezone.now(), status_id=self.status, type_id=self.job_type(label, app_name))
+
+    def add_jobs(self):
+        """Add one job of each app's types, with some results."""
+        from swamplr_derivatives.models import derivative_jobs, derivative_files, derivative_results, job_derivatives
+        from swamplr_ingest.models import ingest_jobs, delete_jobs, delete_objects, job_objects, datastreams, \
+            object_results as ingest_results
+        from swamplr_namespaces.models import namespace_jobs, namespace_operations, namespace_objects, \
+            object_results as namespace_results
+        from swamplr_services.models import services, service_jobs
+
+        success = ingest_results.objects.get_or_create(label="Success")[0]
+        failure = ingest_results.objects.get_or_create(label="Failure")[0]
+        ds = datastreams.objects.get_or_create(datastream_label="OBJ", defaults={"is_object": "y"})[0]
+
+        job = self.add_job("ingest", "swamplr_ingest")
+        ingest_job = ingest_jobs.objects.create(job_id=job, source_dir="/tmp", collection_name="image", namespace="test",
+                                                replace_on_duplicate="", process_new="y", process_existing="",
+                                                rels_ext_from_file="", rels_ext_generated="")
+        for pid, result in (("test:1", success), ("test:1", failure), ("test:2", success)):
+            job_objects.objects.create(job_id=job, created=timezone.now(), obj_file="/tmp/a.tif", result_id=result,
+                                       pid=pid, datastream_id=ds)
+
+        job = self.add_job("delete", "swamplr_ingest")
+        delete_jobs.objects.create(job_id=job, source_job=ingest_job)
+        delete_objects.objects.create(job_id=job, result_id=success, pid="test:1")
+
+        job = self.add_job("derivatives", "swamplr_derivatives")
+        deriv_job = derivative_jobs.objects.create(job_id=job, source_dir="/tmp", replace_on_duplicate="",
+                                                   source_file_extension="tif")
+        job_derive = job_derivatives.objects.create(derive_id=deriv_job, derive_type="TN", parameters="")
+        derivative_files.objects.create(job_derive_id=job_derive, created=timezone.now(), source_file="/tmp/a.tif",
+                                        result_id=derivative_results.objects.get_or_create(label="Success")[0])
+
+        job = self.add_job("namespaces", "swamplr_namespaces")
+        operation = namespace_operations.objects.get_or_create(operation_name="Reindex")[0]
+        namespace_jobs.objects.create(job_id=job, operation_id=operation, namespace="test")
+        namespace_objects.objects.create(job_id=job, completed=timezone.now(), pid="test:1",
+                                         result_id=namespace_results.objects.get_or_create(label="Success")[0])
+
+        job = self.add_job("service", "swamplr_services")
+        service_jobs.objects.create(job_id=job, service_id=services.objects.create(label="test", command="true"))
+
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            job_list = set_jobs_info(jobs.objects.filter(status_id=self.status).select_related("status_id", "type_id"))
+        return len(queries), job_list
+
+    def test_query_count_does_not_grow_with_jobs(self):
+        self.add_jobs()
+        small_count, job_list = self.count_queries()
+        for n in range(4):
+            self.add_jobs()
+        large_count, job_list = self.count_queries()
+
+        self.assertEqual(len(job_list), 25)
+        self.assertEqual(small_count, large_count)
+
+    def test_status_info_counts(self):
+        self.add_jobs()
+        call_command("backfill_job_counts", stdout=StringIO())
+        job_list = dict((j.job_type, j) for j in self.count_queries()[1])
+        # test:1 has a failed datastream, so counts as a failed object.
+        self.assertIn("1 Succeeded</span> <span class='label label-danger'>1 Failed", job_list["ingest"].status_info)
+        self.assertIn("1 Succeeded", job_list["namespaces"].status_info)
+        self.assertIn("Derivatives: TN", job_list["derivatives"].status_info)
+        self.assertIn("Service name: test", job_list["service"].status_info)
+
+
+class JobCountsTest(TestCase):
+
+    def setUp(self):
+        job_status = status.objects.create(status="Test queued", default="y", failure="", running="", success="")
+        job_type = job_types.objects.get_or_create(label="service", defaults={"app_name": "swamplr_services"})[0]
+        self.job = jobs.objects.create(created=timezone.now(), status_id=job_status, type_id=job_type)
+
+    def test_increment_counts(self):
+        self.assertEqual(get_counts([self.job.job_id])[self.job.job_id], {"Success": 0, "Failure": 0, "Skipped": 0})
+        increment_counts(self.job, {"Success": 2, "Failure": 1})
+        increment_counts(self.job.job_id, {"Success": 3, "Skipped": 0})
+        self.assertEqual(get_counts([self.job.job_id])[self.job.job_id], {"Success": 5, "Failure": 1, "Skipped": 0})
+
+
+def add_ingest_results(n=5):
+    """Add an ingest job with n objects, the fourth of which failed."""
+    from swamplr_ingest.models import job_objects, datastreams, object_results
+    job_status = status.objects.create(status="Test success", default="", failure="", running="", success="y")
+    job_type = job_types.objects.get_or_create(label="ingest", defaults={"app_name": "swamplr_ingest"})[0]
+    job = jobs.objects.create(created=timezone.now(), completed=timezone.now(), status_id=job_status, type_id=job_type)
+    success = object_results.objects.get_or_create(label="Success")[0]
+    failure = object_results.objects.get_or_create(label="Failure")[0]
+    ds = datastreams.objects.get_or_create(datastream_label="OBJ", defaults={"is_object": "y"})[0]
+    for i in range(n):
+        job_objects.objects.create(job_id=job, created=timezone.now(), obj_file=u"/tmp/\xe9{0}.tif".format(i),
+                                   result_id=failure if i == 3 else success, pid="test:{0}".format(i),
+                                   datastream_id=ds)
+    return job
+
+
+class ExportTest(TestCase):
+
+    def setUp(self):
+        load_installed_apps()
+        self.job = add_ingest_results()
+
+    def test_iterate_rows_in_batches(self):
+        from swamplr_ingest.models import job_objects
+        rows = list(iterate_rows(job_objects.objects.filter(job_id=self.job), "object_id", ["pid"], batch_size=2))
+        self.assertEqual(rows, [("test:{0}".format(n),) for n in range(5)])
+
+    def test_export_command(self):
+        out = StringIO()
+        call_command("export_job_results", self.job.job_id, result="Failure", stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0], "pid,datastream,file,created,new_object,result")
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[1].startswith("test:3,OBJ,/tmp/\xc3\xa93.tif,"))
+
+        out = StringIO()
+        call_command("export_job_results", self.job.job_id, format="jsonl", stdout=out)
+        rows = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([r["pid"] for r in rows], ["test:{0}".format(n) for n in range(5)])
+        self.assertEqual(rows[3]["result"], "Failure")
+
+
+class ArchiveTest(TestCase):
+
+    def setUp(self):
+        load_installed_apps()
+        self.job = add_ingest_results()
+        self.archive_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.archive_dir)
+
+    def test_archive_and_restore(self):
+        from swamplr_ingest.models import job_objects
+        rows = list(job_objects.objects.filter(job_id=self.job).order_by("object_id").values())
+
+        with self.settings(RESULTS_ARCHIVE_DIR=self.archive_dir, RESULTS_RETENTION_DAYS=0):
+            self.assertEqual(list(jobs_to_archive()), [])
+            self.job.archived = "y"
+            self.job.save()
+            self.assertEqual(list(jobs_to_archive()), [self.job])
+
+            call_command("archive_job_results", stdout=StringIO())
+            self.assertFalse(job_objects.objects.filter(job_id=self.job).exists())
+            self.assertTrue(os.path.exists(archive_path(self.job)))
+            self.assertEqual(list(jobs_to_archive()), [])
+
+            call_command("restore_job_results", self.job.job_id, stdout=StringIO())
+            self.assertEqual(list(job_objects.objects.filter(job_id=self.job).order_by("object_id").values()), rows)
+            self.assertFalse(os.path.exists(archive_path(self.job)))
+
+
+class CancelJobTest(TestCase):
+
+    def setUp(self):
+        running = status.objects.create(status="Test running", default="", failure="", running="y", success="")
+        self.manual = status.objects.create(status="Test cancelled", default="", failure="manual", running="", success="")
+        job_type = job_types.objects.get_or_create(label="service", defaults={"app_name": "swamplr_services"})[0]
+        self.process = subprocess.Popen(["sleep", "30"])
+        self.addCleanup(self.stop_process)
+        self.job = jobs.objects.create(created=timezone.now(), status_id=running, type_id=job_type,
+                                       process_id=self.process.pid)
+
+    def stop_process(self):
+        if self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+
+    def test_job_on_other_host_is_not_signalled(self):
+        self.job.worker = "{0}-other:1234".format(socket.gethostname())
+        self.assertTrue(cancel_job(self.job))
+        self.assertEqual(jobs.objects.get(job_id=self.job.job_id).status_id, self.manual)
+        self.assertIsNone(self.process.poll())
+
+    def test_job_on_this_host_is_signalled(self):
+        self.job.worker = "{0}:1234".format(socket.gethostname())
+        self.assertTrue(cancel_job(self.job))
+        self.assertEqual(jobs.objects.get(job_id=self.job.job_id).status_id, self.manual)
+        self.assertEqual(self.process.wait(), -15)
+
+    def test_heartbeat_and_worker_kept(self):
+        self.job.worker = "{0}-other:1234".format(socket.gethostname())
+        self.job.save()
+        # The worker sends a heartbeat after the view loaded the job.
+        beat = timezone.now().replace(microsecond=0)
+        jobs.objects.filter(job_id=self.job.job_id).update(heartbeat=beat)
+        self.assertTrue(cancel_job(self.job))
+        job = jobs.objects.get(job_id=self.job.job_id)
+        self.assertEqual((job.status_id, job.heartbeat, job.worker), (self.manual, beat, self.job.worker))
+
+
+class CancellationTokenTest(TestCase):
+
+    def setUp(self):
+        self.running = status.objects.create(status="Test running", default="", failure="", running="y", success="")
+        self.manual = status.objects.create(status="Test cancelled", default="", failure="manual", running="", success="")
+        job_type = job_types.objects.get_or_create(label="service", defaults={"app_name": "swamplr_services"})[0]
+        self.job = jobs.objects.create(created=timezone.now(), status_id=self.running, type_id=job_type)
+        self.token = CancellationToken(self.job.job_id, interval=3600)
+
+    def test_checks_within_interval_make_one_query(self):
+        with self.assertNumQueries(1):
+            for n in range(100):
+                self.assertFalse(self.token.is_cancelled())
+
+    def test_stop_seen_once_interval_has_passed(self):
+        self.assertFalse(self.token.is_cancelled())
+        jobs.objects.filter(job_id=self.job.job_id).update(status_id=self.manual)
+        self.assertFalse(self.token.is_cancelled())
+        self.token.last_check -= 3600
+        self.assertTrue(self.token.is_cancelled())
+        # Once cancelled, the token stays cancelled without reading the job again.
+        jobs.objects.filter(job_id=self.job.job_id).update(status_id=self.running)
+        self.token.last_check -= 3600
+        with self.assertNumQueries(0):
+            self.assertTrue(self.token.is_cancelled())
+
+    def test_cancel_takes_effect_without_query(self):
+        self.assertFalse(self.token.is_cancelled())
+        with self.assertNumQueries(0):
+            self.token.cancel()
+            self.assertTrue(self.token.is_cancelled())
+
+
+class ScheduleTest(TestCase):
+
+    def setUp(self):
+        self.queued = status.objects.create(status="Test queued", default="y", failure="", running="", success="")
+        self.running = status.objects.create(status="Test running", default="", failure="", running="y", success="")
+        self.now = timezone.now()
+
+    def add_job(self, label, priority=0, age=0, job_status=None):
+        job_type = job_types.objects.get_or_create(label=label, defaults={"app_name": "swamplr_" + label})[0]
+        return jobs.objects.create(created=self.now - timedelta(seconds=age), status_id=job_status or self.queued,
+                                   type_id=job_type, priority=priority, started=self.now if job_status else None)
+
+    def order(self):
+        return [j.job_id for j in Schedule(now=self.now).runnable()]
+
+    def test_priority_then_job_id(self):
+        low = self.add_job("services")
+        high = self.add_job("services", priority=5)
+        tied = self.add_job("services")
+        with self.settings(JOB_AGING_INTERVAL=0):
+            self.assertEqual(self.order(), [high.job_id, low.job_id, tied.job_id])
+
+    def test_aging(self):
+        old = self.add_job("services", age=600)
+        high = self.add_job("services", priority=5)
+        with self.settings(JOB_AGING_INTERVAL=60):
+            # Ten minutes of waiting is worth 10 points.
+            self.assertEqual(self.order(), [old.job_id, high.job_id])
+        with self.settings(JOB_AGING_INTERVAL=3600):
+            self.assertEqual(self.order(), [high.job_id, old.job_id])
+
+    def test_max_running(self):
+        first = self.add_job("derivatives", job_status=self.running)
+        queued = self.add_job("derivatives", priority=5)
+        other = self.add_job("services")
+        with self.settings(JOB_TYPE_MAX_RUNNING={"derivatives": 1}):
+            self.assertEqual(self.order(), [other.job_id])
+            self.assertFalse(is_over_limit(first))
+            # A second claim of the same type, e.g. by another worker, is over the limit.
+            jobs.objects.filter(job_id=queued.job_id).update(status_id=self.running, started=self.now + timedelta(seconds=1))
+            self.assertTrue(is_over_limit(jobs.objects.get(job_id=queued.job_id)))
+        with self.settings(JOB_TYPE_MAX_RUNNING={"derivatives": 2}):
+            self.assertFalse(is_over_limit(jobs.objects.get(job_id=queued.job_id)))
+
+    def test_add_job_priority(self):
+        job_types.objects.create(label="derivatives", app_name="swamplr_derivatives")
+        with self.settings(JOB_TYPE_PRIORITY={"derivatives": 3}):
+            self.assertEqual(add_job("swamplr_derivatives").priority, 3)
+            self.assertEqual(add_job("swamplr_derivatives", priority=-2).priority, -2)
+
+
+class ExitedProcess(object):
+
+    """Stands in for the multiprocessing.Process of a job whose process has ended."""
+
+    def __init__(self, exitcode):
+        self.exitcode = exitcode
+
+    def is_alive(self):
+        return False
+
+    def join(self):
+        pass
+
+
+class WorkerTest(TestCase):
+
+    def setUp(self):
+        self.queued = status.objects.create(status="Test queued", default="y", failure="", running="", success="")
+        self.running = status.objects.create(status="Test running", default="", failure="", running="y", success="")
+        self.error = status.objects.create(status="Script error", default="", failure="error", running="", success="")
+        self.job_type = job_types.objects.create(label="services", app_name="swamplr_services")
+
+    def add_job(self, **kwargs):
+        return jobs.objects.create(created=timezone.now(), status_id=self.queued, type_id=self.job_type, **kwargs)
+
+    def use_skip_locked(self):
+        """Take the SELECT ... FOR UPDATE SKIP LOCKED branch; SQLite leaves out the locking clause."""
+        features = db.connection.features
+        features.has_select_for_update_skip_locked = True
+        self.addCleanup(delattr, features, "has_select_for_update_skip_locked")
+
+    def assert_claimed_once(self):
+        job = self.add_job()
+        self.assertTrue(claim_job(job.job_id, "a", self.queued, self.running))
+        self.assertFalse(claim_job(job.job_id, "b", self.queued, self.running))
+        job = jobs.objects.get(job_id=job.job_id)
+        self.assertEqual((job.status_id, job.worker), (self.running, "a"))
+        self.assertIsNotNone(job.heartbeat)
+
+    def test_claim_job_conditional_update(self):
+        self.assertFalse(db.connection.features.has_select_for_update_skip_locked)
+        self.assert_claimed_once()
+
+    def test_claim_job_skip_locked(self):
+        self.use_skip_locked()
+        self.assert_claimed_once()
+
+    def test_claim_next_job(self):
+        first, second = self.add_job(), self.add_job()
+        self.assertEqual(claim_next_job("a").job_id, first.job_id)
+        self.assertEqual(claim_next_job("b").job_id, second.job_id)
+        self.assertIsNone(claim_next_job("c"))
+        self.assertEqual(jobs.objects.get(job_id=second.job_id).worker, "b")
+
+    def test_claim_next_job_at_limit(self):
+        self.add_job()
+        self.add_job()
+        with self.settings(JOB_TYPE_MAX_RUNNING={"services": 1}):
+            self.assertIsNotNone(claim_next_job("a"))
+            self.assertIsNone(claim_next_job("b"))
+
+    def test_reclaim_stale_jobs(self):
+        stale = self.add_job()
+        fresh = self.add_job()
+        claim_job(stale.job_id, "a", self.queued, self.running)
+        claim_job(fresh.job_id, "b", self.queued, self.running)
+        jobs.objects.filter(job_id=stale.job_id).update(heartbeat=timezone.now() - timedelta(seconds=600), process_id=123)
+        send_heartbeat([stale.job_id, fresh.job_id], "b")
+
+        self.assertEqual(reclaim_stale_jobs(lease=300), [stale.job_id])
+        stale = jobs.objects.get(job_id=stale.job_id)
+        self.assertEqual((stale.status_id, stale.worker, stale.heartbeat, stale.process_id), (self.queued, "", None, 0))
+        self.assertEqual(job_messages.objects.filter(job_id=stale).count(), 1)
+        self.assertEqual(jobs.objects.get(job_id=fresh.job_id).status_id, self.running)
+        # The reclaimed job can be claimed again.
+        self.assertEqual(claim_next_job("c").job_id, stale.job_id)
+
+    def test_process_job_keeps_heartbeat(self):
+        missing_type = job_types.objects.create(label="missing", app_name="missing_app")
+        jobs.objects.create(created=timezone.now(), status_id=self.queued, type_id=missing_type)
+        job = claim_next_job("a")
+        # The heartbeat thread writes while the job runs; the claimed instance still holds the old value.
+        beat = job.heartbeat + timedelta(seconds=60)
+        jobs.objects.filter(job_id=job.job_id).update(heartbeat=beat)
+        process_job(job)
+        job = jobs.objects.get(job_id=job.job_id)
+        self.assertEqual((job.status_id, job.heartbeat), (self.error, beat))
+
+    def test_reap_fails_job_left_running(self):
+        job = self.add_job()
+        claim_job(job.job_id, "a", self.queued, self.running)
+        worker = JobWorker()
+        worker.running[job.job_id] = ExitedProcess(-9)
+        worker.reap()
+        self.assertEqual(worker.running, {})
+        self.assertEqual(jobs.objects.get(job_id=job.job_id).status_id, self.error)
+        self.assertIn("exit code -9", job_messages.objects.get(job_id=job).message)
+
+    def test_signals(self):
+        process = subprocess.Popen(["sleep", "30"])
+        self.addCleanup(lambda: process.poll() is None and process.kill())
+        process.is_alive = lambda: process.poll() is None
+        worker = JobWorker()
+        worker.running[1] = process
+        worker.handle_signal(signal.SIGTERM, None)
+        self.assertTrue(worker.stopping)
+        self.assertIsNone(process.poll())
+        # A second signal stops running jobs as well.
+        worker.handle_signal(signal.SIGTERM, None)
+        self.assertEqual(process.wait(), -signal.SIGTERM)
@@ -2,12 +2,16 @@ from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from django.shortcuts import render
 from django.shortcuts import redirect
 from django.conf import settings
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseBadRequest, JsonResponse, Http404, StreamingHttpResponse
 from django.utils import timezone
-from models import job_types, jobs, job_messages, status
+from models import job_types, jobs, job_messages, status, job_archives
+from scheduler import Schedule, default_priority
+from paging import MAX_PAGE_SIZE
+from export import EXPORT_FORMATS, can_export, export_lines
 import logging
 import os
 import importlib
+import socket
 
 APPS = [app for app in settings.INSTALLED_APPS if app.startswith("swamplr_")]
 
@@ -25,7 +29,7 @@ def job_status(request, count=25, response={}):
 
     response["headings"] = ["Job ID", "Job Type", "Details", "Created", "Completed", "Status", "Actions"]
 
-    all_jobs = jobs.objects.all().exclude(archived="y").order_by('-created')
+    all_jobs = jobs.objects.all().exclude(archived="y").select_related("status_id", "type_id").order_by('-created')
     paginator = Paginator(all_jobs, count)
     
     page = request.GET.get('page')
@@ -40,9 +44,9 @@ def job_status(request, count=25, response={}):
         # If page is out of range (e.g. 9999), deliver last page of results.
         job_list = paginator.page(paginator.num_pages) 
 
-    for j in job_list.object_list:
-        
-        j = set_job_info(j)
+    set_jobs_info(job_list.object_list)
+
+    set_queue_estimates(job_list.object_list)
 
     response["jobs"] = job_list
 
@@ -60,9 +64,9 @@ def view_job(request, job_id):
     load_installed_apps()
 
     # Get job object.
-    job = jobs.objects.get(job_id=job_id)
+    job = jobs.objects.select_related("status_id", "type_id").get(job_id=job_id)
     # Get type of job object, in order to route the request to the correct app.
-    job_type_object = job_types.objects.get(type_id=job.type_id_id)
+    job_type_object = job.type_id
     app_name = job_type_object.app_name
     app = import_apps[app_name]
 
@@ -84,9 +88,20 @@ def view_job(request, job_id):
         ("Started", job.started),
         ("Completed", job.completed),
         ("Elapsed", elapsed),
+        ("Priority", job.priority),
         ("Status Info", job.status_info),
     ]
 
+    archive = job_archives.objects.filter(job_id=job).first()
+    if archive:
+        job.card.append(("Results", "{0} rows archived {1}; restore with manage.py restore_job_results {2}".format(
+            archive.rows, archive.archived, job.job_id)))
+
+    set_queue_estimates([job])
+    if job.queue_position:
+        job.card.insert(4, ("Queue Position", job.queue_position))
+        job.card.insert(5, ("Estimated Start", job.estimated_start or "Unknown"))
+
     # Show messages on the job detail page.
     job.messages = []
     message_object = job_messages.objects.filter(job_id=job)
@@ -95,9 +110,12 @@ def view_job(request, job_id):
         mtime = m.created
         job.messages.append((mtime, mcontent))
 
-    # Get all needed job object information.
+    # Get all needed job object information. Apps that can page through objects have them loaded by the
+    # browser from job_objects, rather than all at once here.
     job.objects = []
-    if hasattr(app.views, "get_job_objects") and callable(getattr(app.views, "get_job_objects")):
+    job.objects_paged = hasattr(app.views, "get_job_objects_page") and callable(getattr(app.views, "get_job_objects_page"))
+    job.exportable = can_export(app)
+    if not job.objects_paged and hasattr(app.views, "get_job_objects") and callable(getattr(app.views, "get_job_objects")):
         object_data = app.views.get_job_objects(job_id, job_type=job_type_object.label)
         job.objects = object_data
 
@@ -109,31 +127,111 @@ def view_job(request, job_id):
 
     return render(request, 'swamplr_jobs/job.html', {"job": job})
 
-def set_job_info(j):
-    """Get job data for display."""
+def job_objects(request, job_id):
+    """Return one page of a job's objects as JSON.
 
-    j.status = status.objects.get(status_id=j.status_id_id)
-    job_type_object = job_types.objects.get(type_id=j.type_id_id)
+    Query parameters: after (cursor returned with the previous page), limit, and the optional filters
+    result, datastream and prefix (pid or path prefix).
+    """
+    load_installed_apps()
 
-    job_type = job_type_object.label
-    app_name = job_type_object.app_name
+    try:
+        job = jobs.objects.select_related("type_id").get(job_id=job_id)
+    except jobs.DoesNotExist:
+        raise Http404("No job {0}".format(job_id))
+    app = import_apps[job.type_id.app_name]
+    if not (hasattr(app.views, "get_job_objects_page") and callable(getattr(app.views, "get_job_objects_page"))):
+        raise Http404("Objects of {0} jobs can't be paged.".format(job.type_id.label))
 
-    j.job_type = job_type
-    d = import_apps
-    app = import_apps[app_name]
-    
-    status_info = "No further info available."
-    if hasattr(app.views, "get_status_info") and callable(getattr(app.views, "get_status_info")):
-        status_info, details = app.views.get_status_info(j)
-        j.status_info = "\n".join(status_info)
+    try:
+        limit = min(max(int(request.GET.get("limit", 50)), 1), MAX_PAGE_SIZE)
+    except ValueError:
+        return HttpResponseBadRequest("limit must be an integer.")
 
-    if hasattr(app.views, "get_actions") and callable(getattr(app.views, "get_actions")):
-        actions = app.views.get_actions(j)
-    else:
-        actions = set_default_actions(j)
-    j.actions = actions
-    
-    return j
+    try:
+        page = app.views.get_job_objects_page(
+            job,
+            after=request.GET.get("after") or None,
+            limit=limit,
+            result=request.GET.get("result") or None,
+            datastream=request.GET.get("datastream") or None,
+            prefix=request.GET.get("prefix") or None,
+        )
+    except ValueError:
+        return HttpResponseBadRequest("Invalid cursor: {0}".format(request.GET.get("after")))
+    return JsonResponse(page)
+
+def export_job(request, job_id):
+    """Stream every per-object result of a job as a file download.
+
+    Query parameters: format (csv or jsonl, default csv) and the optional filter result.
+    """
+    load_installed_apps()
+
+    try:
+        job = jobs.objects.select_related("type_id").get(job_id=job_id)
+    except jobs.DoesNotExist:
+        raise Http404("No job {0}".format(job_id))
+    app = import_apps[job.type_id.app_name]
+    if not can_export(app):
+        raise Http404("Results of {0} jobs can't be exported.".format(job.type_id.label))
+
+    export_format = request.GET.get("format", "csv")
+    if export_format not in EXPORT_FORMATS:
+        raise Http404("Unknown export format {0}".format(export_format))
+
+    response = StreamingHttpResponse(
+        export_lines(app, job, export_format=export_format, result=request.GET.get("result") or None),
+        content_type=EXPORT_FORMATS[export_format],
+    )
+    response["Content-Disposition"] = 'attachment; filename="job-{0}-results.{1}"'.format(job.job_id, export_format)
+    return response
+
+def set_job_info(j):
+    """Get job data for display."""
+    return set_jobs_info([j])[0]
+
+def set_jobs_info(job_list):
+    """Get display data for a list of jobs with a fixed number of queries.
+
+    Jobs should be loaded with select_related("status_id", "type_id"). Status info is gathered per app
+    with the app's get_status_info_many function, which takes a list of jobs and returns a dict of
+    job id: list of info strings; apps without it fall back to get_status_info for each job.
+    """
+    job_list = list(job_list)
+    by_app = {}
+    for j in job_list:
+        j.status = j.status_id
+        j.job_type = j.type_id.label
+        j.status_info = "No further info available."
+        by_app.setdefault(j.type_id.app_name, []).append(j)
+
+    for app_name, app_jobs in by_app.items():
+        app = import_apps[app_name]
+        if hasattr(app.views, "get_status_info_many") and callable(getattr(app.views, "get_status_info_many")):
+            status_info = app.views.get_status_info_many(app_jobs)
+            for j in app_jobs:
+                j.status_info = "\n".join(status_info[j.job_id])
+        elif hasattr(app.views, "get_status_info") and callable(getattr(app.views, "get_status_info")):
+            for j in app_jobs:
+                status_info, details = app.views.get_status_info(j)
+                j.status_info = "\n".join(status_info)
+
+        for j in app_jobs:
+            if hasattr(app.views, "get_actions") and callable(getattr(app.views, "get_actions")):
+                j.actions = app.views.get_actions(j)
+            else:
+                j.actions = set_default_actions(j)
+
+    return job_list
+
+def set_queue_estimates(job_list):
+    """Set queue position and estimated start time on any queued jobs in list."""
+    estimates = {}
+    if any(j.status.default == "y" for j in job_list):
+        estimates = Schedule().estimates()
+    for j in job_list:
+        j.queue_position, j.estimated_start = estimates.get(j.job_id, (None, None))
 
 def set_default_actions(job):
     """Set default actions for jobs."""
@@ -180,15 +278,17 @@ def build_nav_bar():
     return nav_bar_items
 
 def load_installed_apps():
-    """Load contents of each installed app."""
+    """Load contents of each installed app; apps are only imported once per process."""
     for app in APPS:
-        import_apps[app] = importlib.import_module(app)
+        if app not in import_apps:
+            importlib.import_module(app + ".views")
+            import_apps[app] = importlib.import_module(app)
 
-def add_job(app_name, job_type_label=None):
+def add_job(app_name, job_type_label=None, priority=None):
     """Use app_name or job_type to create new job.
 
     If job_type provided use to get job type id, else use app name. If an app has more than one job type, job_type_id
-    must be passed in.
+    must be passed in. Priority defaults to the configured priority of the job type.
     """
     # Get job type id for job type.
     if job_type_label:
@@ -199,7 +299,10 @@ def add_job(app_name, job_type_label=None):
     # Query for id of job status.
     job_status = status.objects.get(default="y")
 
-    new_job = jobs.objects.create(type_id=job_type, created=timezone.now(), status_id=job_status)    
+    if priority is None:
+        priority = default_priority(job_type.label)
+
+    new_job = jobs.objects.create(type_id=job_type, created=timezone.now(), status_id=job_status, priority=priority)
     new_job.save()
 
     return new_job
@@ -238,7 +341,8 @@ def process_job(current_job):
     current_job.status_id = status_obj
     current_job.started = timezone.now()
     current_job.process_id = os.getpid()
-    current_job.save()
+    # Only write the fields set here: the heartbeat column is written by the worker's heartbeat alone.
+    current_job.save(update_fields=["status_id", "started", "process_id"])
  
     logging.info("Starting {1} Job ID: {0}".format(job_id, type_obj.label))
     
@@ -269,7 +373,7 @@ def process_job(current_job):
     status_obj = status.objects.get(status_id=result[0])
     current_job.status_id = status_obj 
     current_job.completed = timezone.now()
-    current_job.save()
+    current_job.save(update_fields=["status_id", "completed"])
 
 def remove_job(request, job_id):
     """Remove aka "archive" job."""
@@ -278,7 +382,7 @@ def remove_job(request, job_id):
         print("ready to delete job id {0}".format(job_id))
         job_object = jobs.objects.get(job_id=job_id)
         job_object.archived = "y"
-        job_object.save()
+        job_object.save(update_fields=["archived"])
 
     return redirect(job_status)
    
@@ -289,28 +393,36 @@ def stop_job(request, job_id):
         return redirect(job_status)
     
     print("ready to delete job id {0}".format(job_id))
-    result_message = []
-    error_message = []
-    job_object = jobs.objects.get(job_id=job_id)
+    cancel_job(jobs.objects.get(job_id=job_id))
+
+    return redirect(job_status)
+
+def is_local_job(job_object):
+    """Return True if job_object was claimed by a worker on this host, so its process_id is a local process."""
+    return job_object.worker.rpartition(":")[0] == socket.gethostname()
+
+def cancel_job(job_object):
+    """Mark job as stopped by the user and, if it runs on this host, send its process SIGTERM.
+
+    Jobs on other hosts stop when their CancellationToken sees the status.
+
+    returns:
+        (bool): True if the job was marked as stopped without error.
+    """
+    job_id = job_object.job_id
     status_obj = status.objects.get(failure="manual")
     job_object.status_id = status_obj 
     job_object.completed = timezone.now()
-    job_object.save()
+    # The job may still be running: leave its heartbeat and worker to the worker.
+    job_object.save(update_fields=["status_id", "completed"])
 
-    if job_object.process_id != 0:
+    if job_object.process_id != 0 and is_local_job(job_object):
         # Attempt to kill job 'nicely'.
         try:
             os.kill(job_object.process_id, 15)
-            logging.info("Job ID #{0} successfully canceled.".format(job_id))
-            result_message = ["Job ID #{0} successfully canceled.".format(job_id)]
-        except:
-            error_message = ["Unable to cancel job {0} at process ID: {1}".format(job_id, job_object.process_id)]
+        except OSError:
             logging.warning("Unable to cancel job {0} at process ID: {1}".format(job_id, job_object.process_id))
+            return False
 
-    else:
-
-        logging.info("Job ID #{0} successfully canceled.".format(job_id))
-        result_message = ["Job ID #{0} successfully canceled.".format(job_id)]
-
-    return redirect(job_status)
- 
+    logging.info("Job ID #{0} successfully canceled.".format(job_id))
+    return True
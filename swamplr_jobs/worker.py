@@ -0,0 +1,246 @@
+"""Long-running worker that claims queued jobs and runs each in its own process."""
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+from datetime import timedelta
+from django import db
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from models import jobs, job_messages, status
+from scheduler import Schedule, is_over_limit
+import views
+
+
+def worker_name():
+    """Identify this process in the jobs table: host:pid."""
+    return "{0}:{1}".format(socket.gethostname(), os.getpid())
+
+
+def claim_next_job(worker=None):
+    """Claim next queued job, marking it as running; return it, or None if no job could be claimed.
+
+    Jobs are tried in the order given by the scheduler, skipping job types that are at their limit of
+    running jobs.
+
+    kwargs:
+        worker(str): name recorded as holding the job; defaults to this process.
+    """
+    worker = worker or worker_name()
+    queued = status.objects.get(default="y")
+    running = status.objects.get(running="y")
+
+    for job in Schedule().runnable()[:10]:
+        if not claim_job(job.job_id, worker, queued, running):
+            continue
+        if is_over_limit(job):
+            # Another worker started a job of the same type at the same time.
+            jobs.objects.filter(job_id=job.job_id, worker=worker).update(
+                status_id=queued, started=None, heartbeat=None, worker=""
+            )
+            continue
+        return jobs.objects.get(job_id=job.job_id)
+    return None
+
+
+def claim_job(job_id, worker, queued, running):
+    """Mark job as running if it is still queued; return True if this worker got it.
+
+    Uses SELECT ... FOR UPDATE SKIP LOCKED where the database supports it; otherwise the status is
+    changed with a conditional update. Either way a job can only be claimed by one worker.
+    """
+    now = timezone.now()
+    if db.connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            locked = jobs.objects.select_for_update(skip_locked=True).filter(job_id=job_id, status_id=queued)
+            if not list(locked.values_list("job_id", flat=True)):
+                return False
+            return locked.update(status_id=running, started=now, heartbeat=now, worker=worker) == 1
+
+    claimed = jobs.objects.filter(job_id=job_id, status_id=queued).update(
+        status_id=running, started=now, heartbeat=now, worker=worker
+    )
+    return claimed == 1
+
+
+def reclaim_stale_jobs(lease=None):
+    """Return running jobs to the queue if their worker has stopped sending heartbeats.
+
+    kwargs:
+        lease(float): seconds without a heartbeat after which a job is reclaimed; defaults to JOB_LEASE_TIMEOUT.
+    returns:
+        (list): ids of reclaimed jobs.
+    """
+    lease = settings.JOB_LEASE_TIMEOUT if lease is None else lease
+    queued = status.objects.get(default="y")
+    running = status.objects.get(running="y")
+    cutoff = timezone.now() - timedelta(seconds=lease)
+
+    reclaimed = []
+    for job in jobs.objects.filter(status_id=running, heartbeat__lt=cutoff):
+        # Only reclaim if nothing has changed since the job was read, e.g. a late heartbeat.
+        updated = jobs.objects.filter(job_id=job.job_id, status_id=running, heartbeat=job.heartbeat).update(
+            status_id=queued, started=None, heartbeat=None, worker="", process_id=0
+        )
+        if updated == 1:
+            message = "No heartbeat from worker {0} since {1}; job returned to queue.".format(job.worker, job.heartbeat)
+            logging.warning("Job {0}: {1}".format(job.job_id, message))
+            job_messages.objects.create(job_id=job, created=timezone.now(), message=message)
+            reclaimed.append(job.job_id)
+    return reclaimed
+
+
+def send_heartbeat(job_ids, worker):
+    """Record that jobs held by worker are still running."""
+    jobs.objects.filter(job_id__in=job_ids, worker=worker).update(heartbeat=timezone.now())
+
+
+class Heartbeat(threading.Thread):
+
+    """Background thread sending heartbeats for a job run in the current process (e.g. by start_job)."""
+
+    def __init__(self, job_id, worker, interval):
+        """Set job and heartbeat interval in seconds."""
+        super(Heartbeat, self).__init__(name="heartbeat-{0}".format(job_id))
+        self.daemon = True
+        self.job_id = job_id
+        self.worker = worker
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        try:
+            while not self.stopped.wait(self.interval):
+                send_heartbeat([self.job_id], self.worker)
+        finally:
+            db.connection.close()
+
+    def stop(self):
+        self.stopped.set()
+
+
+def run_job(job_id):
+    """Run claimed job; target of each job process."""
+    # Let stop_job's SIGTERM end the job, rather than the worker's shutdown handler.
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        views.process_job(jobs.objects.get(job_id=job_id))
+    finally:
+        db.connections.close_all()
+
+
+class JobWorker(object):
+
+    """Poll queue for jobs and run up to `concurrency` of them at once, each in a child process.
+
+    Running jobs get a heartbeat every `heartbeat_interval` seconds and app pre_process functions run every
+    `pre_process_interval` seconds. On SIGTERM or SIGINT the worker stops claiming jobs and waits for
+    running jobs to finish; a second signal stops the running jobs as well.
+    """
+
+    def __init__(self, concurrency=1, poll_interval=5, heartbeat_interval=30, pre_process_interval=60):
+        """Set worker options (all intervals in seconds)."""
+        self.name = worker_name()
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.pre_process_interval = pre_process_interval
+
+        # Job id: child process.
+        self.running = {}
+        self.stopping = False
+        self.last_heartbeat = 0
+        self.last_pre_process = 0
+
+    def run(self):
+        """Process jobs until shut down."""
+        signal.signal(signal.SIGTERM, self.handle_signal)
+        signal.signal(signal.SIGINT, self.handle_signal)
+        logging.info("Job worker {0} started with concurrency {1}.".format(self.name, self.concurrency))
+
+        while not self.stopping or self.running:
+            self.reap()
+            if not self.stopping:
+                self.pre_process()
+                self.start_jobs()
+            self.heartbeat()
+            self.sleep()
+
+        logging.info("Job worker {0} stopped.".format(self.name))
+
+    def handle_signal(self, signum, frame):
+        """Stop taking jobs; on a second signal, also stop running jobs."""
+        if self.stopping:
+            logging.info("Stopping {0} running job(s).".format(len(self.running)))
+            for p in self.running.values():
+                if p.is_alive():
+                    os.kill(p.pid, signal.SIGTERM)
+        else:
+            logging.info("Shutting down after {0} running job(s) finish.".format(len(self.running)))
+            self.stopping = True
+
+    def pre_process(self):
+        """Run app pre_process functions if they are due."""
+        if time.time() - self.last_pre_process < self.pre_process_interval:
+            return
+        self.last_pre_process = time.time()
+        try:
+            views.pre_process()
+        except Exception as e:
+            logging.exception("Error in pre_process: {0}".format(e))
+
+    def start_jobs(self):
+        """Claim and start jobs while there is capacity."""
+        while len(self.running) < self.concurrency:
+            job = claim_next_job(self.name)
+            if job is None:
+                return
+            logging.info("Claimed job {0}.".format(job.job_id))
+            # The child must open its own database connection.
+            db.connections.close_all()
+            p = multiprocessing.Process(target=run_job, args=(job.job_id,), name="job-{0}".format(job.job_id))
+            p.start()
+            self.running[job.job_id] = p
+
+    def reap(self):
+        """Remove finished job processes, failing any job whose process ended without completing it."""
+        for job_id, p in self.running.items():
+            if p.is_alive():
+                continue
+            p.join()
+            del self.running[job_id]
+            job = jobs.objects.select_related("status_id").get(job_id=job_id)
+            if job.status_id.running == "y":
+                message = "Job process exited unexpectedly (exit code {0}).".format(p.exitcode)
+                logging.error("Job {0}: {1}".format(job_id, message))
+                job_messages.objects.create(job_id=job, created=timezone.now(), message=message)
+                job.status_id = status.objects.get(status="Script error")
+                job.completed = timezone.now()
+                job.save(update_fields=["status_id", "completed"])
+            else:
+                logging.info("Job {0} finished: {1}".format(job_id, job.status_id.status))
+
+    def heartbeat(self):
+        """If due, record that running jobs are still alive, and reclaim jobs of workers that are not."""
+        if time.time() - self.last_heartbeat < self.heartbeat_interval:
+            return
+        self.last_heartbeat = time.time()
+        if self.running:
+            send_heartbeat(list(self.running), self.name)
+        if not self.stopping:
+            reclaim_stale_jobs()
+
+    def sleep(self):
+        """Wait before polling again; return early when a job finishes."""
+        deadline = time.time() + self.poll_interval
+        while time.time() < deadline and not self.stopping:
+            if any(not p.is_alive() for p in self.running.values()):
+                return
+            time.sleep(0.5)
+        if self.stopping and self.running:
+            time.sleep(0.5)
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 15:47
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('swamplr_namespaces', '0007_pathauto_operation'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='namespace_objects',
+            index=models.Index(fields=['job_id', 'result_id'], name='ns_obj_job_result_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='namespace_objects',
+            index=models.Index(fields=['job_id', 'pid'], name='ns_obj_job_pid_idx'),
+        ),
+    ]
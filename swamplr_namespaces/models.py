@@ -42,6 +42,12 @@ class namespace_objects(models.Model):
     result_id = models.ForeignKey('object_results')
     pid = models.CharField(max_length=64, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["job_id", "result_id"], name="ns_obj_job_result_idx"),
+            models.Index(fields=["job_id", "pid"], name="ns_obj_job_pid_idx"),
+        ]
+
 class object_results(models.Model):
 
     result_id = models.AutoField(primary_key=True)
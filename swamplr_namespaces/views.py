@@ -3,13 +3,18 @@ from __future__ import unicode_literals
 from models import namespace_cache, namespace_operations, namespace_jobs, namespace_objects, object_results, cache_job, \
     object_ids
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+from django.db.models import Count
 from django.shortcuts import render, redirect
 from django.conf import settings
 from django.utils import timezone
 from swamplr_jobs.views import add_job, job_status
 from apps import SwamplrNamespacesConfig
-from swamplr_jobs.models import status, jobs
-from fedora_api.api import FedoraApi
+from swamplr_jobs.models import status
+from swamplr_jobs.cancellation import CancellationToken
+from swamplr_jobs.counters import increment_counts, get_counts
+from swamplr_jobs.paging import keyset_page
+from swamplr_jobs.export import iterate_rows
+from fedora_api.api import FedoraApi, get_session
 from ezid_api.api import Ezid
 import logging
 import os
@@ -17,7 +22,7 @@ from StringIO import StringIO
 import requests
 from lxml import etree
 from rdflib.graph import Graph
-from django.db import connections
+from django.db import connections, transaction
 
 def load_namespaces(request, count=25, sort_field="count", direction="-", update_cache=True):
     """Load all namespaces from cache."""
@@ -183,31 +188,41 @@ def set_actions(ns):
 
 def get_status_info(job):
     """Required function: return info about current job for display."""
-    job_id = job.job_id
-
-    try:
-        # Get data about successes, skips, failures.
+    return get_status_info_many([job])[job.job_id], []
+
+def get_status_info_many(jobs):
+    """Return dict of job id: info for display, for a page of jobs, using a fixed number of queries."""
+    job_ids = [job.job_id for job in jobs]
+    ns_jobs = dict((n.job_id_id, n) for n in namespace_jobs.objects.filter(job_id__in=job_ids).select_related("operation_id"))
+
+    # Get data about successes, skips, failures.
+    counts = get_counts(job_ids)
+
+    info = {}
+    for job_id in job_ids:
+        if job_id not in ns_jobs:
+            logging.error("No namespace job found for job {0}.".format(job_id))
+            info[job_id] = ["No info available."]
+            continue
+        ns_job = ns_jobs[job_id]
         result_display = "<span class='label label-success'>{0} Succeeded</span> <span class='label label-danger'>{1} Failed</span>"
-        results = get_job_counts(job_id)
-        result_message = result_display.format(results["status_count"]["Success"], results["status_count"]["Failure"])
-        ns_job = namespace_jobs.objects.get(job_id=job.job_id)
-
-        if job.namespace_jobs.operation_id.operation_name in ["Mint DOI", "Mint ARK"]:
-            result_display = "<span class='label label-success'>{0} Succeeded</span> <span class='label label-danger'>{1} Failed</span> <span class='label label-default'>{2} Skipped</span>"
-            result_message = result_display.format(results["status_count"]["Success"],
-                                                   results["status_count"]["Failure"],
-                                                   results["status_count"]["Skipped"])
-
-        info = ["Process: {0} <br/>".format(ns_job.operation_id.operation_name),
-                "Namespace: {0} <br/>".format(ns_job.namespace),
-                result_message]
-
-    except Exception as e:
+        if ns_job.operation_id.operation_name in ["Mint DOI", "Mint ARK"]:
+            result_display += " <span class='label label-default'>{2} Skipped</span>"
+        result_message = result_display.format(counts[job_id]["Success"], counts[job_id]["Failure"], counts[job_id]["Skipped"])
+        info[job_id] = ["Process: {0} <br/>".format(ns_job.operation_id.operation_name),
+                        "Namespace: {0} <br/>".format(ns_job.namespace),
+                        result_message]
+    return info
 
-        info = ["No info available."]
-        logging.error(e.message)
 
-    return info, []
+def get_result_counts(jobs):
+    """Return dict of job id: {result label: count}, counted from result rows; used to rebuild job totals."""
+    job_ids = [job.job_id for job in jobs]
+    counts = dict((job_id, {}) for job_id in job_ids)
+    rows = namespace_objects.objects.filter(job_id__in=job_ids).values_list("job_id", "result_id__label").annotate(Count("pk"))
+    for job_id, label, count in rows:
+        counts[job_id][label] = count
+    return counts
 
 
 def get_job_details(job):
@@ -232,7 +247,7 @@ def list_items(request, ns, count=25):
                 "namespace": ns}
 
     pid_search_term = ns + ":*"
-    api = FedoraApi()
+    api = FedoraApi(**settings.FEDORA_SESSION)
     found_objects = api.find_all_objects(pid_search_term,
                                          fields=["pid", "label", "creator", "description", "cDate", "mDate"
                                                                                                     "date", "type"])
@@ -306,20 +321,20 @@ def run_pathauto(ns, current_job):
     status_obj = None
 
     pid_search_term = ns + ":*"
-    api = FedoraApi(username=settings.GSEARCH_USER, password=settings.GSEARCH_PASSWORD)
+    api = FedoraApi(username=settings.GSEARCH_USER, password=settings.GSEARCH_PASSWORD, **settings.FEDORA_SESSION)
     count = namespace_cache.objects.get(namespace=ns).count
     api.set_dynamic_param("maxResults", count)
     found_objects = api.find_all_objects(pid_search_term)
     logging.info("Found {0} objects to generate pathauto URLs for.".format(len(found_objects)))
 
+    cancel_token = CancellationToken(current_job.job_id)
     if len(found_objects) > 0:
         for o in found_objects:
             pid = o['pid']
             if pid is None:
                 continue
             # check if the job is still active (i.e. not cancelled by the user)
-            failure_status = jobs.objects.get(job_id=current_job.job_id).status_id.failure
-            if failure_status == "manual":
+            if cancel_token.is_cancelled():
                 messages.append("Job manually stopped by user.")
                 status_obj = status.objects.get(status="Cancelled By User")
                 break
@@ -341,12 +356,14 @@ def run_pathauto(ns, current_job):
                     messages.append("Could not create pathauto URL for {0}. Error: {1}".format(pid, e))
                 finally:
                     # Insert into job objects table
-                    namespace_objects.objects.create(
-                        job_id=current_job,
-                        completed=timezone.now(),
-                        result_id=result_id,
-                        pid=pid,
-                    )
+                    with transaction.atomic():
+                        namespace_objects.objects.create(
+                            job_id=current_job,
+                            completed=timezone.now(),
+                            result_id=result_id,
+                            pid=pid,
+                        )
+                        increment_counts(current_job, {result_id.label: 1})
 
     if status_obj is None:
         status_obj = status.objects.get(status="Complete")
@@ -356,17 +373,17 @@ def run_delete(ns, current_job):
     messages = []
     status_obj = None
     pid_search_term = ns + ":*"
-    api = FedoraApi(username=settings.GSEARCH_USER, password=settings.GSEARCH_PASSWORD)
+    api = FedoraApi(username=settings.GSEARCH_USER, password=settings.GSEARCH_PASSWORD, **settings.FEDORA_SESSION)
     count = namespace_cache.objects.get(namespace=ns).count
     api.set_dynamic_param("maxResults", count)
     found_objects = api.find_all_objects(pid_search_term)
     logging.info("Found {0} objects to delete.".format(len(found_objects)))
 
+    cancel_token = CancellationToken(current_job.job_id)
     if len(found_objects) > 0:
         for o in found_objects:
             # check if the job is still active (i.e. not cancelled by the user)
-            failure_status = jobs.objects.get(job_id=current_job.job_id).status_id.failure 
-            if failure_status == "manual":
+            if cancel_token.is_cancelled():
                 messages.append("Job manually stopped by user.")
                 status_obj = status.objects.get(status="Cancelled By User")
                 break
@@ -378,12 +395,14 @@ def run_delete(ns, current_job):
                 result = "Failure"
             result_id = object_results.objects.get(label=result)
 
-            namespace_objects.objects.create(
-                job_id=current_job,
-                completed=timezone.now(),
-                result_id=result_id,
-                pid=o["pid"],
-            )
+            with transaction.atomic():
+                namespace_objects.objects.create(
+                    job_id=current_job,
+                    completed=timezone.now(),
+                    result_id=result_id,
+                    pid=o["pid"],
+                )
+                increment_counts(current_job, {result_id.label: 1})
     if status_obj is None:
         status_obj = status.objects.get(status="Complete")
     return messages, status_obj
@@ -397,15 +416,15 @@ def run_reindex(ns, current_job):
     else:
         pid_search_term = ns + ":*"
 
-    api = FedoraApi()
+    api = FedoraApi(**settings.FEDORA_SESSION)
 
     found_objects = api.find_all_objects(pid_search_term)
     logging.info("Found {0} objects to reindex.".format(len(found_objects)))
+    cancel_token = CancellationToken(current_job.job_id)
     if len(found_objects) > 0:
         for o in found_objects:
             # check if the job is still active (i.e. not cancelled by the user)
-            failure_status = jobs.objects.get(job_id=current_job.job_id).status_id.failure 
-            if failure_status == "manual":
+            if cancel_token.is_cancelled():
                 messages.append("Job manually stopped by user.")
                 status_obj = status.objects.get(status="Cancelled By User")
                 break
@@ -417,12 +436,14 @@ def run_reindex(ns, current_job):
                 result = "Failure"
             result_id = object_results.objects.get(label=result)
 
-            namespace_objects.objects.create(
-                job_id=current_job,
-                completed=timezone.now(),
-                result_id=result_id,
-                pid=o["pid"],
-            )
+            with transaction.atomic():
+                namespace_objects.objects.create(
+                    job_id=current_job,
+                    completed=timezone.now(),
+                    result_id=result_id,
+                    pid=o["pid"],
+                )
+                increment_counts(current_job, {result_id.label: 1})
 
     if status_obj is None:
         status_obj = status.objects.get(status="Complete")
@@ -432,7 +453,13 @@ def send_reindex(pid):
     """Make call to gsearch to reindex pid."""
     gsearch_url_search = settings.GSEARCH_URL + "rest?operation=updateIndex&action=fromPid&value=" + pid
     logging.info("Reindexing pid: {0}".format(pid))
-    response = requests.get(gsearch_url_search, auth=(settings.GSEARCH_USER, settings.GSEARCH_PASSWORD))
+    # Reuse the pooled keep-alive session rather than opening a new connection per pid.
+    session = get_session(base_url=settings.GSEARCH_URL, username=settings.GSEARCH_USER,
+                          pool_connections=settings.FEDORA_SESSION["pool_connections"],
+                          pool_maxsize=settings.FEDORA_SESSION["pool_maxsize"],
+                          pool_block=settings.FEDORA_SESSION["pool_block"])
+    response = session.get(gsearch_url_search, auth=(settings.GSEARCH_USER, settings.GSEARCH_PASSWORD),
+                           timeout=settings.FEDORA_SESSION["timeout"])
 
     return response
 
@@ -493,6 +520,66 @@ def get_job_objects(job_id, job_type=None):
     return results
 
 
+def get_job_objects_page(job, after=None, limit=50, result=None, datastream=None, prefix=None):
+    """Return one page of a job's objects for the object browser.
+
+    kwargs:
+        after(str): cursor from the previous page.
+        limit(int): objects per page.
+        result(str): only objects with this result (Success, Failure or Skipped).
+        datastream(str): not used; namespace jobs have one result per object.
+        prefix(str): only pids starting with prefix.
+    returns:
+        (dict): "objects", and "next", the cursor for the following page or None.
+    """
+    rows = namespace_objects.objects.filter(job_id=job)
+    if result:
+        rows = rows.filter(result_id__label=result)
+    if prefix:
+        rows = rows.filter(pid__startswith=prefix)
+    page, next_key = keyset_page(rows.values("object_id", "pid", "completed", "result_id__label"), "object_id",
+                                 after=after, limit=limit)
+
+    operation_name = namespace_jobs.objects.select_related("operation_id").get(job_id=job).operation_id.operation_name
+    ids = {}
+    if operation_name in ["Mint DOI", "Mint ARK"]:
+        ids = dict((o["pid"], o) for o in object_ids.objects.filter(pid__in=[r["pid"] for r in page]).values())
+
+    objects = []
+    for r in page:
+        obj = {"pid": r["pid"], "completed": r["completed"], "result": r["result_id__label"], "subs": []}
+        if operation_name in ["Mint DOI", "Mint ARK"]:
+            obj["uid"] = "N/A"
+            obj["created"] = None
+            o = ids.get(r["pid"])
+            if o and operation_name == "Mint DOI" and o["doi"] is not None:
+                obj["uid"] = "https://doi.org/{0}".format(o["doi"].split(":")[1])
+                obj["created"] = o["doi_minted"]
+            elif o and operation_name == "Mint ARK" and o["ark"] is not None:
+                obj["uid"] = "https://n2t.net/{0}".format(o["ark"])
+                obj["created"] = o["ark_minted"]
+        objects.append(obj)
+
+    return {"objects": objects, "next": next_key}
+
+def get_result_querysets(job):
+    """Return querysets of every per-object result row of job, for archiving."""
+    return [namespace_objects.objects.filter(job_id=job)]
+
+def get_job_results(job, result=None):
+    """Return columns and an iterator over every per-object result row of job, for export.
+
+    kwargs:
+        result(str): only rows with this result label.
+    returns:
+        (list, iterator): column names, and rows as tuples in the same order.
+    """
+    rows = namespace_objects.objects.filter(job_id=job)
+    if result:
+        rows = rows.filter(result_id__label=result)
+    columns = ["pid", "completed", "result"]
+    return columns, iterate_rows(rows, "object_id", ["pid", "completed", "result_id__label"])
+
 def get_job_counts(job_id):
     results = {
         "status_count": {
@@ -503,13 +590,7 @@ def get_job_counts(job_id):
         "objects": []
     }
 
-    fail_id = object_results.objects.get(label="Failure").result_id
-    success_id = object_results.objects.get(label="Success").result_id
-    skip_id = object_results.objects.get(label="Skipped").result_id
-
-    results["status_count"]["Success"] = namespace_objects.objects.filter(job_id=job_id, result_id=success_id).count()
-    results["status_count"]["Skipped"] = namespace_objects.objects.filter(job_id=job_id, result_id=skip_id).count()
-    results["status_count"]["Failure"] = namespace_objects.objects.filter(job_id=job_id, result_id=fail_id).count()
+    results["status_count"] = get_counts([int(job_id)])[int(job_id)]
 
     return results
 
@@ -585,11 +666,11 @@ def run_mint_id(ns, current_job, id_type):
     messages = []
     status_obj = None
 
+    cancel_token = CancellationToken(current_job.job_id)
     if len(found_objects) > 0:
         for o in found_objects:
             # check if the job is still active (i.e. not cancelled by the user)
-            failure_status = jobs.objects.get(job_id=current_job.job_id).status_id.failure 
-            if failure_status == "manual":
+            if cancel_token.is_cancelled():
                 messages.append("Job manually stopped by user.")
                 status_obj = status.objects.get(status="Cancelled By User")
                 break
@@ -630,12 +711,14 @@ def run_mint_id(ns, current_job, id_type):
 
             result_id = object_results.objects.get(label=result)
 
-            namespace_objects.objects.create(
-                job_id=current_job,
-                completed=timezone.now(),
-                result_id=result_id,
-                pid=o["pid"],
-            )
+            with transaction.atomic():
+                namespace_objects.objects.create(
+                    job_id=current_job,
+                    completed=timezone.now(),
+                    result_id=result_id,
+                    pid=o["pid"],
+                )
+                increment_counts(current_job, {result_id.label: 1})
 
     if status_obj is None:
         status_obj = status.objects.get(status="Complete")
@@ -694,7 +777,7 @@ def add_uid_to_mods(pid, url, id_type):
         url_element.text = url
 
         tree.insert(-1, location_element)
-        api = FedoraApi(username=settings.FEDORA_USER, password=settings.FEDORA_PASSWORD)
+        api = FedoraApi(username=settings.FEDORA_USER, password=settings.FEDORA_PASSWORD, **settings.FEDORA_SESSION)
         status, response = api.update_datastream_content(
             pid,
             "MODS",
@@ -741,7 +824,7 @@ def add_uid_to_dc(pid, url, id_type):
 
         new_id_element = etree.SubElement(tree, dc_id_tag, nsmap=nsmap)
         new_id_element.text = url
-        api = FedoraApi(username=settings.FEDORA_USER, password=settings.FEDORA_PASSWORD)
+        api = FedoraApi(username=settings.FEDORA_USER, password=settings.FEDORA_PASSWORD, **settings.FEDORA_SESSION)
         status, response = api.update_datastream_content(
             pid,
             "DC",
@@ -766,7 +849,7 @@ def get_xml_datastream(pid, datastream):
 
     Returns tuple of status and datastream content.
     """
-    api = FedoraApi(username=settings.FEDORA_USER, password=settings.FEDORA_PASSWORD)
+    api = FedoraApi(username=settings.FEDORA_USER, password=settings.FEDORA_PASSWORD, **settings.FEDORA_SESSION)
     return api.get_datastream_dissemination(pid, datastream)
 
 
@@ -774,7 +857,7 @@ def get_matching_objects(ns):
     """Get all matching objects based on namespace search."""
     pid_search_term = ns + ":*"
 
-    api = FedoraApi(username=settings.FEDORA_USER, password=settings.FEDORA_PASSWORD)
+    api = FedoraApi(username=settings.FEDORA_USER, password=settings.FEDORA_PASSWORD, **settings.FEDORA_SESSION)
     count = namespace_cache.objects.filter(namespace=ns).count
     api.set_dynamic_param("maxResults", count)
 
@@ -871,7 +954,7 @@ def child_or_root_object(pid):
         "info:fedora/islandora:newspaperPageCModel",
         "info:fedora/islandora:collectionCModel"
     ]
-    api = FedoraApi(username=settings.FEDORA_USER, password=settings.FEDORA_PASSWORD)
+    api = FedoraApi(username=settings.FEDORA_USER, password=settings.FEDORA_PASSWORD, **settings.FEDORA_SESSION)
 
     status, object_profile = api.get_object_profile(pid=pid)
     cmodels = get_content_models(object_profile)
@@ -964,7 +1047,7 @@ def get_doi_data(pid):
     Resource Type
     Text/Dissertation
     """
-    api = FedoraApi(username=settings.FEDORA_USER, password=settings.FEDORA_PASSWORD)
+    api = FedoraApi(username=settings.FEDORA_USER, password=settings.FEDORA_PASSWORD, **settings.FEDORA_SESSION)
     dc_status, dc = api.get_datastream_dissemination(pid, "DC")
     mods_status, mods = api.get_datastream_dissemination(pid, "MODS")
 
@@ -999,7 +1082,7 @@ def get_ark_data(pid):
         When
         oai_dc:dc/dc:date
     """
-    api = FedoraApi(username=settings.FEDORA_USER, password=settings.FEDORA_PASSWORD)
+    api = FedoraApi(username=settings.FEDORA_USER, password=settings.FEDORA_PASSWORD, **settings.FEDORA_SESSION)
     dc_status, dc = api.get_datastream_dissemination(pid, "DC", format="xml")
     mods_status, mods = api.get_datastream_dissemination(pid, "MODS", format="xml")
 
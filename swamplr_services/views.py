@@ -191,20 +191,14 @@ def add_service(request):
 
 def get_status_info(job):
     """Required function: return info about current job for display."""
-    job_id = job.job_id
-
-    try:
-        service = service_jobs.objects.get(job_id=job_id)
-        service_info = services.objects.get(service_id=service.service_id_id)
-        label = service_info.label
-
-    # Cause of this exception would be the service being deleted from the table.
-    except:
-        label = "Not Found"
-
-    info = ["Service name: {0}".format(label)]
-
-    return info, []
+    return get_status_info_many([job])[job.job_id], []
+
+def get_status_info_many(jobs):
+    """Return dict of job id: info for display, for a page of jobs, using one query."""
+    job_ids = [job.job_id for job in jobs]
+    labels = dict(service_jobs.objects.filter(job_id__in=job_ids).values_list("job_id", "service_id__label"))
+    # Service would be missing if it was deleted from the table.
+    return dict((job_id, ["Service name: {0}".format(labels.get(job_id) or "Not Found")]) for job_id in job_ids)
 
 def get_job_details(job):
 